@@ -0,0 +1,162 @@
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict
+from config import Config
+
+# Admission control in front of the processing pipeline. Each upload reserves
+# its file count and byte size against a global and a per-client budget before
+# any work starts. Requests that do not fit wait in a bounded queue for a
+# short time; when the queue is full or the wait runs out they are turned away
+# immediately with a Retry-After hint instead of slowing every other request
+# down (and holding their documents in memory).
+
+class AdmissionRejected(Exception):
+    """Raised when an upload cannot be admitted; carries the HTTP status and retry hint"""
+
+    def __init__(self, reason: str, status: int, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+class Ticket:
+    """Capacity held by one admitted request; release it when the work is done"""
+
+    def __init__(self, controller: 'AdmissionController', client: str, files: int, nbytes: int):
+        self.controller = controller
+        self.client = client
+        self.files = files
+        self.nbytes = nbytes
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    def __init__(self, max_files: int = None, max_bytes: int = None, client_max_files: int = None,
+                 client_max_bytes: int = None, max_waiting: int = None, max_wait: float = None):
+        self.max_files = max_files if max_files is not None else Config.ADMISSION_MAX_FILES
+        self.max_bytes = max_bytes if max_bytes is not None else Config.ADMISSION_MAX_BYTES
+        self.client_max_files = client_max_files if client_max_files is not None else Config.ADMISSION_CLIENT_MAX_FILES
+        self.client_max_bytes = client_max_bytes if client_max_bytes is not None else Config.ADMISSION_CLIENT_MAX_BYTES
+        self.max_waiting = max_waiting if max_waiting is not None else Config.ADMISSION_MAX_WAITING
+        self.max_wait = max_wait if max_wait is not None else Config.ADMISSION_MAX_WAIT
+        self._cond = threading.Condition()
+        self.files = 0
+        self.nbytes = 0
+        self.requests = 0
+        self.clients: Dict[str, list] = {}  # client -> [files, bytes]
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = Counter()
+        self._hold_ewma = None  # seconds an admitted request typically holds its capacity
+
+    def _fits(self, client: str, files: int, nbytes: int) -> bool:
+        # A request bigger than a cap on its own is admitted once that pool is idle,
+        # so oversized batches run one at a time instead of never
+        used_files, used_bytes = self.clients.get(client, (0, 0))
+        global_ok = self.requests == 0 or (self.files + files <= self.max_files and self.nbytes + nbytes <= self.max_bytes)
+        client_ok = used_files == 0 or (used_files + files <= self.client_max_files and used_bytes + nbytes <= self.client_max_bytes)
+        return global_ok and client_ok
+
+    def _over_client_cap(self, client: str, files: int, nbytes: int) -> bool:
+        used_files, used_bytes = self.clients.get(client, (0, 0))
+        return used_files > 0 and (used_files + files > self.client_max_files or used_bytes + nbytes > self.client_max_bytes)
+
+    def retry_after(self) -> int:
+        hold = self._hold_ewma or Config.ADMISSION_RETRY_AFTER
+        # Roughly one typical request per slot ahead of us in the wait queue
+        return max(1, min(300, math.ceil(hold * (1 + self.waiting / max(1, self.requests)))))
+
+    def acquire(self, client: str, files: int, nbytes: int, timeout: float = None) -> Ticket:
+        """Reserve capacity for an upload, waiting briefly if needed; raises AdmissionRejected"""
+        timeout = self.max_wait if timeout is None else timeout
+        with self._cond:
+            if not self._fits(client, files, nbytes):
+                if self._over_client_cap(client, files, nbytes):
+                    # This client already has its share in flight; others are not slowed by waiting for it
+                    self.rejected['client_limit'] += 1
+                    raise AdmissionRejected('Too many uploads in progress for this client', 429, self.retry_after())
+                if self.waiting >= self.max_waiting:
+                    self.rejected['queue_full'] += 1
+                    raise AdmissionRejected('Server is busy, please retry shortly', 503, self.retry_after())
+                self.waiting += 1
+                try:
+                    if not self._cond.wait_for(lambda: self._fits(client, files, nbytes), timeout):
+                        self.rejected['wait_timeout'] += 1
+                        raise AdmissionRejected('Server is busy, please retry shortly', 503, self.retry_after())
+                finally:
+                    self.waiting -= 1
+            self.files += files
+            self.nbytes += nbytes
+            self.requests += 1
+            used = self.clients.setdefault(client, [0, 0])
+            used[0] += files
+            used[1] += nbytes
+            self.admitted += 1
+            return Ticket(self, client, files, nbytes)
+
+    def check_request(self, client: str, nbytes: int) -> None:
+        """Turn away an upload that acquire() would refuse outright, before its body is read.
+
+        Only the byte size is known before the multipart form is parsed, so the
+        request is checked as a single file; acquire() still reserves the real count.
+        """
+        with self._cond:
+            if self._over_client_cap(client, 1, nbytes):
+                self.rejected['client_limit'] += 1
+                raise AdmissionRejected('Too many uploads in progress for this client', 429, self.retry_after())
+            if not self._fits(client, 1, nbytes) and self.waiting >= self.max_waiting:
+                self.rejected['queue_full'] += 1
+                raise AdmissionRejected('Server is busy, please retry shortly', 503, self.retry_after())
+
+    def check_backlog(self, queued: int, files: int) -> None:
+        """Distributed mode: refuse new files while the task queue is deeper than its limit"""
+        if Config.TASK_QUEUE_MAX_DEPTH and queued + files > Config.TASK_QUEUE_MAX_DEPTH:
+            with self._cond:
+                self.rejected['queue_depth'] += 1
+            raise AdmissionRejected('Processing queue is full, please retry shortly', 503, Config.ADMISSION_RETRY_AFTER)
+
+    def _release(self, ticket: Ticket) -> None:
+        held = time.monotonic() - ticket.admitted_at
+        with self._cond:
+            self.files -= ticket.files
+            self.nbytes -= ticket.nbytes
+            self.requests -= 1
+            used = self.clients[ticket.client]
+            used[0] -= ticket.files
+            used[1] -= ticket.nbytes
+            if used[0] <= 0:
+                del self.clients[ticket.client]
+            self._hold_ewma = held if self._hold_ewma is None else 0.8 * self._hold_ewma + 0.2 * held
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'in_flight': {'requests': self.requests, 'files': self.files, 'bytes': self.nbytes},
+                'limits': {
+                    'max_files': self.max_files, 'max_bytes': self.max_bytes,
+                    'client_max_files': self.client_max_files, 'client_max_bytes': self.client_max_bytes,
+                    'max_waiting': self.max_waiting, 'max_wait_seconds': self.max_wait,
+                },
+                'waiting': self.waiting,
+                'clients': len(self.clients),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'avg_hold_seconds': round(self._hold_ewma, 3) if self._hold_ewma is not None else None,
+            }
+
+# Shared by the Flask and ASGI entry points within a process
+controller = AdmissionController()
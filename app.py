@@ -1,15 +1,29 @@
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, session, send_from_directory, Response
 import os
-import tempfile
-import json
+import re
+import shutil
+import threading
+import time
+import uuid
 import logging
 from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from config import Config
-from models import InvoiceData, LineItem
-from ocr_processing import ocr_pdf, ocr_image
-from llm_wrappers import _mistral_parse, _openrouter_parse, _create_invoice_extraction_prompt
-from csv_conversion import convert_invoices_to_csv, create_summary_csv
+from pipeline import TEMP_DIR, BatchStats, process_file, summary_stats
+from deadlines import DeadlineExceeded, FileBudget, job_deadline, job_deadline_at
+from provider_routing import router as provider_router
+from clients import prewarm_in_background
+from task_queue import get_queue
+from job_journal import JobJournal, entry_id, entry_key, get_state as get_journal_state, resume_incomplete_jobs
+from idempotency import get_store as get_idempotency_store, request_fingerprint, client_scope
+from admission import AdmissionRejected, controller as admission_controller
+from scheduler import classify
+from invoice_store import get_store as get_invoice_store
+from exports import IncrementalExport, iter_committed, load_manifest, read_invoices
+import serialization
+from http_cache import compress, content_etag, negotiate, precompressed, response_encodings
 
 app = Flask(
     __name__,
@@ -20,6 +34,21 @@ app = Flask(
 app.config.from_object(Config)
 app.secret_key = Config.SECRET_KEY
 
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify and request JSON through the shared serialization layer (orjson when installed)"""
+
+    def dumps(self, obj, **kwargs):
+        return serialization.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return serialization.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serialization.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,6 +61,9 @@ os.makedirs('temp_files', exist_ok=True)
 UPLOADS_TMP = 'uploads_tmp'
 os.makedirs(UPLOADS_TMP, exist_ok=True)
 
+# Open provider connections now so the first upload does not pay for TLS handshakes
+prewarm_in_background()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
@@ -42,11 +74,101 @@ def index():
 
 @app.route('/uploads_tmp/<path:filename>')
 def serve_temp_upload(filename):
-    # Serve temporary uploaded files for preview (images or PDFs)
-    return send_from_directory(UPLOADS_TMP, filename)
+    # Serve temporary uploaded files for preview (images or PDFs); conditional, so
+    # repeat views get a 304 and PDF viewers can fetch byte ranges
+    path = safe_join(UPLOADS_TMP, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'success': False, 'errors': ['Preview not found']}), 404
+    response = send_from_directory(UPLOADS_TMP, filename, etag=content_etag(path), conditional=True,
+                                   max_age=app.config['PREVIEW_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@app.after_request
+def compress_json(response):
+    # Weak content ETags (304 on repeat GETs) and gzip/brotli for JSON API responses
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or response.status_code != 200 or 'Content-Encoding' in response.headers):
+        return response
+    if request.method == 'GET':
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < app.config['COMPRESS_MIN_BYTES']:
+        return response
+    encoding = negotiate(request.headers.get('Accept-Encoding'), response_encodings())
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
+    # Refuse before request.files parses and spools the whole body
+    content_length = request.content_length or 0
+    if content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'success': False, 'errors': ['Upload too large']}), 413
+    if app.config['PROCESSING_MODE'] != 'queue':
+        try:
+            admission_controller.check_request(client_scope(request.headers, request.remote_addr), content_length)
+        except AdmissionRejected as e:
+            return admission_rejected(e)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        return idempotent_upload(idempotency_key)
+    return process_upload(uuid.uuid4().hex)
+
+def idempotent_upload(key):
+    """Run an upload at most once per (client, Idempotency-Key); retries get the original outcome"""
+    if len(key) > 255:
+        return jsonify({'success': False, 'errors': ['Idempotency-Key must be at most 255 characters']}), 400
+    store = get_idempotency_store()
+    scope = client_scope(request.headers, request.remote_addr)
+    fingerprint = request_fingerprint(request.files.getlist('files'), request.form)
+    job_id = uuid.uuid4().hex
+    record = store.claim(scope, key, fingerprint, job_id)
+    
+    if record is None:
+        # First request with this key: process it and remember the response
+        try:
+            response = app.make_response(process_upload(job_id))
+        except Exception:
+            store.release(scope, key)
+            raise
+        if response.status_code >= 400:
+            # Rejected requests are not worth replaying; let the client fix and retry
+            store.release(scope, key)
+        else:
+            store.complete(scope, key, response.status_code, response.get_data())
+        return response
+    
+    if record['fingerprint'] != fingerprint:
+        return jsonify({'success': False, 'errors': ['Idempotency-Key was already used for a different request']}), 422
+    if record['status'] != 'complete':
+        # Original request still running: wait for it, then fall back to handing out its job
+        record = store.wait_for(scope, key, app.config['IDEMPOTENCY_WAIT_SECONDS']) or record
+    if record['status'] != 'complete':
+        app.logger.info(f"Idempotent retry attached to running job {record['job_id']}")
+        return jsonify({
+            'success': True,
+            'status': 'running',
+            'job_id': record['job_id'],
+            'status_url': url_for('job_status', job_id=record['job_id'])
+        }), 202
+    
+    app.logger.info(f"Replaying stored response for job {record['job_id']}")
+    state = get_journal_state(record['job_id'])
+    if state and state['result'] and state['result'].get('temp_file_paths'):
+        # The retry may come from a fresh session; point /download at the original exports
+        session['temp_files'] = state['result']['temp_file_paths']
+    response = Response(record['response'], status=record['status_code'], mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def process_upload(job_id):
     app.logger.info("Received file upload request")
     if 'files' not in request.files:
         app.logger.warning("No files field in request")
@@ -54,243 +176,325 @@ def upload_files():
     
     files = request.files.getlist('files')
     app.logger.info(f"Number of files uploaded: {len(files)}")
-    llm_choice = request.form.get('llm_choice', 'Mistral')
-    include_detailed_csv = request.form.get('include_detailed_csv') == 'on'
-    include_summary_csv = request.form.get('include_summary_csv') == 'on'
-    confidence_threshold = request.form.get('confidence_threshold')
-    app.logger.info(f"LLM choice: {llm_choice}, Detailed CSV: {include_detailed_csv}, Summary CSV: {include_summary_csv}, Confidence: {confidence_threshold}")
+    lean = request.form.get('response_mode') == 'lean'
+    job, processing = inline_deadlines(request.form.get('deadline_seconds'))
     
     if not files or files[0].filename == '':
         app.logger.warning("Files present but first filename empty")
         return jsonify({'success': False, 'errors': ['No files selected']}), 400
     
-    all_invoices = []
+    if app.config['PROCESSING_MODE'] == 'queue':
+        return enqueue_upload(files, job_id)
+    
+    try:
+        ticket = admission_controller.acquire(client_scope(request.headers, request.remote_addr), len(files), request.content_length or 0)
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    try:
+        journal = JobJournal(job_id)
+    except Exception:
+        ticket.release()
+        raise
+    # The job id is new, so this cannot fail; holding the lock keeps the startup resumer away
+    journal.try_lock()
     errors = []
+    entries = []
+    try:
+        # Save every upload before processing so the journal can resume the whole batch
+        for index, file in enumerate(files):
+            if not (file and allowed_file(file.filename)):
+                errors.append(f"Unsupported file type: {getattr(file, 'filename', 'unknown')}")
+                continue
+            try:
+                filename = secure_filename(file.filename)
+                key = entry_id(index, filename)
+                entries.append({'id': key, 'filename': filename, 'file_path': save_upload(file, key, filename, job_id),
+                                'stage': 'saved'})
+            except Exception as e:
+                app.logger.exception(f"Error saving {getattr(file, 'filename', 'unknown')}: {e}")
+                errors.append(f"Error processing {getattr(file, 'filename', 'unknown')}: {str(e)}")
+        options = upload_options(request.form, errors)
+        journal.start(options, [{'id': e['id'], 'filename': e['filename'], 'file_path': e['file_path']}
+                                for e in entries])
+        result = run_inline_job(journal, entries, options, job, processing)
+    finally:
+        journal.close()
+        ticket.release()
     
-    for file in files:
-        if not (file and allowed_file(file.filename)):
-            errors.append(f"Unsupported file type: {getattr(file, 'filename', 'unknown')}")
+    body, temp_file_paths = finished_upload(result, entries, lean)
+    if temp_file_paths is not None:
+        # Store file paths in session for download
+        session['temp_files'] = temp_file_paths
+    return jsonify(body), 200
+
+def upload_options(form, errors):
+    """Journaled job options from an /upload form (Flask or Starlette)"""
+    options = {
+        'llm_choice': form.get('llm_choice', 'Mistral'),
+        'include_detailed_csv': form.get('include_detailed_csv') == 'on',
+        'include_summary_csv': form.get('include_summary_csv') == 'on',
+        'confidence_threshold': form.get('confidence_threshold'),
+        'errors': errors,
+    }
+    app.logger.info(f"LLM choice: {options['llm_choice']}, Detailed CSV: {options['include_detailed_csv']}, "
+                    f"Summary CSV: {options['include_summary_csv']}, Confidence: {options['confidence_threshold']}")
+    return options
+
+def inline_deadlines(requested_seconds):
+    """(job, processing) deadlines; the export share is held back for CSV/JSON generation"""
+    job = job_deadline(requested_seconds)
+    processing = job.child(job.remaining() * (1 - app.config['STAGE_BUDGET_SPLIT'].get('export', 0.0)), 'processing')
+    return job, processing
+
+def finished_upload(result, entries, lean):
+    """(response body, temp_file_paths) for a finished inline job; paths are None on failure.
+    Shared by the Flask and ASGI /upload, which only differ in how they send it."""
+    temp_file_paths = result.pop('temp_file_paths', None)
+    if not result['success']:
+        return result, None
+    # Server-side exports the page can link to via /download/<file_type>
+    result['downloads'] = sorted(temp_file_paths or {})
+    schedule_preview_cleanup([e['filename'] for e in entries])
+    # The job kept only running totals; a full response reads the invoices back from its JSONL
+    return (lean_result(result) if lean else full_result(result, temp_file_paths)), temp_file_paths
+
+def admission_rejected(e):
+    """429/503 with a Retry-After hint for an upload that could not be admitted"""
+    app.logger.warning(f"Upload rejected ({e.status}): {e.reason}")
+    response = jsonify({'success': False, 'errors': [e.reason]})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+def lean_result(result):
+    """An /upload-shaped result without invoice bodies or CSV text; pages come from /api/jobs/<id>/invoices"""
+    invoices = result.pop('invoices', None)
+    result.pop('csv_files', None)
+    if invoices is not None:
+        result['total_invoices'] = len(invoices)
+        result['invoice_ids'] = [inv.get('invoice_id') for inv in invoices]
+    result.update({'lean': True, 'invoices_url': url_for('job_invoices', job_id=result['job_id'])})
+    return result
+
+def full_result(result, temp_file_paths, directory=TEMP_DIR):
+    """The complete /upload body for a finished job, from its exports on disk"""
+    page = read_invoices(result['job_id'], directory=directory)
+    result.pop('invoice_ids', None)
+    result.pop('total_invoices', None)
+    result['invoices'] = page[1] if page else []
+    result['csv_files'] = read_csv_files(temp_file_paths)
+    return result
+
+def read_csv_files(temp_file_paths):
+    """CSV text by type, for clients of the full response"""
+    csv_files = {}
+    for kind in ('detailed', 'summary'):
+        path = (temp_file_paths or {}).get(kind)
+        if path and os.path.exists(path):
+            with open(path, newline='') as f:
+                csv_files[kind] = f.read()
+    return csv_files
+
+def invoice_summary(invoice):
+    """An invoice without its line items, for paged listings"""
+    summary = {k: v for k, v in invoice.items() if k != 'line_items'}
+    summary['line_items_count'] = len(invoice.get('line_items') or [])
+    return summary
+
+def export_directory():
+    """Where job exports live: queued jobs are exported by workers into the shared folder"""
+    return app.config['SHARED_EXPORT_FOLDER'] if app.config['PROCESSING_MODE'] == 'queue' else TEMP_DIR
+
+def load_job_invoices(job_id, offset, limit):
+    """(total, page) of a job's invoices in upload order, or None for an unknown job"""
+    page = read_invoices(job_id, offset, limit, directory=export_directory())
+    if page is not None or app.config['PROCESSING_MODE'] != 'queue':
+        return page
+    queue = get_queue()
+    job = queue.get_job(job_id)
+    if job is None:
+        return None
+    results = queue.get_results(job['task_ids'])
+    invoices = [inv for task_id in job['task_ids'] if (results.get(task_id) or {}).get('ok')
+                for inv in entry_invoices(results[task_id])]
+    return len(invoices), invoices[offset:offset + limit]
+
+def entry_invoices(entry):
+    """Invoices recorded for one file (journal entry or task result); older records hold a single 'invoice'"""
+    if 'invoices' in entry:
+        return entry['invoices']
+    return [entry['invoice']] if entry.get('invoice') is not None else []
+
+def export_file(export, entry, invoices):
+    """Append a finished file's invoices to the job's incremental exports; export problems never fail the file"""
+    try:
+        export.add(entry_key(entry), invoices)
+    except Exception as e:
+        app.logger.exception(f"Failed to append {entry['filename']} to exports: {e}")
+
+class InlineJobRun:
+    """Bookkeeping for one journaled inline job, shared by the Flask and asyncio runners.
+
+    Each file's outcome is journaled and its invoices appended to the job's
+    incremental exports as soon as it finishes; only running totals stay in
+    memory, so memory stays flat as the batch grows. Safe to call from several
+    threads at once.
+    """
+
+    def __init__(self, journal, options, job, processing=None):
+        self.journal = journal
+        self.job = job
+        self.processing = processing or job
+        self.stats = BatchStats()
+        self.invoice_ids = []
+        self.errors = list(options.get('errors', []))
+        self.timeout_reasons = []
+        # Outputs grow as files finish, so a late failure keeps everything before it
+        kinds = [k for k in ('detailed', 'summary') if options.get(f'include_{k}_csv')] + ['jsonl']
+        self.export = IncrementalExport(journal.job_id, kinds)
+        self._lock = threading.Lock()
+
+    def pending(self, entry):
+        """Whether a file still needs processing; files that are done or cannot run are recorded here"""
+        filename, file_path, stage = entry['filename'], entry['file_path'], entry.get('stage')
+        if stage == 'extracted':
+            self.file_done(entry, entry_invoices(entry))
+            return False
+        if stage == 'failed':
+            with self._lock:
+                self.errors.append(entry.get('error', f"Error processing {filename}"))
+            return False
+        if self.processing.expired():
+            # Budget exhausted: cancel the files that have not started yet
+            reason = f"Skipped {filename}: job deadline exceeded"
+            self.file_failed(entry, reason, timeout_reason=reason)
+            return False
+        if not os.path.exists(file_path):
+            self.file_failed(entry, f"Error processing {filename}: upload no longer available")
+            return False
+        return True
+
+    def file_done(self, entry, invoices):
+        with self._lock:
+            self.stats.add(invoices)
+            self.invoice_ids.extend(inv.get('invoice_id') for inv in invoices)
+        app.logger.info(f"Processed {len(invoices)} invoice(s) from {entry['filename']}")
+        export_file(self.export, entry, invoices)
+
+    def file_error(self, entry, e, budget):
+        """Record a file that raised while processing"""
+        filename = entry['filename']
+        if isinstance(e, DeadlineExceeded):
+            reason = f"Timed out processing {filename}: {e}"
+            app.logger.warning(reason)
+            self.file_failed(entry, reason, timeout_reason=reason)
+            return
+        timeout_reason = None
+        if budget.deadline.expired():
+            # Provider SDKs surface their own timeout errors once our budget runs out
+            e = DeadlineExceeded('file', budget.deadline.budget)
+            timeout_reason = f"Timed out processing {filename}: {e}"
+        app.logger.error(f"Error processing {filename}: {e}", exc_info=e)
+        self.file_failed(entry, f"Error processing {filename}: {str(e)}", timeout_reason)
+
+    def file_failed(self, entry, error, timeout_reason=None):
+        with self._lock:
+            self.errors.append(error)
+            if timeout_reason:
+                self.timeout_reasons.append(timeout_reason)
+        self.journal.file_stage(entry_key(entry), 'failed', error=error)
+
+    def finish(self):
+        """Finalize exports and the journal; the /upload-shaped result without invoice bodies"""
+        errors, timeout_reasons = self.errors, self.timeout_reasons
+        if not self.stats.invoices:
+            self.export.finish(success=False, errors=errors)
+            self.journal.complete(success=False, errors=errors)
+            return {
+                'success': False,
+                'job_id': self.journal.job_id,
+                'errors': errors or ['No invoices were successfully processed'],
+                'timed_out': bool(timeout_reasons),
+                'timeout_reasons': timeout_reasons
+            }
+        
+        # The CSV/JSONL outputs are already written; finalize them and build the raw JSON
+        exports = self.export.finish(success=True, errors=errors, job=self.job)
+        errors.extend(exports['errors'])
+        timeout_reasons.extend(exports['timeout_reasons'])
+        self.journal.complete(success=True, temp_file_paths=exports['temp_file_paths'], errors=errors)
+        
+        return {
+            'success': True,
+            'job_id': self.journal.job_id,
+            'total_invoices': self.stats.invoices,
+            'invoice_ids': self.invoice_ids,
+            'stats': self.stats.to_dict(),
+            'errors': errors,
+            'timed_out': bool(timeout_reasons),
+            'timeout_reasons': timeout_reasons,
+            'temp_file_paths': exports['temp_file_paths']
+        }
+
+def run_inline_job(journal, entries, options, job, processing=None):
+    """Process a journaled batch one file at a time, resuming each file from its last finished stage"""
+    run = InlineJobRun(journal, options, job, processing)
+    for entry in entries:
+        if not run.pending(entry):
             continue
+        filename, file_path = entry['filename'], entry['file_path']
+        budget = FileBudget(run.processing)
         try:
-            filename = secure_filename(file.filename)
-            # Save both to processing dir (existing) and temp public dir for preview
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            temp_public_path = os.path.join(UPLOADS_TMP, filename)
-            file.save(file_path)
-            try:
-                # Also save a temp public copy for UI preview
-                file.stream.seek(0)
-            except Exception:
-                pass
-            try:
-                with open(temp_public_path, 'wb') as ftmp:
-                    file.stream.seek(0)
-                    ftmp.write(file.read())
-            except Exception:
-                # If stream seek/read fails (already consumed), copy from saved file_path
-                import shutil
-                shutil.copyfile(file_path, temp_public_path)
-
-            app.logger.info(f"Saved file to {file_path} and temp preview to {temp_public_path}")
-            
-            # OCR processing
-            md = None
-            preview_url = None
-            if filename.lower().endswith('.pdf'):
-                app.logger.info(f"Processing PDF file: {filename}")
-                md, preview_url = ocr_pdf(file_path)
-            else:
-                app.logger.info(f"Processing Image file: {filename}")
-                md, preview_url = ocr_image(file_path)
-            if md is None:
-                raise ValueError("OCR returned no metadata")
-            # Persist a lightweight preview into public/previews for reliable UI preview
-            try:
-                os.makedirs(os.path.join(app.static_folder, 'previews'), exist_ok=True)
-                saved_preview_path = None
-                if isinstance(preview_url, str) and preview_url.startswith('data:image'):
-                    # data URL -> save to file
-                    import base64, re
-                    m = re.match(r'data:image/(png|jpeg|jpg);base64,(.*)', preview_url)
-                    ext = m.group(1) if m else 'png'
-                    b64 = m.group(2) if m else preview_url.split(',', 1)[-1]
-                    data = base64.b64decode(b64)
-                    safe_base = os.path.splitext(filename)[0]
-                    saved_preview_path = os.path.join(app.static_folder, 'previews', f'{safe_base}.preview.{ext}')
-                    with open(saved_preview_path, 'wb') as out:
-                        out.write(data)
-                else:
-                    # If original is an image and still exists, copy as preview
-                    if filename.lower().endswith(('.png', '.jpg', '.jpeg')) and os.path.exists(file_path):
-                        import shutil
-                        safe_base = os.path.splitext(filename)[0]
-                        ext = os.path.splitext(filename)[1].lstrip('.').lower() or 'png'
-                        saved_preview_path = os.path.join(app.static_folder, 'previews', f'{safe_base}.preview.{ext}')
-                        shutil.copyfile(file_path, saved_preview_path)
-                if saved_preview_path and os.path.exists(saved_preview_path):
-                    # Expose as /public/previews/<file>
-                    md['preview_public_url'] = '/public/previews/' + os.path.basename(saved_preview_path)
-                elif preview_url and isinstance(preview_url, str) and preview_url.startswith('data:image'):
-                    # fallback keep original data url
-                    md['preview_public_url'] = preview_url
-                else:
-                    app.logger.warning("No preview available to persist for UI")
-            except Exception as p_err:
-                app.logger.warning(f"Preview persistence failed: {p_err}")
-            
-            # LLM extraction
-            prompt = _create_invoice_extraction_prompt(md)
-            app.logger.debug(f"Prompt created, length={len(prompt) if isinstance(prompt,str) else 'n/a'}")
-            
-            invoice_data = None
-            try:
-                if llm_choice == 'Mistral':
-                    from mistralai import TextChunk, ImageURLChunk
-                    chunks = [TextChunk(text=prompt)]
-                    if preview_url and isinstance(preview_url, str) and preview_url.startswith("data:image"):
-                        chunks = [ImageURLChunk(image_url=preview_url)] + chunks
-                    invoice_data = _mistral_parse(chunks)
-                else:  # OpenRouter
-                    img_arg = preview_url if (isinstance(preview_url, str) and preview_url.startswith("data:image")) else None
-                    invoice_data = _openrouter_parse(prompt, img_arg)
-            except Exception as llm_err:
-                app.logger.exception(f"LLM extraction failed for {filename}: {llm_err}")
-                errors.append(f"LLM extraction failed for {filename}: {str(llm_err)}")
-                invoice_data = None
-            
-            # Validate and clean the extracted data
-            if not isinstance(invoice_data, dict):
-                raise ValueError("Invalid data structure returned from LLM")
-            
-            # Clean numeric fields
-            numeric_fields = ['subtotal', 'tax_amount', 'discount_amount', 'total_amount']
-            for field in numeric_fields:
-                if field in invoice_data:
-                    try:
-                        invoice_data[field] = float(invoice_data[field]) if invoice_data[field] is not None else 0.0
-                    except (ValueError, TypeError):
-                        invoice_data[field] = 0.0
-            
-            # Clean line items
-            if 'line_items' in invoice_data and isinstance(invoice_data['line_items'], list):
-                cleaned_items = []
-                for item in invoice_data['line_items']:
-                    if isinstance(item, dict):
-                        # Clean numeric fields in line items
-                        item_numeric_fields = ['quantity', 'unit_price', 'total_price', 'tax_rate']
-                        for field in item_numeric_fields:
-                            if field in item:
-                                try:
-                                    item[field] = float(item[field]) if item[field] is not None else 0.0
-                                except (ValueError, TypeError):
-                                    item[field] = 0.0
-                        cleaned_items.append(item)
-                invoice_data['line_items'] = cleaned_items
-            
-            # Add metadata
-            invoice_data['source_file'] = filename
-            # Attach preview URL preference:
-            # 1) If OCR persisted an image preview in /public -> use it
-            if isinstance(md, dict) and 'preview_public_url' in md:
-                invoice_data['preview_url'] = md['preview_public_url']
-            else:
-                # 2) Otherwise expose the temp uploaded file for UI
-                # For images, browser will render directly; for PDFs, iframe loads it.
-                invoice_data['preview_url'] = f'/uploads_tmp/{secure_filename(filename)}'
-            invoice_data['processed_at'] = datetime.now().isoformat()
-            if confidence_threshold:
-                invoice_data['confidence_threshold'] = confidence_threshold
-            
-            all_invoices.append(invoice_data)
-            app.logger.info(f"Processed invoice from {filename}")
-            
+            invoices = process_file(
+                file_path, filename, options['llm_choice'], budget,
+                confidence_threshold=options.get('confidence_threshold'),
+                preview_dir=os.path.join(app.static_folder, 'previews'),
+                checkpoint=journal.checkpoint_for(entry_key(entry)),
+                ocr_state=entry if entry.get('stage') == 'ocr' else None,
+                job_id=journal.job_id,
+            )
+            run.file_done(entry, invoices)
         except Exception as e:
-            app.logger.exception(f"Error processing {getattr(file, 'filename', 'unknown')}: {e}")
-            errors.append(f"Error processing {getattr(file, 'filename', 'unknown')}: {str(e)}")
+            run.file_error(entry, e, budget)
         finally:
-            # Clean up uploaded file
+            # Clean up uploaded file once its outcome is journaled
             try:
-                if 'file_path' in locals() and os.path.exists(file_path):
+                if os.path.exists(file_path):
                     os.remove(file_path)
             except Exception as rm_err:
                 app.logger.warning(f"Failed to remove temp file {file_path}: {rm_err}")
-            # Do NOT remove temp_public_path here; leave it for preview until end of request
-    
-    if not all_invoices:
-        return jsonify({
-            'success': False,
-            'errors': errors or ['No invoices were successfully processed']
-        }), 200
-    
-    # Generate CSV files and store them temporarily
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    csv_files = {}
-    temp_file_paths = {}
-    
-    try:
-        if include_detailed_csv:
-            detailed_df = convert_invoices_to_csv(all_invoices)
-            detailed_csv_path = f'temp_files/invoices_detailed_{timestamp}.csv'
-            detailed_df.to_csv(detailed_csv_path, index=False)
-            csv_files['detailed'] = detailed_df.to_csv(index=False)
-            temp_file_paths['detailed'] = detailed_csv_path
-    except Exception as csv_err:
-        app.logger.exception(f"Failed to generate detailed CSV: {csv_err}")
-        errors.append(f"Failed to generate detailed CSV: {str(csv_err)}")
-    
-    try:
-        if include_summary_csv:
-            summary_df = create_summary_csv(all_invoices)
-            summary_csv_path = f'temp_files/invoices_summary_{timestamp}.csv'
-            summary_df.to_csv(summary_csv_path, index=False)
-            csv_files['summary'] = summary_df.to_csv(index=False)
-            temp_file_paths['summary'] = summary_csv_path
-    except Exception as csv_err:
-        app.logger.exception(f"Failed to generate summary CSV: {csv_err}")
-        errors.append(f"Failed to generate summary CSV: {str(csv_err)}")
-    
-    # Store JSON file
+            # Do NOT remove the uploads_tmp copy here; leave it for preview until end of request
+    return run.finish()
+
+def resume_journaled_job(state, journal):
+    """Finish a job interrupted by a restart, with a fresh time budget"""
+    entries = [state['files'][name] for name in state['order']]
+    run_inline_job(journal, entries, state['options'], job_deadline())
+
+def save_upload(file, key, filename, job_id):
+    """Save an uploaded file for processing plus a temp public copy for the UI preview"""
+    # Job- and entry-prefixed so the journal can find it after a restart, and neither
+    # other jobs nor same-named files in this batch collide
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{job_id}_{key}')
+    temp_public_path = os.path.join(UPLOADS_TMP, filename)
+    file.save(file_path)
     try:
-        json_path = f'temp_files/invoices_raw_{timestamp}.json'
-        with open(json_path, 'w') as f:
-            json.dump(all_invoices, f, indent=2)
-        temp_file_paths['json'] = json_path
-    except Exception as json_err:
-        app.logger.exception(f"Failed to write raw JSON: {json_err}")
-        errors.append(f"Failed to write raw JSON: {str(json_err)}")
-    
-    # Calculate summary statistics
-    total_line_items = sum(len(inv.get('line_items', [])) for inv in all_invoices)
-    total_amount = sum(inv.get('total_amount', 0) for inv in all_invoices)
-    
-    # Store file paths in session for download
-    session['temp_files'] = temp_file_paths
-    
-    result = {
-        'success': True,
-        'invoices': all_invoices,
-        'csv_files': csv_files,
-        'stats': {
-            'total_invoices': len(all_invoices),
-            'total_line_items': total_line_items,
-            'total_amount': total_amount,
-            'average_amount': total_amount / len(all_invoices) if all_invoices else 0
-        },
-        'errors': errors
-    }
-    
-    # Schedule cleanup of temp previews once response is sent
+        with open(temp_public_path, 'wb') as ftmp:
+            file.stream.seek(0)
+            ftmp.write(file.read())
+    except Exception:
+        # If stream seek/read fails (already consumed), copy from saved file_path
+        shutil.copyfile(file_path, temp_public_path)
+    app.logger.info(f"Saved file to {file_path} and temp preview to {temp_public_path}")
+    return file_path
+
+def schedule_preview_cleanup(filenames, delay=120):
+    """Remove uploads_tmp previews once the client has had time to load them"""
+    # Immediate cleanup after building the response could race with the client
+    # loading previews, so delay it on a background thread.
     try:
-        # Note: Simple immediate cleanup after building response could race with client loading preview.
-        # We delay cleanup slightly using a background thread.
-        import threading, time
-        temp_preview_files = []
-        try:
-            temp_preview_files = [os.path.join(UPLOADS_TMP, inv.get('source_file', '')) for inv in all_invoices if inv.get('source_file')]
-        except Exception:
-            temp_preview_files = []
+        temp_preview_files = [os.path.join(UPLOADS_TMP, name) for name in filenames if name]
 
-        def delayed_cleanup(paths, delay=120):
+        def delayed_cleanup(paths):
             time.sleep(delay)
             for p in paths:
                 try:
@@ -303,11 +507,147 @@ def upload_files():
     except Exception as e:
         app.logger.warning(f"Failed to schedule temp previews cleanup: {e}")
 
-    return jsonify(result)
+def enqueue_upload(files, job_id):
+    """Distributed mode: hand each file to the task queue and return a job handle"""
+    queue = get_queue()
+    try:
+        admission_controller.check_backlog(queue.depth()['queued'], len(files))
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    os.makedirs(app.config['SHARED_UPLOAD_FOLDER'], exist_ok=True)
+    tenant = client_scope(request.headers, request.remote_addr)
+    priority = classify(request.headers.get('X-Priority') or request.form.get('priority'), len(files), tenant)
+    # One absolute deadline for the whole job, however long its tasks wait or retry
+    deadline_at = job_deadline_at(request.form.get('deadline_seconds'))
+    task_ids, filenames, errors, tasks = [], [], [], []
+    for file in files:
+        if not (file and allowed_file(file.filename)):
+            errors.append(f"Unsupported file type: {getattr(file, 'filename', 'unknown')}")
+            continue
+        filename = secure_filename(file.filename)
+        task_id = f'{job_id}-{len(task_ids)}'
+        # Task-prefixed path so neither other jobs nor same-named files in this job collide
+        file_path = os.path.join(app.config['SHARED_UPLOAD_FOLDER'], f'{task_id}_{filename}')
+        file.save(file_path)
+        shutil.copyfile(file_path, os.path.join(UPLOADS_TMP, filename))
+        tasks.append((task_id, {
+            'job_id': job_id,
+            'file_path': file_path,
+            'filename': filename,
+            'llm_choice': request.form.get('llm_choice', 'Mistral'),
+            'confidence_threshold': request.form.get('confidence_threshold'),
+            'deadline_at': deadline_at,
+            'tenant': tenant,
+            'priority': priority,
+            'size': os.path.getsize(file_path),
+        }))
+        task_ids.append(task_id)
+        filenames.append(filename)
+    job = {
+        'task_ids': task_ids,
+        'filenames': filenames,
+        'errors': errors,
+        'include_detailed_csv': request.form.get('include_detailed_csv') == 'on',
+        'include_summary_csv': request.form.get('include_summary_csv') == 'on',
+        'tenant': tenant,
+        'priority': priority,
+        'created_at': datetime.now().isoformat(),
+    }
+    if not task_ids:
+        # Nothing to process, so no worker will ever finalize it
+        job['result'] = {'success': False, 'errors': errors or ['No invoices were successfully processed'],
+                         'timed_out': False, 'timeout_reasons': []}
+    # Stored before any task can finish, so the worker with the last result finds the job
+    queue.put_job(job_id, job)
+    # Smallest documents first within the job; results are still reported in upload order
+    for task_id, payload in sorted(tasks, key=lambda t: t[1]['size']):
+        queue.enqueue(payload, task_id=task_id)
+    app.logger.info(f"Enqueued job {job_id} with {len(task_ids)} {priority} tasks")
+    return jsonify({
+        'success': True,
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'total': len(task_ids),
+        'errors': errors
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Progress of a queued job; the full /upload-shaped result once every task has finished"""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    state = get_journal_state(job_id)
+    if state is not None:
+        return journal_job_status(state)
+    if app.config['PROCESSING_MODE'] != 'queue':
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    queue = get_queue()
+    job = queue.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    result = job.get('result')
+    if result is None:
+        # A worker finalizes the job (exports included) once every task has a result
+        return jsonify({'success': True, 'status': 'running', 'job_id': job_id,
+                        'completed': queue.count_results(job['task_ids']), 'total': len(job['task_ids'])}), 200
+    schedule_job_previews_cleanup(job_id, job.get('filenames', []))
+    body = {
+        'success': result['success'],
+        'status': 'complete',
+        'job_id': job_id,
+        'errors': result['errors'],
+        'timed_out': result['timed_out'],
+        'timeout_reasons': result['timeout_reasons']
+    }
+    if not result['success']:
+        return jsonify(body), 200
+    temp_file_paths = result['temp_file_paths']
+    session['temp_files'] = temp_file_paths
+    body.update(stats=result['stats'], total_invoices=result['total_invoices'], invoice_ids=result['invoice_ids'])
+    if request.args.get('response_mode') == 'lean':
+        return jsonify(lean_result(body))
+    return jsonify(full_result(body, temp_file_paths, export_directory()))
+
+_previews_cleanup_scheduled = set()
+_previews_cleanup_lock = threading.Lock()
+
+def schedule_job_previews_cleanup(job_id, filenames):
+    """Queue mode: remove a finished job's preview copies once, on the node that saved them"""
+    with _previews_cleanup_lock:
+        if job_id in _previews_cleanup_scheduled:
+            return
+        _previews_cleanup_scheduled.add(job_id)
+    schedule_preview_cleanup(filenames)
+
+def journal_job_status(state):
+    """Status of an inline job (possibly resumed after a restart) from its journal"""
+    files = [state['files'][name] for name in state['order']]
+    done = sum(1 for f in files if f.get('stage') in ('extracted', 'failed'))
+    if not state['completed']:
+        return jsonify({'success': True, 'status': 'running', 'job_id': state['job_id'],
+                        'completed': done, 'total': len(files)}), 200
+    all_invoices = [inv for f in files if f.get('stage') == 'extracted' for inv in entry_invoices(f)]
+    result = state['result'] or {}
+    temp_file_paths = result.get('temp_file_paths') or {}
+    lean = request.args.get('response_mode') == 'lean'
+    csv_files = read_csv_files(temp_file_paths) if not lean else {}
+    if temp_file_paths:
+        session['temp_files'] = temp_file_paths
+    response = {
+        'success': bool(result.get('success')),
+        'status': 'complete',
+        'job_id': state['job_id'],
+        'invoices': all_invoices,
+        'csv_files': csv_files,
+        'stats': summary_stats(all_invoices),
+        'errors': result.get('errors', [])
+    }
+    return jsonify(lean_result(response) if lean else response)
 
 @app.route('/download/<file_type>')
 def download_file(file_type):
-    if file_type not in ['detailed', 'summary', 'json']:
+    if file_type not in ['detailed', 'summary', 'json', 'jsonl', 'detailed_parquet', 'summary_parquet', 'xlsx']:
         flash('Invalid file type')
         return redirect(url_for('index'))
     
@@ -324,19 +664,92 @@ def download_file(file_type):
         filename = os.path.basename(file_path)
         if file_type == 'json':
             mime_type = 'application/json'
+        elif file_type == 'jsonl':
+            mime_type = 'application/x-ndjson'
+        elif file_type.endswith('_parquet'):
+            mime_type = 'application/vnd.apache.parquet'
+        elif file_type == 'xlsx':
+            mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         else:
             mime_type = 'text/csv'
         
-        return send_file(
-            file_path,
+        # Stored gzip/zstd copy when the client accepts one; ranges are served from the original
+        etag = content_etag(file_path)
+        variants = {} if request.range else precompressed(file_path)
+        encoding = negotiate(request.headers.get('Accept-Encoding'), variants)
+        response = send_file(
+            variants[encoding] if encoding else file_path,
             as_attachment=True,
             download_name=filename,
-            mimetype=mime_type
+            mimetype=mime_type,
+            etag=f'{etag}.{encoding}' if encoding else etag,
+            conditional=True,
+            max_age=0
         )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        # Same URL, different file per session: always revalidate, never share
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Accept-Encoding')
+        response.vary.add('Cookie')
+        return response
     except Exception as e:
         flash(f'Error downloading file: {str(e)}')
         return redirect(url_for('index'))
 
+@app.route('/api/jobs/<job_id>/exports/<kind>')
+def job_export(job_id, kind):
+    # Committed part of a job's incremental export; usable while the job is still running
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'success': False, 'errors': ['Invalid job id']}), 400
+    manifest = load_manifest(job_id, export_directory())
+    if manifest is None:
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    if kind == 'manifest':
+        return jsonify(manifest), 200
+    output = manifest['outputs'].get(kind)
+    if output is None or not os.path.exists(output['path']):
+        return jsonify({'success': False, 'errors': [f'No {kind} export for this job']}), 404
+    mimetype = 'application/x-ndjson' if kind == 'jsonl' else 'text/csv'
+    response = Response(iter_committed(output['path'], output['bytes']), mimetype=mimetype)
+    response.headers['Content-Length'] = str(output['bytes'])
+    response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(output["path"])}'
+    response.headers['X-Export-Status'] = manifest['status']
+    return response
+
+@app.route('/api/jobs/<job_id>/invoices')
+def job_invoices(job_id):
+    # One page of a job's invoices in upload order; line items only with full=1
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', 50)), app.config['INVOICE_QUERY_MAX_LIMIT']))
+    except ValueError:
+        return jsonify({'success': False, 'errors': ['offset and limit must be integers']}), 400
+    page = load_job_invoices(job_id, offset, limit)
+    if page is None:
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    total, invoices = page
+    full = request.args.get('full') == '1'
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'invoices': [{'index': offset + i, **(inv if full else invoice_summary(inv))} for i, inv in enumerate(invoices)]
+    }), 200
+
+@app.route('/api/jobs/<job_id>/invoices/<int:index>')
+def job_invoice(job_id, index):
+    page = load_job_invoices(job_id, index, 1) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if not page or not page[1]:
+        return jsonify({'success': False, 'errors': ['Unknown invoice']}), 404
+    return jsonify({'success': True, 'invoice': {'index': index, **page[1][0]}}), 200
+
 @app.route('/api/health')
 def api_health():
     return jsonify({
@@ -344,6 +757,77 @@ def api_health():
         'time': datetime.utcnow().isoformat() + 'Z'
     }), 200
 
+@app.route('/api/queue')
+def api_queue():
+    # Task queue depth in distributed mode
+    if app.config['PROCESSING_MODE'] != 'queue':
+        return jsonify({'mode': app.config['PROCESSING_MODE']}), 200
+    return jsonify({'mode': 'queue', **get_queue().depth()}), 200
+
+@app.route('/api/admission')
+def api_admission():
+    # In-flight work, wait queue depth and rejection counts for capacity planning
+    stats = admission_controller.snapshot()
+    if app.config['PROCESSING_MODE'] == 'queue':
+        stats['task_queue'] = get_queue().depth()
+    return jsonify(stats), 200
+
+@app.route('/api/invoices')
+def api_invoices():
+    # Stored invoices across all jobs, filtered by indexed fields and keyset-paginated
+    if not app.config['INVOICE_STORE_ENABLED']:
+        return jsonify({'success': False, 'errors': ['Invoice store is disabled']}), 404
+    args = request.args
+    for name in ('date_from', 'date_to'):
+        if args.get(name) and not re.fullmatch(r'\d{4}-\d{2}-\d{2}', args[name]):
+            return jsonify({'success': False, 'errors': [f'{name} must be YYYY-MM-DD']}), 400
+    try:
+        limit = int(args.get('limit', 50))
+        cursor = int(args['cursor']) if args.get('cursor') else None
+        vendor_id = int(args['vendor_id']) if args.get('vendor_id') else None
+    except ValueError:
+        return jsonify({'success': False, 'errors': ['limit, cursor and vendor_id must be integers']}), 400
+    page = get_invoice_store().query(
+        vendor=args.get('vendor'), tax_id=args.get('tax_id'), invoice_number=args.get('invoice_number'),
+        date_from=args.get('date_from'), date_to=args.get('date_to'), source_hash=args.get('source_hash'),
+        currency=args.get('currency'), vendor_id=vendor_id, cursor=cursor, limit=limit,
+    )
+    return jsonify({'success': True, **page}), 200
+
+@app.route('/api/invoices/<int:invoice_id>')
+def api_invoice(invoice_id):
+    invoice = get_invoice_store().get(invoice_id) if app.config['INVOICE_STORE_ENABLED'] else None
+    if invoice is None:
+        return jsonify({'success': False, 'errors': ['Unknown invoice']}), 404
+    return jsonify({'success': True, 'invoice': invoice}), 200
+
+@app.route('/api/stats')
+def api_stats():
+    # Cross-batch totals per vendor, month or currency, read from the incrementally maintained rollups
+    if not app.config['INVOICE_STORE_ENABLED']:
+        return jsonify({'success': False, 'errors': ['Invoice store is disabled']}), 404
+    try:
+        rows = get_invoice_store().stats(
+            request.args.get('dimension', 'currency'), key=request.args.get('key'),
+            currency=request.args.get('currency'), limit=int(request.args.get('limit', 50)),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'errors': [str(e)]}), 400
+    return jsonify({'success': True, 'dimension': request.args.get('dimension', 'currency'), 'rows': rows}), 200
+
+@app.route('/api/routing')
+def api_routing():
+    # Rolling latency/error profile used by the "Auto" LLM choice
+    return jsonify({
+        'hedge_enabled': provider_router.hedge,
+        'ranking': provider_router.rank(),
+        'providers': provider_router.snapshot()
+    }), 200
+
+# Finish jobs a previous process was working on when it stopped
+if app.config['JOURNAL_RESUME_ON_STARTUP']:
+    threading.Thread(target=resume_incomplete_jobs, args=(resume_journaled_job,), name='journal-resume', daemon=True).start()
+
 if __name__ == '__main__':
     # Ensure folders exist before run
     try:
@@ -0,0 +1,185 @@
+# ASGI entry point: /upload runs on the asyncio pipeline, every other route is
+# served by the existing Flask app. Run with e.g. `uvicorn asgi:application`.
+# The async /upload runs the same job as the Flask one (journal, incremental
+# exports, invoice store, lean responses, Idempotency-Key handling, compressed
+# JSON); only the per-file work is concurrent. In distributed mode
+# (PROCESSING_MODE=queue) /upload is left to Flask, which enqueues the files.
+import asyncio
+import os
+import shutil
+import uuid
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+from config import Config
+from serialization import dumps_bytes
+from app import (app as flask_app, allowed_file, finished_upload, inline_deadlines, upload_options,
+                 InlineJobRun, UPLOADS_TMP)
+from async_pipeline import pipeline
+from idempotency import get_store as get_idempotency_store, request_fingerprint, client_scope
+from admission import AdmissionRejected, controller as admission_controller
+from job_journal import JobJournal, entry_id, get_state as get_journal_state
+from http_cache import compress, negotiate, response_encodings
+
+def _save_upload(upload, key: str, filename: str, job_id: str) -> str:
+    """Copy a spooled upload to the processing dir and the temp preview dir"""
+    # Job- and entry-prefixed like app.save_upload, so same-named uploads never collide
+    file_path = os.path.join(Config.UPLOAD_FOLDER, f'{job_id}_{key}')
+    upload.file.seek(0)
+    with open(file_path, 'wb') as out:
+        shutil.copyfileobj(upload.file, out)
+    shutil.copyfile(file_path, os.path.join(UPLOADS_TMP, filename))
+    return file_path
+
+def _set_flask_session(response: Response, data: dict) -> None:
+    """Write a Flask-compatible signed session cookie so /download keeps working"""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    response.set_cookie(
+        flask_app.config['SESSION_COOKIE_NAME'],
+        serializer.dumps(data),
+        httponly=True,
+        samesite=flask_app.config.get('SESSION_COOKIE_SAMESITE') or 'lax',
+        secure=bool(flask_app.config.get('SESSION_COOKIE_SECURE')),
+    )
+
+def _flask_context(request: Request):
+    # url_for in the shared response builders needs a Flask request context
+    return flask_app.test_request_context(request.url.path, base_url=str(request.base_url))
+
+def _compress(request: Request, response: Response) -> Response:
+    """gzip/brotli a JSON response, as the Flask app's after_request hook does"""
+    if response.media_type != 'application/json' or 'content-encoding' in response.headers:
+        return response
+    response.headers.append('Vary', 'Accept-Encoding')
+    if len(response.body) < Config.COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate(request.headers.get('accept-encoding'), response_encodings())
+    if encoding:
+        response.body = compress(response.body, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(response.body))
+    return response
+
+async def upload_files(request: Request):
+    return _compress(request, await _upload(request))
+
+async def _upload(request: Request):
+    content_length = int(request.headers.get('content-length') or 0)
+    if content_length > Config.MAX_CONTENT_LENGTH:
+        return JSONResponse({'success': False, 'errors': ['Upload too large']}, status_code=413)
+    # A client already at its share is refused before the form is parsed, as in the Flask /upload
+    try:
+        admission_controller.check_request(
+            client_scope(request.headers, request.client.host if request.client else None), content_length)
+    except AdmissionRejected as e:
+        return JSONResponse({'success': False, 'errors': [e.reason]}, status_code=e.status,
+                            headers={'Retry-After': str(e.retry_after)})
+    key = request.headers.get('idempotency-key')
+    if not key:
+        return await process_upload(request, uuid.uuid4().hex)
+    if len(key) > 255:
+        return JSONResponse({'success': False, 'errors': ['Idempotency-Key must be at most 255 characters']}, status_code=400)
+
+    store = get_idempotency_store()
+    scope = client_scope(request.headers, request.client.host if request.client else None)
+    form = await request.form(max_files=Config.ASYNC_MAX_FILES)
+    fingerprint = request_fingerprint(form.getlist('files'), form)
+    job_id = uuid.uuid4().hex
+    record = await asyncio.to_thread(store.claim, scope, key, fingerprint, job_id)
+    if record is None:
+        try:
+            response = await process_upload(request, job_id, form)
+        except BaseException:
+            await asyncio.to_thread(store.release, scope, key)
+            raise
+        if response.status_code >= 400:
+            await asyncio.to_thread(store.release, scope, key)
+        else:
+            await asyncio.to_thread(store.complete, scope, key, response.status_code, bytes(response.body))
+        return response
+
+    await form.close()
+    if record['fingerprint'] != fingerprint:
+        return JSONResponse({'success': False, 'errors': ['Idempotency-Key was already used for a different request']}, status_code=422)
+    if record['status'] != 'complete':
+        record = await asyncio.to_thread(store.wait_for, scope, key, Config.IDEMPOTENCY_WAIT_SECONDS) or record
+    if record['status'] != 'complete':
+        # Original request still running: hand out its job, whose status Flask serves from the journal
+        with _flask_context(request):
+            status_url = flask_app.url_for('job_status', job_id=record['job_id'])
+        return Response(dumps_bytes({'success': True, 'status': 'running', 'job_id': record['job_id'],
+                                     'status_url': status_url}), status_code=202, media_type='application/json')
+    response = Response(record['response'], status_code=record['status_code'], media_type='application/json',
+                        headers={'Idempotent-Replayed': 'true'})
+    state = await asyncio.to_thread(get_journal_state, record['job_id'])
+    if state and state['result'] and state['result'].get('temp_file_paths'):
+        # The retry may come from a fresh session; point /download at the original exports
+        _set_flask_session(response, {'temp_files': state['result']['temp_file_paths']})
+    return response
+
+async def process_upload(request: Request, job_id: str, form=None):
+    if form is None:
+        form = await request.form(max_files=Config.ASYNC_MAX_FILES)
+    try:
+        files = form.getlist('files')
+        if not files or not getattr(files[0], 'filename', ''):
+            return JSONResponse({'success': False, 'errors': ['No files selected. Make sure to select PDF/JPG/PNG files.']}, status_code=400)
+        lean = form.get('response_mode') == 'lean'
+        job, processing = inline_deadlines(form.get('deadline_seconds'))
+
+        try:
+            # Waiting for capacity blocks, so do it off the event loop
+            ticket = await asyncio.to_thread(
+                admission_controller.acquire,
+                client_scope(request.headers, request.client.host if request.client else None),
+                len(files), int(request.headers.get('content-length') or 0),
+            )
+        except AdmissionRejected as e:
+            return JSONResponse({'success': False, 'errors': [e.reason]}, status_code=e.status,
+                                headers={'Retry-After': str(e.retry_after)})
+
+        with ticket:
+            journal = await asyncio.to_thread(JobJournal, job_id)
+            try:
+                # A new job id, so this cannot fail; it keeps the startup resumer away
+                journal.try_lock()
+                errors = []
+                entries = []
+                # Save every upload before processing so the journal can resume the whole batch
+                for index, upload in enumerate(files):
+                    if not allowed_file(upload.filename or ''):
+                        errors.append(f"Unsupported file type: {upload.filename or 'unknown'}")
+                        continue
+                    filename = secure_filename(upload.filename)
+                    key = entry_id(index, filename)
+                    try:
+                        file_path = await asyncio.to_thread(_save_upload, upload, key, filename, job_id)
+                        entries.append({'id': key, 'filename': filename, 'file_path': file_path, 'stage': 'saved'})
+                    except Exception as e:
+                        errors.append(f"Error processing {upload.filename}: {str(e)}")
+                options = upload_options(form, errors)
+                await asyncio.to_thread(journal.start, options, [
+                    {'id': e['id'], 'filename': e['filename'], 'file_path': e['file_path']} for e in entries])
+                run = await asyncio.to_thread(InlineJobRun, journal, options, job, processing)
+                result = await pipeline.process_job(run, entries, options,
+                                                    preview_dir=os.path.join(flask_app.static_folder, 'previews'))
+            finally:
+                journal.close()
+    finally:
+        await form.close()
+
+    with _flask_context(request):
+        body, temp_file_paths = await asyncio.to_thread(finished_upload, result, entries, lean)
+    response = Response(dumps_bytes(body), media_type='application/json')
+    if temp_file_paths is not None:
+        _set_flask_session(response, {'temp_files': temp_file_paths})
+    return response
+
+routes = [Mount('/', app=WSGIMiddleware(flask_app))]
+if Config.PROCESSING_MODE != 'queue':
+    routes.insert(0, Route('/upload', upload_files, methods=['POST']))
+
+application = Starlette(routes=routes)
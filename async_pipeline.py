@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+from ocr_processing import ocr_file_pages_async, ocr_pdf_pages
+from invoice_splitting import page_range_label
+from preflight import cleanup as preflight_cleanup, page_chunks, preflight
+from llm_wrappers import _extract_with_provider_async, _create_invoice_extraction_prompt
+from provider_routing import router as provider_router
+from pipeline import (PREVIEW_DIR, persist_preview, clean_invoice_data, finalize_invoice, invoice_groups,
+                      find_duplicate, index_document, duplicate_note, page_image_hash, store_invoices,
+                      resolve_entities, extraction_error)
+from deadlines import DeadlineExceeded, FileBudget
+from job_journal import entry_key
+
+logger = logging.getLogger(__name__)
+
+class AsyncPipeline:
+    """Asyncio execution engine for the upload pipeline.
+
+    Every document is a coroutine rather than a thread, so one process can keep
+    hundreds of OCR/LLM waits in flight. Bounded semaphores cap concurrent calls
+    per provider (Config.ASYNC_PROVIDER_CONCURRENCY).
+    """
+
+    def __init__(self, limits: Dict[str, int] = None):
+        self.limits = dict(limits or Config.ASYNC_PROVIDER_CONCURRENCY)
+        self._semaphores: Dict[Tuple[int, str], asyncio.Semaphore] = {}
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        # Semaphores belong to the loop they are first awaited on
+        key = (id(asyncio.get_running_loop()), name)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.BoundedSemaphore(self.limits.get(name, 16))
+        return self._semaphores[key]
+
+    async def _ocr(self, file_path: str, deadline, report=None) -> Tuple[List[str], str]:
+        if report is not None and report.action == 'local_text':
+            return report.page_texts, None
+        async with self._semaphore('ocr'):
+            if report is not None and report.action == 'split':
+                # Parallel page-range calls run on threads with the sync client
+                return await asyncio.to_thread(ocr_pdf_pages, file_path, deadline, page_chunks(report.pages))
+            if report is not None:
+                return await ocr_file_pages_async(report.ocr_path or file_path, deadline=deadline, mime=report.mime)
+            return await ocr_file_pages_async(file_path, deadline=deadline)
+
+    async def _call(self, provider: str, prompt: str, preview_url, deadline,
+                    abandoned: asyncio.Event = None) -> Dict[str, Any]:
+        """Bounded provider call that feeds the shared latency profile used by 'Auto'"""
+        stats = provider_router.stats_for(provider)
+        async with self._semaphore(provider):
+            start = time.monotonic()
+            try:
+                result = await _extract_with_provider_async(provider, prompt, preview_url, deadline)
+            except asyncio.CancelledError:
+                if abandoned is not None and abandoned.is_set():
+                    # A cancelled hedge loser took at least this long; sampling that lower
+                    # bound keeps the slow tail (and so the hedge delay) from drifting down
+                    stats.record(time.monotonic() - start, True)
+                    stats.record_abandoned()
+                raise
+            except Exception:
+                if deadline is None or not deadline.expired():
+                    stats.record(time.monotonic() - start, False)
+                raise
+            stats.record(time.monotonic() - start, True)
+        if isinstance(result, dict):
+            result.setdefault('llm_provider', provider)
+        return result
+
+    async def _extract_auto(self, prompt: str, preview_url, deadline) -> Dict[str, Any]:
+        """Async counterpart of ProviderRouter.extract: best provider first, hedged past its p95"""
+        ranked = provider_router.rank()
+        if not ranked:
+            raise RuntimeError("No LLM provider API key configured")
+        primary, backup = ranked[0], (ranked[1] if len(ranked) > 1 else None)
+        # Set only once a call wins, so budget timeouts cancelling both are not counted as hedge losses
+        abandoned = asyncio.Event()
+        tasks = {asyncio.ensure_future(self._call(primary, prompt, preview_url, deadline, abandoned))}
+        hedge_delay = provider_router._hedge_delay(primary) if (backup and provider_router.hedge) else None
+        hedged = False
+        try:
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done and provider_router.stats_for(backup).healthy():
+                    tasks.add(asyncio.ensure_future(self._call(backup, prompt, preview_url, deadline, abandoned)))
+                    hedged = True
+            last_error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        abandoned.set()
+                        return task.result()
+                    last_error = task.exception()
+            if backup and not hedged and not (deadline and deadline.expired()):
+                return await self._call(backup, prompt, preview_url, deadline)
+            raise last_error
+        finally:
+            # The loser of a hedge is cancelled rather than left running
+            for task in tasks:
+                task.cancel()
+
+    async def extract(self, llm_choice: str, prompt: str, preview_url, deadline=None) -> Dict[str, Any]:
+        if llm_choice == 'Auto':
+            return await self._extract_auto(prompt, preview_url, deadline)
+        provider = 'Mistral' if llm_choice == 'Mistral' else 'OpenRouter'
+        return await self._call(provider, prompt, preview_url, deadline)
+
+    async def _extract_group(self, md: str, filename: str, llm_choice: str, preview_url, extraction_deadline,
+                             phash: Optional[int] = None) -> Dict[str, Any]:
+        duplicate = await asyncio.to_thread(find_duplicate, md, phash)
+        if duplicate is not None:
+            logger.info(f"{filename} is a near-duplicate of {duplicate['source_file']} "
+                        f"({duplicate['kind']} similarity {duplicate['similarity']})")
+            if duplicate['reusable'] and Config.DEDUP_REUSE:
+                invoice_data = duplicate['invoice']
+                invoice_data['near_duplicate'] = duplicate_note(duplicate, reused=True)
+                return invoice_data
+
+        prompt = _create_invoice_extraction_prompt(md)
+        try:
+            invoice_data = await self.extract(llm_choice, prompt, preview_url, extraction_deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as llm_err:
+            if extraction_deadline.expired():
+                raise DeadlineExceeded('extraction', extraction_deadline.budget) from llm_err
+            logger.exception(f"LLM extraction failed for {filename}: {llm_err}")
+            raise extraction_error(filename, llm_err) from llm_err
+        invoice_data = await asyncio.to_thread(resolve_entities, clean_invoice_data(invoice_data))
+        await asyncio.to_thread(index_document, md, invoice_data, phash, filename)
+        if duplicate is not None:
+            invoice_data['near_duplicate'] = duplicate_note(duplicate, reused=False)
+        return invoice_data
+
+    async def process_file(self, file_path: str, filename: str, llm_choice: str, budget: FileBudget,
+                           confidence_threshold=None, preview_dir: str = PREVIEW_DIR,
+                           checkpoint=None, job_id: str = None) -> List[Dict[str, Any]]:
+        """Async counterpart of pipeline.process_file (a resumed job is finished by the sync pipeline)"""
+        report = await asyncio.to_thread(preflight, file_path, filename) if Config.PREFLIGHT_ENABLED else None
+        try:
+            md_pages, preview_url = await self._ocr(file_path, budget.stage('ocr'), report)
+            preview_source = report.ocr_path if report is not None and report.ocr_path else file_path
+            preview_public_url = await asyncio.to_thread(persist_preview, filename, preview_source, preview_url, preview_dir)
+        finally:
+            preflight_cleanup(report)
+        if checkpoint:
+            await asyncio.to_thread(checkpoint, 'ocr', {'md_pages': md_pages, 'preview_public_url': preview_public_url})
+        groups = invoice_groups(md_pages)
+        texts = ["\n\n".join(md_pages[i] or '' for i in group) for group in groups]
+        del md_pages
+
+        # Invoices split out of one PDF are extracted concurrently, bounded by the provider semaphores
+        extraction_deadline = budget.stage('extraction')
+        phash = await asyncio.to_thread(page_image_hash, file_path, filename) if len(groups) == 1 else None
+        invoices = await asyncio.gather(
+            *(self._extract_group(md, filename, llm_choice, preview_url, extraction_deadline, phash) for md in texts))
+        for index, (invoice_data, group) in enumerate(zip(invoices, groups)):
+            finalize_invoice(invoice_data, filename, preview_public_url, confidence_threshold)
+            invoice_data['source_pages'] = page_range_label(group) if group else None
+            if len(groups) > 1:
+                invoice_data['invoice_index'] = index + 1
+        invoices = list(invoices)
+        await asyncio.to_thread(store_invoices, invoices, file_path, filename, None, job_id)
+        if checkpoint:
+            await asyncio.to_thread(checkpoint, 'extracted', {'invoices': invoices})
+        return invoices
+
+    async def _run_entry(self, run, entry: Dict[str, Any], options: Dict[str, Any], preview_dir: str,
+                         slots: asyncio.Semaphore) -> None:
+        filename, file_path = entry['filename'], entry['file_path']
+        # The file's budget starts when it gets a slot, as in the sync runner, so files
+        # queued behind the rest of the batch are not timed out before they start
+        async with slots:
+            if not await asyncio.to_thread(run.pending, entry):
+                return
+            budget = FileBudget(run.processing)
+            try:
+                # wait_for cancels the in-flight provider call when the file budget runs out
+                invoices = await asyncio.wait_for(
+                    self.process_file(file_path, filename, options['llm_choice'], budget,
+                                      confidence_threshold=options.get('confidence_threshold'),
+                                      preview_dir=preview_dir,
+                                      checkpoint=run.journal.checkpoint_for(entry_key(entry)),
+                                      job_id=run.journal.job_id),
+                    timeout=max(0.001, budget.deadline.remaining()),
+                )
+            except DeadlineExceeded as e:
+                await asyncio.to_thread(run.file_error, entry, e, budget)
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(run.file_error, entry, DeadlineExceeded('file', budget.deadline.budget), budget)
+            except Exception as e:
+                await asyncio.to_thread(run.file_error, entry, e, budget)
+            else:
+                await asyncio.to_thread(run.file_done, entry, invoices)
+            finally:
+                try:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                except Exception as rm_err:
+                    logger.warning(f"Failed to remove temp file {file_path}: {rm_err}")
+
+    async def process_job(self, run, entries: List[Dict[str, Any]], options: Dict[str, Any],
+                          preview_dir: str = PREVIEW_DIR) -> Dict[str, Any]:
+        """Process a journaled batch concurrently; returns run.finish().
+
+        `run` is the app.InlineJobRun the Flask /upload uses, so both entry points
+        journal, export and report a job the same way. At most the 'files' limit of
+        them run at once; files are exported in the order they finish rather than
+        upload order.
+        """
+        slots = asyncio.Semaphore(self.limits.get('files', self.limits.get('ocr', 16)))
+        await asyncio.gather(*(self._run_entry(run, entry, options, preview_dir, slots) for entry in entries))
+        return await asyncio.to_thread(run.finish)
+
+pipeline = AsyncPipeline()
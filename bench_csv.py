@@ -0,0 +1,81 @@
+import argparse
+import io
+import random
+import time
+import tracemalloc
+from csv_conversion import convert_invoices_to_csv, create_summary_csv, write_csv
+
+# Benchmark: streaming CSV writer vs the pandas DataFrame path.
+#   python bench_csv.py --invoices 5000 --items 20
+# Builds a synthetic batch, writes both exports each way, checks the output is
+# byte-identical and reports wall time and peak Python memory (tracemalloc).
+# tests/test_csv_conversion.py asserts the byte-for-byte match.
+
+def synthetic_invoices(count: int, items: int, seed: int = 1):
+    rnd = random.Random(seed)
+    invoices = []
+    for i in range(count):
+        line_items = [{
+            'description': f'Item {j} "standard", size {rnd.randint(1, 9)}',
+            'quantity': float(rnd.randint(1, 20)),
+            'unit_price': round(rnd.random() * 100, 2),
+            'total_price': round(rnd.random() * 1000, 2),
+            'unit': rnd.choice(['each', 'kg', 'hours', None]),
+            'sku': f'SKU-{rnd.randint(1000, 9999)}',
+            'tax_rate': rnd.choice([0.0, 5.0, 18.0]),
+        } for j in range(rnd.randint(0, items * 2))]
+        invoices.append({
+            'invoice_number': f'INV-{i:06d}', 'invoice_date': '2024-03-01', 'due_date': None,
+            'vendor_name': f'Vendor {i % 97}, Ltd', 'vendor_address': '1 Main St\nSpringfield',
+            'vendor_phone': None, 'vendor_email': 'ap@example.com', 'vendor_tax_id': None,
+            'customer_name': 'Globex', 'customer_address': None, 'customer_phone': None, 'customer_email': None,
+            'subtotal': round(rnd.random() * 10000, 2), 'tax_amount': round(rnd.random() * 1000, 2),
+            'discount_amount': 0.0, 'total_amount': round(rnd.random() * 11000, 2), 'currency': 'USD',
+            'payment_terms': 'Net 30', 'notes': None, 'gst_number': None, 'line_items': line_items,
+        })
+    return invoices
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def pandas_path(invoices):
+    # What the exports used to do: DataFrame, then CSV text
+    return {
+        'detailed': convert_invoices_to_csv(invoices).to_csv(index=False),
+        'summary': create_summary_csv(invoices).to_csv(index=False),
+    }
+
+def streaming_path(invoices):
+    out = {}
+    for kind in ('detailed', 'summary'):
+        buf = io.StringIO()
+        write_csv(kind, invoices, buf)
+        out[kind] = buf.getvalue()
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CSV export paths')
+    parser.add_argument('--invoices', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=10, help='Average line items per invoice')
+    args = parser.parse_args()
+
+    invoices = synthetic_invoices(args.invoices, args.items)
+    rows = sum(max(1, len(inv['line_items'])) for inv in invoices)
+    print(f"{args.invoices} invoices, {rows} detailed rows")
+    expected, t_pd, m_pd = measure(lambda: pandas_path(invoices))
+    actual, t_st, m_st = measure(lambda: streaming_path(invoices))
+    for kind in ('detailed', 'summary'):
+        status = 'identical' if expected[kind] == actual[kind] else 'DIFFERENT'
+        print(f"  {kind}: {len(expected[kind])} bytes, {status}")
+    # Both paths hold the finished CSV text here; the difference is the intermediate rows/DataFrame
+    print(f"  pandas:    {t_pd:.3f}s, peak {m_pd / 2**20:.1f} MiB")
+    print(f"  streaming: {t_st:.3f}s, peak {m_st / 2**20:.1f} MiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import io
+import json
+import time
+from bench_csv import synthetic_invoices
+from csv_conversion import write_csv
+from models import InvoiceData
+from serialization import dumps_bytes, orjson
+
+# Benchmark: the old JSON paths vs the serialization layer.
+#   python bench_serialization.py --invoices 2000 --items 10
+# Covers the three hot spots: turning a parsed LLM result into a dict, writing
+# the raw invoices JSON, and encoding the /upload response body. Reports wall
+# time (best of --repeat) and output size.
+
+def best_of(fn, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def report(label: str, old, new, repeat: int) -> None:
+    old_out, t_old = best_of(old, repeat)
+    new_out, t_new = best_of(new, repeat)
+    sizes = f", {len(old_out)} -> {len(new_out)} bytes" if isinstance(old_out, (bytes, str)) else ''
+    print(f"  {label}: {t_old * 1000:.1f} ms -> {t_new * 1000:.1f} ms ({t_old / t_new:.1f}x){sizes}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON serialization paths')
+    parser.add_argument('--invoices', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=10, help='Average line items per invoice')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    invoices = synthetic_invoices(args.invoices, args.items)
+    parsed = [InvoiceData(**inv) for inv in invoices]
+    csv_files = {}
+    for kind in ('detailed', 'summary'):
+        buf = io.StringIO()
+        write_csv(kind, invoices, buf)
+        csv_files[kind] = buf.getvalue()
+    response = {'success': True, 'invoices': invoices, 'csv_files': csv_files, 'errors': []}
+    print(f"{args.invoices} invoices, encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+
+    report('LLM result to dict', lambda: [json.loads(p.model_dump_json()) for p in parsed],
+           lambda: [p.model_dump(mode='json') for p in parsed], args.repeat)
+    report('raw invoices JSON', lambda: json.dumps(invoices, indent=2).encode('utf-8'),
+           lambda: dumps_bytes(invoices), args.repeat)
+    # Flask's default provider: sorted keys, compact separators
+    report('/upload response', lambda: json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8'),
+           lambda: dumps_bytes(response), args.repeat)
+
+if __name__ == '__main__':
+    main()
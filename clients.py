@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+import httpx
+from mistralai import Mistral
+from openai import AsyncOpenAI, OpenAI
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Lazily created, pooled provider clients shared by OCR and extraction.
+# Keyed by provider name; reset in forked children (gunicorn --preload) so a
+# worker never reuses sockets or locks inherited from the parent process.
+_clients = {}
+_http_clients = {}
+# Async clients are bound to the event loop that created their connection pool
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_pid = os.getpid()
+
+PREWARM_URLS = {
+    'mistral': Config.MISTRAL_SERVER_URL,
+    'openrouter': Config.OPENROUTER_BASE_URL,
+}
+
+def _http2_enabled() -> bool:
+    if not Config.HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx needs the optional h2 package for HTTP/2)
+        return True
+    except ImportError:
+        logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed; using HTTP/1.1")
+        return False
+
+def _http_options() -> dict:
+    return dict(
+        limits=httpx.Limits(
+            max_connections=Config.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(Config.HTTP_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+        http2=_http2_enabled(),
+    )
+
+def _new_http_client() -> httpx.Client:
+    """httpx client with the configured pool size, keep-alive and timeouts"""
+    return httpx.Client(**_http_options())
+
+def _check_fork() -> None:
+    global _pid
+    if os.getpid() != _pid:
+        _reset_after_fork()
+
+def _reset_after_fork() -> None:
+    """Drop inherited clients without closing them; the parent still owns those sockets"""
+    global _lock, _pid
+    _lock = threading.Lock()
+    _clients.clear()
+    _http_clients.clear()
+    _async_clients.clear()
+    _pid = os.getpid()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _build(provider: str):
+    http = _new_http_client()
+    if provider == 'mistral':
+        client = Mistral(api_key=Config.MISTRAL_API_KEY, server_url=Config.MISTRAL_SERVER_URL, client=http)
+    elif provider == 'openrouter':
+        client = OpenAI(
+            base_url=Config.OPENROUTER_BASE_URL,
+            api_key=Config.OPENROUTER_API_KEY,
+            http_client=http,
+            max_retries=Config.HTTP_MAX_RETRIES,
+        )
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+    return client, http
+
+def _api_key(provider: str):
+    return {'mistral': Config.MISTRAL_API_KEY, 'openrouter': Config.OPENROUTER_API_KEY}.get(provider)
+
+def get_client(provider: str):
+    """Return the shared client for a provider, or None if its API key is not configured"""
+    if not _api_key(provider):
+        return None
+    _check_fork()
+    client = _clients.get(provider)
+    if client is not None:
+        return client
+    with _lock:
+        if provider not in _clients:
+            _clients[provider], _http_clients[provider] = _build(provider)
+        return _clients[provider]
+
+def get_mistral_client():
+    return get_client('mistral')
+
+def get_openrouter_client():
+    return get_client('openrouter')
+
+def get_async_client(provider: str):
+    """Return the async client for a provider on the running event loop, or None if not configured"""
+    if not _api_key(provider):
+        return None
+    _check_fork()
+    loop = asyncio.get_running_loop()
+    per_loop = _async_clients.setdefault(loop, {})
+    if provider not in per_loop:
+        http = httpx.AsyncClient(**_http_options())
+        if provider == 'mistral':
+            per_loop[provider] = Mistral(api_key=Config.MISTRAL_API_KEY, server_url=Config.MISTRAL_SERVER_URL, async_client=http)
+        elif provider == 'openrouter':
+            per_loop[provider] = AsyncOpenAI(
+                base_url=Config.OPENROUTER_BASE_URL,
+                api_key=Config.OPENROUTER_API_KEY,
+                http_client=http,
+                max_retries=Config.HTTP_MAX_RETRIES,
+            )
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
+    return per_loop[provider]
+
+def prewarm(providers=None) -> None:
+    """Open pooled connections (DNS + TCP + TLS) ahead of the first real call"""
+    def warm(provider, http):
+        try:
+            # Any response will do; we only want the connection in the pool
+            http.head(PREWARM_URLS[provider], timeout=Config.HTTP_CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Prewarm of {provider} connection failed: {e}")
+
+    threads = []
+    for provider in providers or PREWARM_URLS:
+        if get_client(provider) is None:
+            continue
+        http = _http_clients.get(provider)
+        # Concurrent requests, otherwise keep-alive would reuse a single connection
+        for _ in range(max(1, Config.HTTP_PREWARM_CONNECTIONS)):
+            t = threading.Thread(target=warm, args=(provider, http), daemon=True)
+            t.start()
+            threads.append(t)
+    for t in threads:
+        t.join()
+
+def prewarm_in_background() -> None:
+    if Config.HTTP_PREWARM:
+        threading.Thread(target=prewarm, name='client-prewarm', daemon=True).start()
+
+def close_all() -> None:
+    with _lock:
+        for http in _http_clients.values():
+            try:
+                http.close()
+            except Exception:
+                pass
+        _clients.clear()
+        _http_clients.clear()
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -14,4 +15,137 @@ class Config:
     # LLM Settings
     DEFAULT_MODEL = "pixtral-12b-latest"
     OPENROUTER_MODEL = "google/gemini-flash-1.5"
-    OCR_MODEL = "mistral-ocr-latest"
\ No newline at end of file
+    OCR_MODEL = "mistral-ocr-latest"
+    
+    # Provider routing ("Auto" LLM choice)
+    LLM_ROUTING_WINDOW = int(os.environ.get('LLM_ROUTING_WINDOW', 50))  # calls kept per provider/model
+    LLM_ROUTING_MIN_SAMPLES = int(os.environ.get('LLM_ROUTING_MIN_SAMPLES', 5))
+    LLM_UNHEALTHY_ERROR_RATE = float(os.environ.get('LLM_UNHEALTHY_ERROR_RATE', 0.5))
+    LLM_UNHEALTHY_COOLDOWN = float(os.environ.get('LLM_UNHEALTHY_COOLDOWN', 30))  # seconds
+    LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'true').lower() == 'true'
+    LLM_HEDGE_MAX_WORKERS = int(os.environ.get('LLM_HEDGE_MAX_WORKERS', 8))
+    
+    # Time budgets (seconds). A job's remaining time is shared by its files;
+    # each file's budget is split across stages in these proportions.
+    JOB_DEADLINE_SECONDS = float(os.environ.get('JOB_DEADLINE_SECONDS', 600))
+    MAX_JOB_DEADLINE_SECONDS = float(os.environ.get('MAX_JOB_DEADLINE_SECONDS', 3600))
+    MIN_JOB_DEADLINE_SECONDS = float(os.environ.get('MIN_JOB_DEADLINE_SECONDS', 10))
+    FILE_DEADLINE_SECONDS = float(os.environ.get('FILE_DEADLINE_SECONDS', 180))
+    STAGE_BUDGET_SPLIT = {'ocr': 0.45, 'extraction': 0.45, 'export': 0.10}
+    
+    # Provider HTTP clients (shared pool per provider, see clients.py)
+    MISTRAL_SERVER_URL = os.environ.get('MISTRAL_SERVER_URL', 'https://api.mistral.ai')
+    OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+    HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', 50))
+    HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 60))
+    HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 120))
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+    HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', 'false').lower() == 'true'
+    HTTP_PREWARM = os.environ.get('HTTP_PREWARM', 'true').lower() == 'true'
+    HTTP_PREWARM_CONNECTIONS = int(os.environ.get('HTTP_PREWARM_CONNECTIONS', 2))
+    
+    # Async pipeline (asgi.py): max concurrent calls per provider within one process
+    ASYNC_PROVIDER_CONCURRENCY = {
+        'ocr': int(os.environ.get('ASYNC_OCR_CONCURRENCY', 32)),
+        'Mistral': int(os.environ.get('ASYNC_MISTRAL_CONCURRENCY', 32)),
+        'OpenRouter': int(os.environ.get('ASYNC_OPENROUTER_CONCURRENCY', 32)),
+        'files': int(os.environ.get('ASYNC_FILE_CONCURRENCY', 32)),  # files in flight per job
+    }
+    ASYNC_MAX_FILES = int(os.environ.get('ASYNC_MAX_FILES', 1000))
+    
+    # CPU pool for base64/CSV work (0 workers = run inline on the calling thread)
+    CPU_POOL_WORKERS = int(os.environ.get('CPU_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+    CPU_POOL_START_METHOD = os.environ.get('CPU_POOL_START_METHOD', 'spawn')  # fork is unsafe with threads
+    CPU_POOL_MIN_BYTES = int(os.environ.get('CPU_POOL_MIN_BYTES', 256 * 1024))  # smaller inputs run inline
+    
+    # Distributed worker mode: PROCESSING_MODE='queue' makes /upload enqueue
+    # files for worker.py instead of processing them in the web process.
+    PROCESSING_MODE = os.environ.get('PROCESSING_MODE', 'inline')
+    TASK_QUEUE_URL = os.environ.get('TASK_QUEUE_URL', 'sqlite:///data/task_queue.db')
+    SHARED_UPLOAD_FOLDER = os.environ.get('SHARED_UPLOAD_FOLDER', 'uploads_shared')  # must be visible to workers
+    SHARED_EXPORT_FOLDER = os.environ.get('SHARED_EXPORT_FOLDER', 'temp_files')  # queued jobs' exports; must be visible to web nodes
+    TASK_VISIBILITY_TIMEOUT = float(os.environ.get('TASK_VISIBILITY_TIMEOUT', 300))
+    TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 3))
+    TASK_RESULT_TTL = int(os.environ.get('TASK_RESULT_TTL', 7 * 24 * 3600))
+    
+    # Crash-safe job journal (job_journal.py)
+    JOURNAL_DIR = os.environ.get('JOURNAL_DIR', os.path.join('data', 'journal'))
+    JOURNAL_RESUME_ON_STARTUP = os.environ.get('JOURNAL_RESUME_ON_STARTUP', 'true').lower() == 'true'
+    JOURNAL_RETENTION_DAYS = float(os.environ.get('JOURNAL_RETENTION_DAYS', 7))
+    
+    # Idempotency-Key support on /upload (idempotency.py)
+    IDEMPOTENCY_DB = os.environ.get('IDEMPOTENCY_DB', os.path.join('data', 'idempotency.db'))
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 30))  # how long a retry waits on the original
+    
+    # Admission control (admission.py): caps on work in flight per process
+    ADMISSION_MAX_FILES = int(os.environ.get('ADMISSION_MAX_FILES', 200))
+    ADMISSION_MAX_BYTES = int(os.environ.get('ADMISSION_MAX_BYTES', 512 * 1024 * 1024))
+    ADMISSION_CLIENT_MAX_FILES = int(os.environ.get('ADMISSION_CLIENT_MAX_FILES', 100))
+    ADMISSION_CLIENT_MAX_BYTES = int(os.environ.get('ADMISSION_CLIENT_MAX_BYTES', 256 * 1024 * 1024))
+    ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 16))  # requests allowed to wait for capacity
+    ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 10))  # seconds before a waiting request gets a 503
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 30))  # Retry-After hint before timings are known
+    TASK_QUEUE_MAX_DEPTH = int(os.environ.get('TASK_QUEUE_MAX_DEPTH', 0))  # queue mode: refuse uploads past this backlog (0 = unlimited)
+    
+    # Fair scheduling of queued tasks (scheduler.py)
+    SCHEDULER_CLASS_WEIGHTS = {
+        'interactive': float(os.environ.get('SCHEDULER_INTERACTIVE_WEIGHT', 8)),
+        'batch': float(os.environ.get('SCHEDULER_BATCH_WEIGHT', 1)),
+    }
+    SCHEDULER_TENANT_WEIGHTS = json.loads(os.environ.get('SCHEDULER_TENANT_WEIGHTS') or '{}')  # {"<client scope>": weight}
+    SCHEDULER_INTERACTIVE_MAX_FILES = int(os.environ.get('SCHEDULER_INTERACTIVE_MAX_FILES', 5))  # larger uploads are batch unless the tenant is trusted
+    SCHEDULER_TRUSTED_TENANTS = json.loads(os.environ.get('SCHEDULER_TRUSTED_TENANTS') or '[]')  # ["<client scope>"] allowed to ask for interactive at any size
+    SCHEDULER_BYTES_PER_PAGE = int(os.environ.get('SCHEDULER_BYTES_PER_PAGE', 200 * 1024))  # cost estimate before page counts are known
+    
+    # Preflight inspection before OCR (preflight.py)
+    PREFLIGHT_ENABLED = os.environ.get('PREFLIGHT_ENABLED', 'true').lower() == 'true'
+    PREFLIGHT_MAX_PAGES = int(os.environ.get('PREFLIGHT_MAX_PAGES', 100))  # longer PDFs are rejected
+    PREFLIGHT_SPLIT_PAGES = int(os.environ.get('PREFLIGHT_SPLIT_PAGES', 20))  # longer PDFs are OCR'd in chunks of this size
+    PREFLIGHT_LOCAL_TEXT = os.environ.get('PREFLIGHT_LOCAL_TEXT', 'true').lower() == 'true'  # use an existing text layer instead of OCR
+    PREFLIGHT_MIN_TEXT_CHARS = int(os.environ.get('PREFLIGHT_MIN_TEXT_CHARS', 200))  # per page, for a text layer to count
+    PREFLIGHT_MAX_IMAGE_SIDE = int(os.environ.get('PREFLIGHT_MAX_IMAGE_SIDE', 3000))  # larger images are downscaled
+    PREFLIGHT_MIN_IMAGE_SIDE = int(os.environ.get('PREFLIGHT_MIN_IMAGE_SIDE', 32))
+    OCR_CHUNK_CONCURRENCY = int(os.environ.get('OCR_CHUNK_CONCURRENCY', 4))  # parallel page-range OCR calls per split PDF
+
+    # Multi-invoice PDFs
+    INVOICE_SPLIT_ENABLED = os.environ.get('INVOICE_SPLIT_ENABLED', 'true').lower() == 'true'
+    INVOICE_SPLIT_CONCURRENCY = int(os.environ.get('INVOICE_SPLIT_CONCURRENCY', 4))  # parallel extractions per split PDF
+
+    # Near-duplicate detection
+    DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+    DEDUP_DB = os.environ.get('DEDUP_DB', os.path.join('data', 'dedup.db'))
+    DEDUP_REUSE = os.environ.get('DEDUP_REUSE', 'false').lower() == 'true'  # reuse the earlier extraction instead of calling the LLM
+    DEDUP_TEXT_THRESHOLD = float(os.environ.get('DEDUP_TEXT_THRESHOLD', 0.85))  # estimated Jaccard similarity of OCR text
+    DEDUP_IMAGE_MAX_DISTANCE = int(os.environ.get('DEDUP_IMAGE_MAX_DISTANCE', 6))  # bits of 64 between image hashes
+    DEDUP_MAX_CANDIDATES = int(os.environ.get('DEDUP_MAX_CANDIDATES', 50))  # candidates scored per lookup, most shared LSH bands first
+
+    # Invoice store
+    INVOICE_STORE_ENABLED = os.environ.get('INVOICE_STORE_ENABLED', 'true').lower() == 'true'
+    INVOICE_DB = os.environ.get('INVOICE_DB', os.path.join('data', 'invoices.db'))
+    INVOICE_QUERY_MAX_LIMIT = int(os.environ.get('INVOICE_QUERY_MAX_LIMIT', 200))  # page size cap for /api/invoices
+
+    # Vendor/customer entity resolution
+    ENTITY_RESOLUTION_ENABLED = os.environ.get('ENTITY_RESOLUTION_ENABLED', 'true').lower() == 'true'
+    ENTITY_DB = os.environ.get('ENTITY_DB', os.path.join('data', 'entities.db'))
+    ENTITY_MATCH_THRESHOLD = float(os.environ.get('ENTITY_MATCH_THRESHOLD', 0.7))  # trigram Jaccard similarity for a fuzzy match
+    ENTITY_MAX_CANDIDATES = int(os.environ.get('ENTITY_MAX_CANDIDATES', 50))  # candidates verified per fuzzy lookup
+
+    # Parquet exports (parquet_export.py, needs pyarrow)
+    PARQUET_EXPORT_ENABLED = os.environ.get('PARQUET_EXPORT_ENABLED', 'true').lower() == 'true'
+    PARQUET_ROW_GROUP_ROWS = int(os.environ.get('PARQUET_ROW_GROUP_ROWS', 50000))  # rows buffered per row group
+    PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+
+    # Excel export (xlsx_export.py, needs xlsxwriter)
+    XLSX_EXPORT_ENABLED = os.environ.get('XLSX_EXPORT_ENABLED', 'true').lower() == 'true'
+
+    # Compression and caching of downloads, previews and JSON responses (http_cache.py)
+    EXPORT_PRECOMPRESS = os.environ.get('EXPORT_PRECOMPRESS', 'true').lower() == 'true'  # .gz/.zst copies of CSV/JSON exports
+    PRECOMPRESS_GZIP_LEVEL = int(os.environ.get('PRECOMPRESS_GZIP_LEVEL', 9))  # written once, so spend the CPU
+    PRECOMPRESS_ZSTD_LEVEL = int(os.environ.get('PRECOMPRESS_ZSTD_LEVEL', 12))
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))  # smaller JSON responses are sent as is
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 5))  # per response
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))  # per response
+    PREVIEW_MAX_AGE = int(os.environ.get('PREVIEW_MAX_AGE', 300))  # seconds a preview is reused before revalidating
@@ -0,0 +1,145 @@
+import asyncio
+import base64
+import logging
+import mimetypes
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# CPU-heavy local steps (base64 encoding of documents, PDF splitting, CSV
+# building) run in a process pool so they do not hold the GIL on the request
+# thread or the event loop. Work is handed over by file path both ways: workers
+# read their inputs from disk and write their outputs to disk, and only paths
+# and small values cross the pipe, so multi-MB documents and their base64 text
+# are never pickled in either direction. Keep this module's imports light;
+# spawned workers import it.
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+def _get_pool():
+    global _pool, _pool_pid
+    if Config.CPU_POOL_WORKERS <= 0:
+        return None
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            ctx = multiprocessing.get_context(Config.CPU_POOL_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=Config.CPU_POOL_WORKERS, mp_context=ctx)
+            _pool_pid = os.getpid()
+        return _pool
+
+def _inline(size) -> bool:
+    # Small inputs cost more to ship to a worker than to process here
+    return size is not None and size < Config.CPU_POOL_MIN_BYTES
+
+def run_cpu(fn, *args, size: int = None):
+    """Run fn(*args) in the process pool (or inline if disabled / the input is small)"""
+    pool = None if _inline(size) else _get_pool()
+    if pool is None:
+        return fn(*args)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool as e:
+        # A worker died (e.g. OOM); replace the pool and do this piece of work inline
+        logger.warning(f"Process pool unavailable ({e}); running {fn.__name__} inline")
+        _discard(pool)
+        return fn(*args)
+
+async def run_cpu_async(fn, *args, size: int = None):
+    """Async variant of run_cpu; falls back to a thread when the pool is disabled"""
+    pool = None if _inline(size) else _get_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+def _discard(pool) -> None:
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def file_size(path: str):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def data_url(path: str, mime: str = None) -> str:
+    """Base64 data URL of a file; large files are encoded in the pool and read back from disk"""
+    size = file_size(path)
+    if _inline(size) or _get_pool() is None:
+        return encode_data_url(path, mime)
+    fd, out_path = tempfile.mkstemp(suffix='.b64')
+    os.close(fd)
+    try:
+        run_cpu(write_data_url, path, out_path, mime, size=size)
+        with open(out_path, encoding='ascii') as f:
+            return f.read()
+    finally:
+        _remove(out_path)
+
+async def data_url_async(path: str, mime: str = None) -> str:
+    """Async variant of data_url"""
+    return await asyncio.to_thread(data_url, path, mime)
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# --- Worker tasks (module level so they can be pickled by reference) ---
+
+def encode_data_url(path: str, mime: str = None) -> str:
+    """Read a file and encode it as a base64 data URL (PDF or image by extension unless `mime` is given)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not mime:
+        if path.lower().endswith('.pdf'):
+            mime = "application/pdf"
+        else:
+            mime = mimetypes.guess_type(os.path.basename(path))[0] or "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+def write_data_url(path: str, out_path: str, mime: str = None) -> str:
+    """Encode a file as a data URL into out_path; returns out_path"""
+    with open(out_path, 'w', encoding='ascii') as out:
+        out.write(encode_data_url(path, mime))
+    return out_path
+
+def decode_to_file(b64: str, out_path: str) -> str:
+    """Decode base64 text into out_path (inline: the text is already in the caller's memory)"""
+    with open(out_path, 'wb') as out:
+        out.write(base64.b64decode(b64))
+    return out_path
+
+def split_pdf(path: str, page_groups: list) -> list:
+    """Write each 0-based page group of a PDF as its own file next to it; returns their paths"""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(path)
+    out_paths = []
+    for pages in page_groups:
+        writer = PdfWriter()
+        for index in pages:
+            writer.add_page(reader.pages[index])
+        out_path = f'{path}.pages{pages[0] + 1}-{pages[-1] + 1}.pdf'
+        with open(out_path, 'wb') as f:
+            writer.write(f)
+        out_paths.append(out_path)
+    return out_paths
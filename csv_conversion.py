@@ -1,8 +1,23 @@
-import pandas as pd
-from typing import Any, Dict, List
+import csv
+import io
+import math
+from typing import Any, Dict, Iterator, List, Optional, TextIO
 
-def convert_invoices_to_csv(invoices: List[Dict[str, Any]]) -> pd.DataFrame:
+# Two ways to build the exports:
+#   - convert_invoices_to_csv / create_summary_csv return pandas DataFrames
+#     (pandas is imported only when they are called);
+#   - write_detailed_csv / write_summary_csv (and the iter_* variants) stream
+#     rows straight from the invoice dicts to a file or generator. They build
+#     one row at a time, never copy a header dict per line item, and produce
+#     the same bytes as DataFrame.to_csv(index=False).
+# Matching pandas byte for byte needs one thing pandas learns from the whole
+# batch: a column whose numbers mix ints with floats (or with missing values)
+# becomes float64, so its ints are written as "0.0". A first pass over the rows
+# records only per-column type flags; the second pass writes.
+
+def convert_invoices_to_csv(invoices: List[Dict[str, Any]]):
     """Convert multiple invoices to a single CSV with line-item level detail"""
+    import pandas as pd
     rows = []
     
     for invoice_idx, invoice in enumerate(invoices, 1):
@@ -65,8 +80,9 @@ def convert_invoices_to_csv(invoices: List[Dict[str, Any]]) -> pd.DataFrame:
     
     return pd.DataFrame(rows)
 
-def create_summary_csv(invoices: List[Dict[str, Any]]) -> pd.DataFrame:
+def create_summary_csv(invoices: List[Dict[str, Any]]):
     """Create a summary CSV with one row per invoice"""
+    import pandas as pd
     summary_rows = []
     
     for invoice_idx, invoice in enumerate(invoices, 1):
@@ -85,7 +101,136 @@ def create_summary_csv(invoices: List[Dict[str, Any]]) -> pd.DataFrame:
             'total_amount': invoice.get('total_amount', 0),
             'currency': invoice.get('currency', 'USD'),
             'gst_number': invoice.get('gst_number', ''),
+            'source_pages': invoice.get('source_pages', ''),
         }
         summary_rows.append(summary_row)
     
-    return pd.DataFrame(summary_rows)
\ No newline at end of file
+    return pd.DataFrame(summary_rows)
+
+DETAILED_HEADER_COLUMNS = [
+    'file_number', 'invoice_number', 'invoice_date', 'due_date', 'vendor_name', 'vendor_address', 'vendor_phone',
+    'vendor_email', 'vendor_tax_id', 'customer_name', 'customer_address', 'customer_phone', 'customer_email',
+    'subtotal', 'tax_amount', 'discount_amount', 'total_amount', 'currency', 'payment_terms', 'notes', 'gst_number',
+]
+DETAILED_ITEM_COLUMNS = [
+    'line_item_number', 'item_description', 'quantity', 'unit_price', 'line_total', 'unit', 'sku', 'tax_rate',
+]
+DETAILED_COLUMNS = DETAILED_HEADER_COLUMNS + DETAILED_ITEM_COLUMNS
+SUMMARY_COLUMNS = [
+    'file_number', 'invoice_number', 'invoice_date', 'due_date', 'vendor_name', 'customer_name', 'line_items_count',
+    'subtotal', 'tax_amount', 'discount_amount', 'total_amount', 'currency', 'gst_number', 'source_pages',
+]
+# (column, default) pairs read from the invoice for the header part of a detailed row
+_HEADER_FIELDS = [(c, '') for c in DETAILED_HEADER_COLUMNS[1:13]] + [
+    ('subtotal', 0), ('tax_amount', 0), ('discount_amount', 0), ('total_amount', 0), ('currency', 'USD'),
+    ('payment_terms', ''), ('notes', ''), ('gst_number', ''),
+]
+_EMPTY_ITEM = [1, '', 0, 0, 0, '', '', 0]
+# Amount columns; cleaned invoices always hold floats here, so batches print them as floats
+NUMERIC_COLUMNS = frozenset(['subtotal', 'tax_amount', 'discount_amount', 'total_amount',
+                             'quantity', 'unit_price', 'line_total', 'tax_rate'])
+
+def iter_detailed_rows(invoices: List[Dict[str, Any]], file_number: Optional[int] = None) -> Iterator[list]:
+    """Detailed rows (lists in DETAILED_COLUMNS order), one per line item"""
+    for invoice_idx, invoice in enumerate(invoices, 1):
+        header = [file_number if file_number is not None else invoice_idx]
+        header.extend(invoice.get(field, default) for field, default in _HEADER_FIELDS)
+        line_items = invoice.get('line_items', [])
+        if not line_items:
+            yield header + _EMPTY_ITEM
+            continue
+        for item_idx, item in enumerate(line_items, 1):
+            yield header + [
+                item_idx, item.get('description', ''), item.get('quantity', 0), item.get('unit_price', 0),
+                item.get('total_price', 0), item.get('unit', ''), item.get('sku', ''), item.get('tax_rate', 0),
+            ]
+
+def iter_summary_rows(invoices: List[Dict[str, Any]], file_number: Optional[int] = None) -> Iterator[list]:
+    """Summary rows (lists in SUMMARY_COLUMNS order), one per invoice"""
+    for invoice_idx, invoice in enumerate(invoices, 1):
+        yield [
+            file_number if file_number is not None else invoice_idx,
+            invoice.get('invoice_number', ''), invoice.get('invoice_date', ''), invoice.get('due_date', ''),
+            invoice.get('vendor_name', ''), invoice.get('customer_name', ''), len(invoice.get('line_items', [])),
+            invoice.get('subtotal', 0), invoice.get('tax_amount', 0), invoice.get('discount_amount', 0),
+            invoice.get('total_amount', 0), invoice.get('currency', 'USD'), invoice.get('gst_number', ''),
+            invoice.get('source_pages', ''),
+        ]
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def _float_columns(rows: Iterator[list], width: int) -> List[bool]:
+    """Columns pandas would store as float64: only numbers, with a float or a missing value among them"""
+    numeric = [True] * width
+    promote = [False] * width
+    for row in rows:
+        for i, value in enumerate(row):
+            if not numeric[i]:
+                continue
+            if value is None or isinstance(value, float):
+                promote[i] = True
+            elif isinstance(value, bool) or not isinstance(value, int):
+                numeric[i] = False
+    return [n and p for n, p in zip(numeric, promote)]
+
+def _format_row(row: list, float_cols: List[bool]) -> list:
+    out = []
+    for value, as_float in zip(row, float_cols):
+        if _is_missing(value):
+            out.append('')
+        elif as_float and isinstance(value, (int, float)) and not isinstance(value, bool):
+            out.append(repr(float(value)))
+        else:
+            out.append(value)
+    return out
+
+def _rows_for(kind: str, invoices: List[Dict[str, Any]], file_number: Optional[int]):
+    if kind == 'detailed':
+        return DETAILED_COLUMNS, lambda: iter_detailed_rows(invoices, file_number)
+    return SUMMARY_COLUMNS, lambda: iter_summary_rows(invoices, file_number)
+
+def iter_csv(kind: str, invoices: List[Dict[str, Any]], header: bool = True, file_number: Optional[int] = None,
+             chunk_rows: int = 500, float_columns=None) -> Iterator[str]:
+    """'detailed' or 'summary' CSV text, yielded every `chunk_rows` rows.
+    `float_columns` fixes which columns print numbers as floats instead of inferring it from the batch.
+    """
+    if not invoices:
+        # An empty DataFrame has no columns either
+        if header:
+            yield '\n'
+        return
+    columns, rows = _rows_for(kind, invoices, file_number)
+    if float_columns is not None:
+        float_cols = [c in float_columns for c in columns]
+    else:
+        float_cols = _float_columns(rows(), len(columns))
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    if header:
+        writer.writerow(columns)
+    for n, row in enumerate(rows(), 1):
+        writer.writerow(_format_row(row, float_cols))
+        if n % chunk_rows == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def write_csv(kind: str, invoices: List[Dict[str, Any]], out: TextIO, header: bool = True,
+              file_number: Optional[int] = None, float_columns=None) -> None:
+    """Stream the detailed/summary CSV to a text file object.
+    `file_number` overrides the per-invoice numbering (e.g. when appending one file's invoices);
+    appenders should also pass `float_columns` so every chunk formats amounts the same way.
+    """
+    for chunk in iter_csv(kind, invoices, header, file_number, float_columns=float_columns):
+        out.write(chunk)
+
+def write_detailed_csv(invoices: List[Dict[str, Any]], out: TextIO, header: bool = True,
+                       file_number: Optional[int] = None) -> None:
+    write_csv('detailed', invoices, out, header, file_number)
+
+def write_summary_csv(invoices: List[Dict[str, Any]], out: TextIO, header: bool = True,
+                      file_number: Optional[int] = None) -> None:
+    write_csv('summary', invoices, out, header, file_number)
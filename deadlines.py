@@ -0,0 +1,95 @@
+import math
+import time
+from typing import Dict, Iterable, Optional
+from config import Config
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a job, file or stage runs out of its time budget"""
+
+    def __init__(self, stage: str, budget: Optional[float] = None):
+        self.stage = stage
+        self.budget = budget
+        detail = f" ({budget:.1f}s budget)" if budget is not None else ""
+        super().__init__(f"Deadline exceeded during {stage}{detail}")
+
+class Deadline:
+    """Absolute point in time (monotonic) that a unit of work must finish by"""
+
+    def __init__(self, seconds: float, label: str = 'job', parent: 'Deadline' = None):
+        expires_at = time.monotonic() + max(0.0, float(seconds))
+        if parent is not None:
+            expires_at = min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self.budget = max(0.0, expires_at - time.monotonic())
+        self.label = label
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self, stage: str = None) -> None:
+        """Raise DeadlineExceeded if no time is left"""
+        if self.expired():
+            raise DeadlineExceeded(stage or self.label, self.budget)
+
+    def timeout_ms(self) -> int:
+        """Remaining budget in milliseconds, for the Mistral SDK `timeout_ms` argument"""
+        return max(1, int(self.remaining() * 1000))
+
+    def child(self, seconds: float, label: str) -> 'Deadline':
+        """A nested deadline that never outlives this one"""
+        return Deadline(seconds, label=label, parent=self)
+
+class FileBudget:
+    """Per-file deadline split across pipeline stages.
+
+    Each stage gets its configured share of whatever is left for the file, so
+    time a fast stage does not use rolls forward to the later ones. Export is
+    a job-level stage (reserved when the job's processing deadline is carved
+    out), so its share is left out of the per-file split.
+    """
+
+    def __init__(self, job: Deadline, seconds: float = None, split: Dict[str, float] = None):
+        self.deadline = job.child(seconds or Config.FILE_DEADLINE_SECONDS, 'file')
+        self.split = {k: v for k, v in (split or Config.STAGE_BUDGET_SPLIT).items() if k != 'export'}
+
+    def stage(self, name: str) -> Deadline:
+        self.deadline.check(name)
+        stages = list(self.split)
+        later: Iterable[str] = stages[stages.index(name):] if name in stages else [name]
+        total = sum(self.split.get(s, 0.0) for s in later) or 1.0
+        share = self.split.get(name, total) / total
+        return self.deadline.child(self.deadline.remaining() * share, name)
+
+def job_seconds(requested_seconds=None) -> float:
+    """A job's budget: a caller override clamped to [MIN, MAX]; the default for anything not a finite number"""
+    try:
+        seconds = float(requested_seconds) if requested_seconds else None
+    except (TypeError, ValueError):
+        seconds = None
+    if seconds is None or not math.isfinite(seconds):
+        return Config.JOB_DEADLINE_SECONDS
+    return max(Config.MIN_JOB_DEADLINE_SECONDS, min(seconds, Config.MAX_JOB_DEADLINE_SECONDS))
+
+def job_deadline(requested_seconds=None) -> Deadline:
+    """Build the per-job deadline, honouring a caller override up to the configured maximum"""
+    return Deadline(job_seconds(requested_seconds), label='job')
+
+def job_deadline_at(requested_seconds=None) -> float:
+    """Wall-clock time a job must finish by, for tasks that cross processes (monotonic time does not)"""
+    return time.time() + job_seconds(requested_seconds)
+
+def deadline_until(deadline_at: float, label: str = 'job') -> Deadline:
+    """The Deadline for a wall-clock `deadline_at` from job_deadline_at, in this process"""
+    return Deadline(max(0.0, float(deadline_at) - time.time()), label=label)
+
+def client_timeout_kwargs(deadline: Optional[Deadline], sdk: str) -> dict:
+    """Keyword arguments that bound a single provider call by the deadline"""
+    if deadline is None:
+        return {}
+    if sdk == 'mistral':
+        return {'timeout_ms': deadline.timeout_ms()}
+    # OpenAI SDK: seconds; None would mean "no timeout" so only pass a real value
+    return {'timeout': max(0.001, deadline.remaining())}
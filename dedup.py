@@ -0,0 +1,198 @@
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+from serialization import dumps, loads
+
+# Near-duplicate detection. The same invoice often arrives as a re-scan, a
+# phone photo and the emailed PDF; exact content hashes miss all of these.
+# Every extracted invoice is indexed by
+#   - a MinHash signature of its OCR text (word 3-gram shingles), and
+#   - a 64-bit difference hash (dHash) of the page image, for image uploads.
+# Both are bucketed by locality-sensitive hashing (LSH bands) in SQLite, so a
+# lookup only compares against documents sharing a band bucket instead of
+# scanning the corpus. A text match is verified by its estimated Jaccard
+# similarity, an image match by Hamming distance.
+# Invoices from one vendor share a template, so similar text or a similar
+# image alone is not proof of the same invoice: an earlier extraction is only
+# reused when the text matches and the documents contain the same numbers
+# (amounts, dates, invoice number). Anything weaker is just flagged.
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+NUM_PERM = 128
+TEXT_BANDS = 16  # 16 bands x 8 rows: candidates from roughly 0.7 Jaccard upwards
+IMAGE_BANDS = 8  # 8 bands x 8 bits: any pair within 7 bits shares a band
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_IMAGE_REF = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+_TOKEN = re.compile(r'[a-z0-9]+(?:[.,][0-9]+)*')
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(_IMAGE_REF.sub(' ', text.lower()))
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def minhash(text: str, shingle: int = 3) -> Optional[List[int]]:
+    """MinHash signature over word shingles; None for text too short to compare"""
+    tokens = _tokens(text or '')
+    if len(tokens) < shingle:
+        return None
+    hashes = {_hash64(' '.join(tokens[i:i + shingle])) for i in range(len(tokens) - shingle + 1)}
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+def numbers_fingerprint(text: str) -> str:
+    """Hash of the set of numbers in a document, ignoring thousands separators"""
+    numbers = sorted({re.sub(r'[,\s]', '', t) for t in _tokens(text or '') if any(c.isdigit() for c in t)})
+    return hashlib.sha1(' '.join(numbers).encode('utf-8')).hexdigest()
+
+def similarity(a: List[int], b: List[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+def image_hash(path: str) -> Optional[int]:
+    """64-bit dHash of an image file; None without Pillow or for unreadable files"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            pixels = list(img.convert('L').resize((9, 8)).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+def _text_buckets(signature: List[int]) -> List[str]:
+    rows = NUM_PERM // TEXT_BANDS
+    return [hashlib.blake2b(repr(signature[i * rows:(i + 1) * rows]).encode(), digest_size=8).hexdigest()
+            for i in range(TEXT_BANDS)]
+
+def _image_buckets(phash: int) -> List[str]:
+    return [f'{(phash >> (8 * i)) & 0xFF:02x}' for i in range(IMAGE_BANDS)]
+
+class DuplicateIndex:
+    def __init__(self, path: str = None):
+        self.path = path or Config.DEDUP_DB
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_file TEXT,
+                signature TEXT,
+                numbers TEXT,
+                phash TEXT,
+                invoice TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh (
+                kind TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                doc_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON lsh (kind, band, bucket);
+        ''')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _candidates(self, kind: str, buckets: List[str]) -> List[sqlite3.Row]:
+        """Documents sharing a band bucket, most shared bands first; only the columns needed to score them"""
+        clauses = ' OR '.join('(l.band = ? AND l.bucket = ?)' for _ in buckets)
+        params = [kind] + [v for band, bucket in enumerate(buckets) for v in (band, bucket)]
+        return self._conn().execute(
+            f'SELECT d.doc_id, d.signature, d.numbers, d.phash, COUNT(*) AS hits '
+            f'FROM lsh l JOIN documents d ON d.doc_id = l.doc_id '
+            f'WHERE l.kind = ? AND ({clauses}) GROUP BY l.doc_id ORDER BY hits DESC LIMIT ?',
+            params + [Config.DEDUP_MAX_CANDIDATES],
+        ).fetchall()
+
+    def find(self, text: str, phash: int = None) -> Optional[Dict[str, Any]]:
+        """Best near-duplicate of a document already in the index, or None.
+
+        The match carries 'kind' ('text' or 'image'), 'similarity', the earlier
+        'source_file' and 'invoice', and 'reusable' when the earlier extraction
+        can stand in for this document.
+        """
+        best = None
+        signature = minhash(text)
+        if signature is not None:
+            numbers = numbers_fingerprint(text)
+            for row in self._candidates('text', _text_buckets(signature)):
+                score = similarity(signature, loads(row['signature']))
+                if score >= Config.DEDUP_TEXT_THRESHOLD and (best is None or score > best['similarity']):
+                    best = {'doc_id': row['doc_id'], 'kind': 'text', 'similarity': score,
+                            'reusable': row['numbers'] == numbers}
+        if best is None and phash is not None:
+            for row in self._candidates('image', _image_buckets(phash)):
+                distance = bin(phash ^ int(row['phash'], 16)).count('1')
+                score = 1 - distance / 64
+                if distance <= Config.DEDUP_IMAGE_MAX_DISTANCE and (best is None or score > best['similarity']):
+                    best = {'doc_id': row['doc_id'], 'kind': 'image', 'similarity': score, 'reusable': False}
+        return self._match(best) if best is not None else None
+
+    def _match(self, best: Dict[str, Any]) -> Dict[str, Any]:
+        # The stored invoice is only loaded for the document that won
+        row = self._conn().execute('SELECT source_file, invoice FROM documents WHERE doc_id = ?',
+                                   (best['doc_id'],)).fetchone()
+        return {**best, 'similarity': round(best['similarity'], 3),
+                'source_file': row['source_file'], 'invoice': loads(row['invoice'])}
+
+    def add(self, text: str, invoice: Dict[str, Any], phash: int = None, source_file: str = None) -> Optional[int]:
+        """Index an extracted invoice under its OCR text (and page image hash)"""
+        signature = minhash(text)
+        if signature is None and phash is None:
+            return None
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cur = conn.execute(
+                'INSERT INTO documents (source_file, signature, numbers, phash, invoice, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (source_file, dumps(signature) if signature is not None else None,
+                 numbers_fingerprint(text) if signature is not None else None,
+                 f'{phash:016x}' if phash is not None else None, dumps(invoice), time.time()),
+            )
+            doc_id = cur.lastrowid
+            rows = []
+            if signature is not None:
+                rows += [('text', band, bucket, doc_id) for band, bucket in enumerate(_text_buckets(signature))]
+            if phash is not None:
+                rows += [('image', band, bucket, doc_id) for band, bucket in enumerate(_image_buckets(phash))]
+            conn.executemany('INSERT INTO lsh (kind, band, bucket, doc_id) VALUES (?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return doc_id
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> DuplicateIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DuplicateIndex()
+        return _index
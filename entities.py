@@ -0,0 +1,191 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+from invoice_store import normalize_id
+
+# Entity resolution for vendor/customer names. The LLM returns the same
+# company as "ACME Ltd", "Acme Limited" or "ACME LTD." from one document to
+# the next; every extracted invoice gets a canonical vendor_id/customer_id so
+# grouping, rollups and duplicate checks see one entity.
+# Lookup order:
+#   1. exact tax id (vendor tax id / GST number)
+#   2. exact normalized name (lowercased, punctuation and legal suffixes removed)
+#   3. fuzzy: character-trigram Jaccard similarity >= ENTITY_MATCH_THRESHOLD
+# The fuzzy step is sub-linear: an inverted index maps trigrams to entities and
+# only the rarest trigrams of the query are looked up (prefix filtering: any
+# name above the threshold must share at least one of them), so common grams
+# such as " co" never pull in half the table. No match creates a new entity.
+
+LEGAL_SUFFIXES = {
+    'ltd', 'limited', 'inc', 'incorporated', 'llc', 'llp', 'lp', 'plc', 'corp', 'corporation', 'co', 'company',
+    'gmbh', 'ag', 'sa', 'sas', 'srl', 'bv', 'nv', 'pty', 'pvt', 'private', 'the',
+}
+ABBREVIATIONS = {'intl': 'international', 'mfg': 'manufacturing', 'svcs': 'services', 'svc': 'service',
+                 'bros': 'brothers', 'dept': 'department', 'natl': 'national', '&': 'and'}
+KINDS = ('vendor', 'customer')
+
+def normalize_entity_name(name: Optional[str]) -> str:
+    words = re.findall(r'[a-z0-9]+|&', (name or '').lower())
+    words = [ABBREVIATIONS.get(w, w) for w in words]
+    core = [w for w in words if w not in LEGAL_SUFFIXES]
+    # A name made only of suffix words ("The Company") keeps them
+    return ' '.join(core or words)
+
+def trigrams(norm: str) -> set:
+    padded = f'  {norm} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+class EntityIndex:
+    def __init__(self, path: str = None):
+        self.path = path or Config.ENTITY_DB
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS entities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                norm TEXT NOT NULL,
+                tax_id TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entities_tax ON entities (kind, tax_id);
+            CREATE TABLE IF NOT EXISTS aliases (
+                kind TEXT NOT NULL,
+                norm TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                PRIMARY KEY (kind, norm)
+            );
+            CREATE TABLE IF NOT EXISTS grams (
+                kind TEXT NOT NULL,
+                gram TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                PRIMARY KEY (kind, gram, entity_id)
+            );
+            CREATE TABLE IF NOT EXISTS gram_counts (
+                kind TEXT NOT NULL,
+                gram TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (kind, gram)
+            );
+        ''')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def resolve(self, kind: str, name: Optional[str], tax_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Canonical entity for a name/tax id, created if unseen; None for an empty name and no tax id"""
+        norm = normalize_entity_name(name)
+        tax_id = normalize_id(tax_id)
+        if not norm and not tax_id:
+            return None
+        conn = self._conn()
+        # Fast path without a write lock: a known alias and a consistent tax id
+        row = self._by_alias(conn, kind, norm) if norm else None
+        if row is not None and (not tax_id or row['tax_id'] == tax_id):
+            return self._entity(row, 'alias')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            match, how = None, None
+            if tax_id:
+                match = conn.execute('SELECT * FROM entities WHERE kind = ? AND tax_id = ?', (kind, tax_id)).fetchone()
+                how = 'tax_id'
+            if match is None and norm:
+                match, how = self._by_alias(conn, kind, norm), 'alias'
+                # A name shared by two tax ids is two entities, never one
+                if match is not None and tax_id and match['tax_id'] and match['tax_id'] != tax_id:
+                    match = None
+            if match is None and norm:
+                match, how = self._fuzzy(conn, kind, norm, tax_id), 'fuzzy'
+            if match is None:
+                match, how = self._create(conn, kind, name, norm, tax_id), 'new'
+            else:
+                if tax_id and not match['tax_id']:
+                    conn.execute('UPDATE entities SET tax_id = ? WHERE id = ?', (tax_id, match['id']))
+                if norm:
+                    conn.execute('INSERT OR IGNORE INTO aliases (kind, norm, entity_id) VALUES (?, ?, ?)',
+                                 (kind, norm, match['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self._entity(match, how)
+
+    @staticmethod
+    def _by_alias(conn: sqlite3.Connection, kind: str, norm: str) -> Optional[sqlite3.Row]:
+        return conn.execute(
+            'SELECT e.* FROM aliases a JOIN entities e ON e.id = a.entity_id WHERE a.kind = ? AND a.norm = ?',
+            (kind, norm),
+        ).fetchone()
+
+    @staticmethod
+    def _entity(row: sqlite3.Row, how: str) -> Dict[str, Any]:
+        return {'id': row['id'], 'name': row['name'], 'tax_id': row['tax_id'], 'matched_by': how}
+
+    def _fuzzy(self, conn: sqlite3.Connection, kind: str, norm: str,
+               tax_id: Optional[str] = None) -> Optional[sqlite3.Row]:
+        grams = trigrams(norm)
+        threshold = Config.ENTITY_MATCH_THRESHOLD
+        placeholders = ', '.join('?' * len(grams))
+        df = {row['gram']: row['df'] for row in conn.execute(
+            f'SELECT gram, df FROM gram_counts WHERE kind = ? AND gram IN ({placeholders})', [kind, *grams])}
+        # Grams nobody has cannot produce candidates; the rest are probed rarest first
+        probe_count = len(grams) - math.ceil(threshold * len(grams)) + 1
+        probes = sorted(grams, key=lambda g: df.get(g, 0))[:probe_count]
+        probes = [g for g in probes if df.get(g)]
+        if not probes:
+            return None
+        candidates = conn.execute(
+            f'SELECT e.*, COUNT(*) AS hits FROM grams g JOIN entities e ON e.id = g.entity_id '
+            f'WHERE g.kind = ? AND g.gram IN ({", ".join("?" * len(probes))}) '
+            f'GROUP BY g.entity_id ORDER BY hits DESC LIMIT ?',
+            [kind, *probes, Config.ENTITY_MAX_CANDIDATES],
+        ).fetchall()
+        best, best_score = None, threshold
+        for row in candidates:
+            if tax_id and row['tax_id'] and row['tax_id'] != tax_id:
+                continue
+            score = jaccard(grams, trigrams(row['norm']))
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+
+    def _create(self, conn: sqlite3.Connection, kind: str, name: Optional[str], norm: str,
+                tax_id: Optional[str]) -> sqlite3.Row:
+        display = ' '.join((name or '').split()) or tax_id
+        cur = conn.execute('INSERT INTO entities (kind, name, norm, tax_id, created_at) VALUES (?, ?, ?, ?, ?)',
+                           (kind, display, norm, tax_id, time.time()))
+        entity_id = cur.lastrowid
+        if norm:
+            conn.execute('INSERT OR IGNORE INTO aliases (kind, norm, entity_id) VALUES (?, ?, ?)', (kind, norm, entity_id))
+            grams = sorted(trigrams(norm))
+            conn.executemany('INSERT OR IGNORE INTO grams (kind, gram, entity_id) VALUES (?, ?, ?)',
+                             [(kind, g, entity_id) for g in grams])
+            conn.executemany('INSERT INTO gram_counts (kind, gram, df) VALUES (?, ?, 1) '
+                             'ON CONFLICT (kind, gram) DO UPDATE SET df = df + 1', [(kind, g) for g in grams])
+        return conn.execute('SELECT * FROM entities WHERE id = ?', (entity_id,)).fetchone()
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> EntityIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = EntityIndex()
+        return _index
@@ -0,0 +1,198 @@
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import Config
+from csv_conversion import NUMERIC_COLUMNS, iter_csv
+from http_cache import precompress
+from parquet_export import available as parquet_available, iter_jsonl, write_parquet
+from pipeline import TEMP_DIR, run_export_step
+from serialization import dumps_bytes, load, loads
+from xlsx_export import available as xlsx_available, write_xlsx
+
+# Incremental, append-only exports for one job. Each file's invoices are
+# appended to the detailed CSV, summary CSV and JSONL outputs as soon as the
+# file finishes, so memory does not grow with the batch, a failure late in a
+# batch keeps everything before it, and the outputs can be downloaded while
+# the job is still running.
+# Every append is one O_APPEND write per output followed by an fsync, and the
+# manifest (written atomically with os.replace) records how many bytes of each
+# output are committed. Readers serve only the committed prefix; a restarted
+# job truncates any torn tail back to it and skips files already recorded.
+# Amount columns are always printed as floats, since per-file appends cannot
+# see the whole batch the way a one-shot export does.
+# Parquet and XLSX cannot be appended to across restarts (both are finalized
+# when closed), so they are streamed from the committed JSONL at finish(),
+# which also writes the compressed copies /download serves.
+
+KINDS = ('detailed', 'summary', 'jsonl')
+
+def manifest_path(job_id: str, directory: str = TEMP_DIR) -> str:
+    return os.path.join(directory, f'manifest_{job_id}.json')
+
+def load_manifest(job_id: str, directory: str = TEMP_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(manifest_path(job_id, directory), encoding='utf-8') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return None
+
+def iter_committed(path: str, length: int, block: int = 64 * 1024) -> Iterator[bytes]:
+    """The first `length` bytes of a file, in blocks"""
+    with open(path, 'rb') as f:
+        while length > 0:
+            data = f.read(min(block, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+def read_invoices(job_id: str, offset: int = 0, limit: int = None,
+                  directory: str = TEMP_DIR) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+    """(total, invoices[offset:offset + limit]) from a job's committed JSONL; None without one"""
+    manifest = load_manifest(job_id, directory)
+    output = (manifest or {}).get('outputs', {}).get('jsonl')
+    if output is None or not os.path.exists(output['path']):
+        return None
+    invoices = []
+    end = offset + limit if limit is not None else None
+    position = index = 0
+    with open(output['path'], 'rb') as f:
+        # Lines outside the page are skipped unparsed; anything past the committed length is ignored
+        for line in f:
+            position += len(line)
+            if position > output['bytes'] or (end is not None and index >= end):
+                break
+            if not line.strip():
+                continue
+            if index >= offset:
+                invoices.append(loads(line))
+            index += 1
+    return manifest['invoice_count'], invoices
+
+class IncrementalExport:
+    def __init__(self, job_id: str, kinds=KINDS, directory: str = TEMP_DIR):
+        self.job_id = job_id
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        manifest = load_manifest(job_id, directory)
+        if manifest is None:
+            manifest = {
+                'job_id': job_id,
+                'status': 'running',
+                'created_at': datetime.now().isoformat(),
+                'invoice_count': 0,
+                'sources': [],
+                'outputs': {kind: {'path': self._path(kind), 'bytes': 0, 'rows': 0} for kind in kinds},
+            }
+        self.manifest = manifest
+        # Resuming: drop anything written after the last committed manifest
+        for output in manifest['outputs'].values():
+            if os.path.exists(output['path']) and os.path.getsize(output['path']) > output['bytes']:
+                os.truncate(output['path'], output['bytes'])
+        self._write_manifest()
+
+    def _path(self, kind: str) -> str:
+        if kind == 'jsonl':
+            return os.path.join(self.directory, f'invoices_{self.job_id}.jsonl')
+        return os.path.join(self.directory, f'invoices_{kind}_{self.job_id}.csv')
+
+    def _write_manifest(self) -> None:
+        self.manifest['updated_at'] = datetime.now().isoformat()
+        path = manifest_path(self.job_id, self.directory)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(dumps_bytes(self.manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _render(self, kind: str, invoices: List[Dict[str, Any]], first_number: int, header: bool) -> bytes:
+        if kind == 'jsonl':
+            return b''.join(dumps_bytes(inv) + b'\n' for inv in invoices)
+        parts = []
+        for offset, invoice in enumerate(invoices):
+            parts.extend(iter_csv(kind, [invoice], header=header and offset == 0,
+                                  file_number=first_number + offset, float_columns=NUMERIC_COLUMNS))
+        return ''.join(parts).encode('utf-8')
+
+    def add(self, source: str, invoices: List[Dict[str, Any]]) -> bool:
+        """Append one source file's invoices; False if that source was already exported"""
+        with self._lock:
+            if source in self.manifest['sources'] or self.manifest['status'] != 'running':
+                return False
+            first_number = self.manifest['invoice_count'] + 1
+            for kind, output in self.manifest['outputs'].items():
+                data = self._render(kind, invoices, first_number, header=output['bytes'] == 0)
+                fd = os.open(output['path'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                output['bytes'] += len(data)
+                output['rows'] += len(invoices) if kind != 'detailed' else sum(
+                    max(1, len(inv.get('line_items') or [])) for inv in invoices)
+            self.manifest['invoice_count'] += len(invoices)
+            self.manifest['sources'].append(source)
+            self._write_manifest()
+            return True
+
+    def finish(self, success: bool = True, errors: List[str] = None, job=None) -> Dict[str, Any]:
+        """Mark the job's exports final and build the download set.
+
+        Returns temp_file_paths (file references only; nothing is read back
+        into memory), errors and timeout_reasons. The raw JSON array for
+        /download/json and the Parquet/XLSX exports are streamed from the
+        JSONL output, each step within `job`'s export deadline.
+        """
+        out = {'temp_file_paths': {}, 'errors': [], 'timeout_reasons': []}
+        paths = out['temp_file_paths']
+
+        def run(label, fn):
+            run_export_step(out, label, fn, job)
+
+        with self._lock:
+            outputs = self.manifest['outputs']
+            tables = [k for k in ('detailed', 'summary') if k in outputs]
+            for kind in tables:
+                if os.path.exists(outputs[kind]['path']):
+                    paths[kind] = outputs[kind]['path']
+            jsonl_path = outputs['jsonl']['path'] if 'jsonl' in outputs else None
+            if jsonl_path and os.path.exists(jsonl_path):
+                paths['jsonl'] = jsonl_path
+                run("Failed to write raw JSON", lambda: paths.update(json=self._write_json_array(jsonl_path)))
+                if Config.PARQUET_EXPORT_ENABLED and parquet_available():
+                    for kind in tables:
+                        run(f"Failed to generate {kind} Parquet", lambda: paths.update({f'{kind}_parquet': write_parquet(
+                            kind, iter_jsonl(jsonl_path),
+                            os.path.join(self.directory, f'invoices_{kind}_{self.job_id}.parquet'))}))
+                if Config.XLSX_EXPORT_ENABLED and xlsx_available() and tables:
+                    run("Failed to generate XLSX", lambda: paths.update(xlsx=write_xlsx(
+                        iter_jsonl(jsonl_path), os.path.join(self.directory, f'invoices_{self.job_id}.xlsx'), tables)))
+            if Config.EXPORT_PRECOMPRESS:
+                for path in list(paths.values()):
+                    run(f"Failed to compress {os.path.basename(path)}", lambda: precompress(path))
+            self.manifest['status'] = 'complete' if success else 'failed'
+            if errors:
+                self.manifest['errors'] = list(errors)
+            self._write_manifest()
+        return out
+
+    def _write_json_array(self, jsonl_path: str) -> str:
+        # Every JSONL line is already one invoice's JSON: join them, no re-encoding
+        json_path = os.path.join(self.directory, f'invoices_raw_{self.job_id}.json')
+        with open(jsonl_path, 'rb') as src, open(json_path, 'wb') as f:
+            f.write(b'[')
+            first = True
+            for line in src:
+                line = line.strip()
+                if not line:
+                    continue
+                f.write(line if first else b',' + line)
+                first = False
+            f.write(b']')
+        return json_path
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from config import Config
+
+# Cheap repeat transfers for downloads, previews and JSON responses.
+#   - Exports are compressed once when they are written (gzip, plus zstd when
+#     the zstandard package is installed) and the stored copy is sent to
+#     clients that accept it, instead of compressing on every download.
+#   - Files get a content-hash ETag (cached per path/size/mtime), so a repeat
+#     view is answered with 304 Not Modified; werkzeug's conditional send_file
+#     also serves Range requests, which PDF viewers use to fetch pages.
+#   - JSON API responses are gzip/brotli compressed on the fly when the client
+#     accepts it (brotli needs the brotli package).
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.csv', '.json', '.jsonl')
+SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+PREFERENCE = ('zstd', 'br', 'gzip')
+
+_etags: Dict[Tuple[str, int, int], str] = {}
+_etags_lock = threading.Lock()
+
+def content_etag(path: str) -> str:
+    """ETag from the SHA-256 of a file's content; rehashed only when size or mtime change"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+    if etag is not None:
+        return etag
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    etag = digest.hexdigest()[:32]
+    with _etags_lock:
+        if len(_etags) >= 4096:
+            _etags.clear()
+        _etags[key] = etag
+    return etag
+
+def precompress(path: str) -> Dict[str, str]:
+    """Write compressed copies of a text export next to it; {encoding: path}"""
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return {}
+    out = {}
+    encoders = {'gzip': _gzip_copy}
+    if zstandard is not None:
+        encoders['zstd'] = _zstd_copy
+    for encoding, copy in encoders.items():
+        target = path + SUFFIXES[encoding]
+        tmp = f'{target}.tmp'
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            copy(src, dst)
+        os.replace(tmp, target)
+        out[encoding] = target
+    return out
+
+def _gzip_copy(src, dst) -> None:
+    # mtime=0 keeps the bytes (and so the ETag) stable for the same content
+    with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=Config.PRECOMPRESS_GZIP_LEVEL, mtime=0) as gz:
+        shutil.copyfileobj(src, gz, 1024 * 1024)
+
+def _zstd_copy(src, dst) -> None:
+    zstandard.ZstdCompressor(level=Config.PRECOMPRESS_ZSTD_LEVEL).copy_stream(src, dst)
+
+def precompressed(path: str) -> Dict[str, str]:
+    """Compressed copies of a file that are at least as new as the file itself"""
+    mtime = os.path.getmtime(path)
+    out = {}
+    for encoding, suffix in SUFFIXES.items():
+        variant = path + suffix
+        if os.path.exists(variant) and os.path.getmtime(variant) >= mtime:
+            out[encoding] = variant
+    return out
+
+def negotiate(accept_encoding: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """Preferred content coding among `available` that the Accept-Encoding header allows"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for encoding in PREFERENCE:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=Config.PRECOMPRESS_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=Config.COMPRESS_GZIP_LEVEL, mtime=0)
+
+def response_encodings() -> Tuple[str, ...]:
+    """Codings available for on-the-fly JSON compression"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
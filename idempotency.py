@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from config import Config
+
+# Idempotency records for /upload. A client retrying with the same
+# Idempotency-Key gets the stored response (or is attached to the job still in
+# progress) instead of re-running OCR and extraction. Records are scoped per
+# client and expire after Config.IDEMPOTENCY_TTL seconds. SQLite keeps them
+# shared across worker processes and restarts.
+
+class IdempotencyStore:
+    def __init__(self, path: str = None):
+        self.path = path or Config.IDEMPOTENCY_DB
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS idempotency (
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                status TEXT NOT NULL,
+                job_id TEXT,
+                status_code INTEGER,
+                response BLOB,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (scope, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency (expires_at);
+        ''')
+        self.purge_expired()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def claim(self, scope: str, key: str, fingerprint: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Reserve (scope, key) for a new job.
+
+        Returns None if the caller now owns the key, otherwise the existing
+        record (in progress or complete).
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM idempotency WHERE scope = ? AND key = ? AND expires_at <= ?', (scope, key, now))
+            cur = conn.execute(
+                'INSERT OR IGNORE INTO idempotency (scope, key, fingerprint, status, job_id, created_at, expires_at) '
+                "VALUES (?, ?, ?, 'in_progress', ?, ?, ?)",
+                (scope, key, fingerprint, job_id, now, now + Config.IDEMPOTENCY_TTL),
+            )
+            existing = None
+            if cur.rowcount == 0:
+                existing = dict(conn.execute('SELECT * FROM idempotency WHERE scope = ? AND key = ?', (scope, key)).fetchone())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return existing
+
+    def complete(self, scope: str, key: str, status_code: int, response: bytes) -> None:
+        self._conn().execute(
+            "UPDATE idempotency SET status = 'complete', status_code = ?, response = ? WHERE scope = ? AND key = ?",
+            (status_code, response, scope, key),
+        )
+
+    def release(self, scope: str, key: str) -> None:
+        """Forget a key whose request failed so a retry can run again"""
+        self._conn().execute("DELETE FROM idempotency WHERE scope = ? AND key = ? AND status = 'in_progress'", (scope, key))
+
+    def get(self, scope: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            'SELECT * FROM idempotency WHERE scope = ? AND key = ? AND expires_at > ?', (scope, key, time.time())
+        ).fetchone()
+        return dict(row) if row else None
+
+    def wait_for(self, scope: str, key: str, timeout: float, interval: float = 0.5) -> Optional[Dict[str, Any]]:
+        """Poll until the record completes or the timeout passes; returns the latest record"""
+        deadline = time.monotonic() + timeout
+        record = self.get(scope, key)
+        while record and record['status'] != 'complete' and time.monotonic() < deadline:
+            time.sleep(interval)
+            record = self.get(scope, key)
+        return record
+
+    def purge_expired(self) -> int:
+        return self._conn().execute('DELETE FROM idempotency WHERE expires_at <= ?', (time.time(),)).rowcount
+
+def request_fingerprint(files, form) -> str:
+    """Hash of the uploaded file names/sizes and processing options, to catch key reuse with a different payload"""
+    h = hashlib.sha256()
+    for f in files:
+        # Werkzeug FileStorage exposes .stream, Starlette UploadFile exposes .file
+        stream = getattr(f, 'stream', None) or getattr(f, 'file', None)
+        size = 0
+        try:
+            pos = stream.tell()
+            size = stream.seek(0, os.SEEK_END)
+            stream.seek(pos)
+        except Exception:
+            pass
+        h.update(f"{getattr(f, 'filename', '')}:{size}\n".encode())
+    for name in sorted(k for k in form.keys() if k != 'files'):
+        h.update(f"{name}={form.get(name)}\n".encode())
+    return h.hexdigest()
+
+def client_scope(headers, remote_addr: str) -> str:
+    """Identify the caller: a hash of its API key if it sends one, otherwise its address"""
+    api_key = headers.get('X-API-Key') or headers.get('Authorization')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return f'addr:{remote_addr or "unknown"}'
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> IdempotencyStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IdempotencyStore()
+        return _store
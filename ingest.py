@@ -0,0 +1,257 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from config import Config
+from csv_conversion import NUMERIC_COLUMNS, write_csv
+from deadlines import Deadline, DeadlineExceeded, FileBudget
+from invoice_store import content_hash
+from pipeline import process_file
+from serialization import dumps, loads
+
+# Headless bulk ingestion: run a directory or glob of invoices through the same
+# OCR -> extraction -> CSV steps as the web app, without Flask.
+#   python ingest.py /mnt/share/invoices/2024-03 --output out/march --workers 8 --rate 4
+# Re-running with the same --output skips files whose content was already
+# processed, so an interrupted month-end run simply picks up where it stopped.
+
+logger = logging.getLogger('ingest')
+
+def find_inputs(inputs: Iterable[str], recursive: bool = True) -> List[str]:
+    """Expand directories and glob patterns into supported files, deduplicated and sorted"""
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                paths = (os.path.join(root, name) for root, _, names in os.walk(item) for name in names)
+            else:
+                paths = (os.path.join(item, name) for name in os.listdir(item))
+        else:
+            paths = glob.glob(item, recursive=recursive)
+        for path in paths:
+            ext = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+            if ext in Config.ALLOWED_EXTENSIONS and os.path.isfile(path):
+                found.add(os.path.realpath(path))
+    return sorted(found)
+
+class RateLimiter:
+    """Space out file starts to at most `rate` per second across all threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class OutputWriter:
+    """Append each finished file's invoices to the JSONL/CSV outputs and the processed-hash ledger.
+
+    With rotate='daily' the JSONL/CSV outputs roll over to a new dated set of
+    files each day; the ledger stays a single file.
+    """
+
+    def __init__(self, directory: str, rotate: str = None):
+        self.directory = directory
+        self.rotate = rotate
+        os.makedirs(directory, exist_ok=True)
+        self.ledger_path = os.path.join(directory, 'processed.jsonl')
+        self._lock = threading.Lock()
+        self.done_hashes = set()
+        self.count = 0
+        if os.path.exists(self.ledger_path):
+            with open(self.ledger_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from an interrupted run
+                    if rec.get('status') == 'ok':
+                        self.done_hashes.add(rec['sha256'])
+                        self.count = max(self.count, rec.get('file_number', 0))
+
+    def _output_path(self, name: str, ext: str) -> str:
+        suffix = f"_{datetime.now().strftime('%Y%m%d')}" if self.rotate == 'daily' else ''
+        return os.path.join(self.directory, f'{name}{suffix}.{ext}')
+
+    @property
+    def jsonl_path(self) -> str:
+        return self._output_path('invoices', 'jsonl')
+
+    @property
+    def detailed_path(self) -> str:
+        return self._output_path('invoices_detailed', 'csv')
+
+    @property
+    def summary_path(self) -> str:
+        return self._output_path('invoices_summary', 'csv')
+
+    def _append_csv(self, path: str, kind: str, invoices: List[Dict]) -> None:
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'a', newline='') as f:
+            write_csv(kind, invoices, f, header=new, file_number=self.count, float_columns=NUMERIC_COLUMNS)
+
+    def _ledger(self, record: Dict) -> None:
+        with open(self.ledger_path, 'a', encoding='utf-8') as f:
+            f.write(dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, path: str, sha256: str, invoices: List[Dict]) -> None:
+        """Record the invoices extracted from one file (several when a PDF bundles invoices)"""
+        with self._lock:
+            self.count += 1
+            for invoice in invoices:
+                invoice['source_path'] = path
+                invoice['sha256'] = sha256
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                for invoice in invoices:
+                    f.write(dumps(invoice) + '\n')
+            self._append_csv(self.detailed_path, 'detailed', invoices)
+            self._append_csv(self.summary_path, 'summary', invoices)
+            # Ledger last: a crash before this line only means the file is processed again
+            self._ledger({'sha256': sha256, 'path': path, 'status': 'ok', 'file_number': self.count,
+                          'invoices': len(invoices), 'processed_at': datetime.now().isoformat()})
+            self.done_hashes.add(sha256)
+
+    def failed(self, path: str, sha256: Optional[str], error: str) -> None:
+        with self._lock:
+            self._ledger({'sha256': sha256, 'path': path, 'status': 'failed', 'error': error,
+                          'processed_at': datetime.now().isoformat()})
+
+class Progress:
+    """Throughput/ETA reporting for a run"""
+
+    def __init__(self, total: int, interval: float = 5.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.ok = self.failed = self.skipped = 0
+        self.started = time.monotonic()
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            now = time.monotonic()
+            if now - self._last >= self.interval or self.ok + self.failed + self.skipped == self.total:
+                self._last = now
+                self.stream.write(self.line() + '\n')
+                self.stream.flush()
+
+    def line(self) -> str:
+        done = self.ok + self.failed + self.skipped
+        elapsed = time.monotonic() - self.started
+        # Skipped files cost next to nothing, so leave them out of the rate
+        worked = self.ok + self.failed
+        rate = worked / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else None
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        return (f"[{done}/{self.total}] {rate:.2f} files/s ok={self.ok} failed={self.failed} "
+                f"skipped={self.skipped} elapsed={elapsed:.0f}s eta={eta_text}")
+
+def ingest_file(path: str, writer: OutputWriter, limiter: RateLimiter, in_progress: set, lock: threading.Lock,
+                llm_choice: str, file_deadline: float, preview_dir: str) -> str:
+    """Process one file; returns 'ok', 'failed' or 'skipped'"""
+    sha256 = None
+    try:
+        sha256 = content_hash(path)
+        with lock:
+            # Same content under another name (or already done in an earlier run)
+            if sha256 in writer.done_hashes or sha256 in in_progress:
+                return 'skipped'
+            in_progress.add(sha256)
+        try:
+            limiter.wait()
+            budget = FileBudget(Deadline(file_deadline, label='file'), seconds=file_deadline)
+            invoices = process_file(path, os.path.basename(path), llm_choice, budget, preview_dir=preview_dir,
+                                    source_hash=sha256)
+            writer.add(path, sha256, invoices)
+            return 'ok'
+        finally:
+            with lock:
+                in_progress.discard(sha256)
+    except DeadlineExceeded as e:
+        logger.warning(f"Timed out processing {path}: {e}")
+        writer.failed(path, sha256, f"Timed out: {e}")
+    except Exception as e:
+        logger.warning(f"Error processing {path}: {e}")
+        writer.failed(path, sha256, str(e))
+    return 'failed'
+
+def run_ingest(inputs: List[str], output: str, workers: int = 4, rate: float = 0.0, llm_choice: str = 'Mistral',
+               file_deadline: float = None, recursive: bool = True, progress_interval: float = 5.0,
+               stop: threading.Event = None) -> Progress:
+    paths = find_inputs(inputs, recursive)
+    writer = OutputWriter(output)
+    limiter = RateLimiter(rate)
+    progress = Progress(len(paths), progress_interval)
+    stop = stop or threading.Event()
+    in_progress, lock = set(), threading.Lock()
+    file_deadline = file_deadline or Config.FILE_DEADLINE_SECONDS
+    preview_dir = os.path.join(output, 'previews')
+    os.makedirs(preview_dir, exist_ok=True)
+    logger.info(f"Ingesting {len(paths)} files into {output} with {workers} workers"
+                f" ({len(writer.done_hashes)} already processed)")
+
+    pending = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+        running = set()
+        while True:
+            # Keep only a bounded number of files in flight so huge inputs do not pile up futures
+            while not stop.is_set() and len(running) < workers * 2:
+                path = next(pending, None)
+                if path is None:
+                    break
+                running.add(pool.submit(ingest_file, path, writer, limiter, in_progress, lock,
+                                        llm_choice, file_deadline, preview_dir))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                progress.record(future.result())
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk invoice ingestion from folders or globs')
+    parser.add_argument('inputs', nargs='+', help='Directories or glob patterns (quote globs, e.g. "share/**/*.pdf")')
+    parser.add_argument('--output', '-o', required=True, help='Output directory for JSONL/CSV results and the processed ledger')
+    parser.add_argument('--workers', '-w', type=int, default=4, help='Files processed in parallel')
+    parser.add_argument('--rate', type=float, default=0.0, help='Max files started per second (0 = unlimited)')
+    parser.add_argument('--llm', default='Mistral', choices=['Mistral', 'OpenRouter', 'Auto'], help='Extraction provider')
+    parser.add_argument('--file-deadline', type=float, default=Config.FILE_DEADLINE_SECONDS, help='Seconds allowed per file')
+    parser.add_argument('--no-recursive', action='store_true', help='Do not descend into subdirectories')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stop = threading.Event()
+    # Stop taking new files on SIGTERM and let the ones in flight finish; the next run skips what was written
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        progress = run_ingest(args.inputs, args.output, args.workers, args.rate, args.llm, args.file_deadline,
+                              not args.no_recursive, args.progress_interval, stop)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.stderr.write(progress.line() + '\n')
+    sys.exit(1 if progress.failed and not progress.ok else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import re
+from typing import List, Optional
+
+# Boundary detection for PDFs that bundle several invoices (supplier
+# statements, scanned stacks). Works on the per-page OCR markdown and groups
+# pages into one invoice each, using:
+#   - "Page 1 of N" / "Page 1/N" markers (a new invoice starts at page 1,
+#     later page numbers always continue the current one)
+#   - a change of invoice number between pages
+#   - a totals block ("Total due", "Amount due", ...) followed by a page that
+#     opens with an invoice header
+# Anything ambiguous stays in the current group, so a normal multi-page
+# invoice is never split.
+
+_PAGE_OF = re.compile(r'\bpage\s*(\d{1,4})\s*(?:of|/)\s*(\d{1,4})\b', re.I)
+_INVOICE_NO = re.compile(
+    r'\b(?:invoice|inv|bill)\s*(?:no\.?|number|num\.?|#)\s*[:#.]?\s*([A-Z0-9][A-Z0-9\-/.]{2,30})',
+    re.I,
+)
+_TOTALS = re.compile(r'\b(?:grand\s+total|total\s+due|amount\s+due|balance\s+due|invoice\s+total|total\s+amount\s+payable)\b', re.I)
+_HEADER = re.compile(r'\b(?:tax\s+invoice|invoice)\b', re.I)
+
+class PageFeatures:
+    def __init__(self, text: str):
+        m = _PAGE_OF.search(text)
+        self.page_number: Optional[int] = int(m.group(1)) if m else None
+        m = _INVOICE_NO.search(text)
+        self.invoice_number: Optional[str] = m.group(1).strip('.').upper() if m else None
+        # Only the top of the page counts as a header; "invoice" in a footer means nothing
+        self.has_header = bool(_HEADER.search(text[:600]))
+        self.has_totals = bool(_TOTALS.search(text))
+
+def split_pages(pages: List[str]) -> List[List[int]]:
+    """Group 0-based page indexes into invoices; a single group means 'one invoice'"""
+    if len(pages) < 2:
+        return [list(range(len(pages)))]
+    features = [PageFeatures(p or '') for p in pages]
+    groups = [[0]]
+    current_number = features[0].invoice_number
+    for i in range(1, len(pages)):
+        f, prev = features[i], features[i - 1]
+        if f.page_number is not None and f.page_number > 1:
+            new_invoice = False  # explicit continuation page
+        elif f.page_number == 1:
+            new_invoice = True
+        elif f.invoice_number and current_number and f.invoice_number != current_number:
+            new_invoice = True
+        else:
+            new_invoice = prev.has_totals and f.has_header
+        if new_invoice:
+            groups.append([i])
+            current_number = f.invoice_number
+        else:
+            groups[-1].append(i)
+            current_number = current_number or f.invoice_number
+    return groups
+
+def page_range_label(group: List[int]) -> str:
+    """1-based, human-readable page range for a group"""
+    first, last = group[0] + 1, group[-1] + 1
+    return str(first) if first == last else f'{first}-{last}'
@@ -0,0 +1,332 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+from serialization import dumps, loads
+
+# Persistent store for extracted invoices. Every processed invoice is written
+# here as it completes (header columns + one row per line item), so lookups
+# such as "all invoices from vendor X last quarter" or "have we seen invoice
+# number N from this vendor" are indexed queries instead of scans over the
+# per-request exports in temp_files/. Processing the same document again
+# (same source hash) replaces its earlier rows.
+# Reporting totals live in a small `rollups` table (per vendor, month and
+# currency) that is adjusted in the same transaction as every insert/delete,
+# so dashboard reads cost the same however much history is stored.
+
+HEADER_FIELDS = [
+    'invoice_number', 'invoice_date', 'due_date', 'gst_number', 'vendor_name', 'vendor_tax_id',
+    'customer_name', 'currency', 'subtotal', 'tax_amount', 'discount_amount', 'total_amount',
+]
+ITEM_FIELDS = ['description', 'quantity', 'unit_price', 'total_price', 'unit', 'sku', 'tax_rate']
+ROLLUP_DIMENSIONS = ('vendor', 'month', 'currency')
+
+def content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def normalize_name(name: Optional[str]) -> str:
+    return ' '.join((name or '').lower().split())
+
+def normalize_id(value: Optional[str]) -> Optional[str]:
+    """Tax/GST ids compare without case, spaces or punctuation"""
+    cleaned = ''.join(c for c in (value or '').upper() if c.isalnum())
+    return cleaned or None
+
+class InvoiceStore:
+    def __init__(self, path: str = None):
+        self.path = path or Config.INVOICE_DB
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS invoices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_hash TEXT,
+                source_file TEXT,
+                source_pages TEXT,
+                job_id TEXT,
+                invoice_number TEXT,
+                invoice_date TEXT,
+                due_date TEXT,
+                gst_number TEXT,
+                vendor_name TEXT,
+                vendor_key TEXT,
+                vendor_id INTEGER,
+                customer_id INTEGER,
+                vendor_tax_id TEXT,
+                customer_name TEXT,
+                currency TEXT,
+                subtotal REAL,
+                tax_amount REAL,
+                discount_amount REAL,
+                total_amount REAL,
+                line_items_count INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS line_items (
+                invoice_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                description TEXT,
+                quantity REAL,
+                unit_price REAL,
+                total_price REAL,
+                unit TEXT,
+                sku TEXT,
+                tax_rate REAL,
+                PRIMARY KEY (invoice_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_invoices_vendor ON invoices (vendor_key, invoice_date);
+            CREATE INDEX IF NOT EXISTS idx_invoices_vendor_tax_id ON invoices (vendor_tax_id);
+            CREATE INDEX IF NOT EXISTS idx_invoices_gst ON invoices (gst_number);
+            CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number);
+            CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date);
+            CREATE INDEX IF NOT EXISTS idx_invoices_due ON invoices (due_date);
+            CREATE INDEX IF NOT EXISTS idx_invoices_source ON invoices (source_hash);
+            CREATE INDEX IF NOT EXISTS idx_line_items_sku ON line_items (sku);
+            CREATE TABLE IF NOT EXISTS rollups (
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                label TEXT,
+                invoice_count INTEGER NOT NULL DEFAULT 0,
+                subtotal REAL NOT NULL DEFAULT 0,
+                tax_amount REAL NOT NULL DEFAULT 0,
+                discount_amount REAL NOT NULL DEFAULT 0,
+                total_amount REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, key, currency)
+            );
+            CREATE INDEX IF NOT EXISTS idx_rollups_total ON rollups (dimension, total_amount);
+        ''')
+        conn = self._conn()
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(invoices)')]
+        for column in ('vendor_id', 'customer_id'):
+            if column not in columns:
+                # Stores created before entity resolution
+                conn.execute(f'ALTER TABLE invoices ADD COLUMN {column} INTEGER')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_invoices_vendor_id ON invoices (vendor_id, invoice_date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_invoices_customer_id ON invoices (customer_id)')
+        if conn.execute('SELECT 1 FROM invoices LIMIT 1').fetchone() and not conn.execute('SELECT 1 FROM rollups LIMIT 1').fetchone():
+            self.rebuild_rollups()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, invoices: List[Dict[str, Any]], source_hash: str = None, job_id: str = None) -> List[int]:
+        """Store the invoices of one document in a single transaction; returns their ids"""
+        conn = self._conn()
+        ids = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if source_hash:
+                self._delete(conn, 'source_hash = ?', (source_hash,))
+            for invoice in invoices:
+                ids.append(self._insert(conn, invoice, source_hash, job_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return ids
+
+    def _insert(self, conn: sqlite3.Connection, invoice: Dict[str, Any], source_hash: Optional[str],
+                job_id: Optional[str]) -> int:
+        items = [item for item in invoice.get('line_items') or [] if isinstance(item, dict)]
+        header = {k: v for k, v in invoice.items() if k != 'line_items'}
+        values = {field: invoice.get(field) for field in HEADER_FIELDS}
+        values['vendor_tax_id'] = normalize_id(values['vendor_tax_id'])
+        values['gst_number'] = normalize_id(values['gst_number'])
+        values['currency'] = (values['currency'] or '').upper() or None
+        # Group by the resolved entity's canonical name when there is one
+        vendor_label = invoice.get('vendor_canonical') or invoice.get('vendor_name')
+        values['vendor_key'] = normalize_name(vendor_label)
+        cur = conn.execute(
+            f'INSERT INTO invoices (source_hash, source_file, source_pages, job_id, vendor_key, vendor_id, customer_id, '
+            f'line_items_count, data, created_at, {", ".join(HEADER_FIELDS)}) '
+            f'VALUES ({", ".join("?" * (10 + len(HEADER_FIELDS)))})',
+            [source_hash, invoice.get('source_file'), invoice.get('source_pages'), job_id, values['vendor_key'],
+             invoice.get('vendor_id'), invoice.get('customer_id'), len(items), dumps(header),
+             time.time()] + [values[f] for f in HEADER_FIELDS],
+        )
+        invoice_id = cur.lastrowid
+        self._roll(conn, values, vendor_label, 1)
+        conn.executemany(
+            f'INSERT INTO line_items (invoice_id, position, {", ".join(ITEM_FIELDS)}) '
+            f'VALUES ({", ".join("?" * (2 + len(ITEM_FIELDS)))})',
+            [[invoice_id, position] + [item.get(f) for f in ITEM_FIELDS] for position, item in enumerate(items, 1)],
+        )
+        return invoice_id
+
+    def _delete(self, conn: sqlite3.Connection, where: str, params: tuple) -> List[sqlite3.Row]:
+        rows = conn.execute(f'SELECT * FROM invoices WHERE {where}', params).fetchall()
+        for row in rows:
+            self._roll(conn, row, None, -1)
+            conn.execute('DELETE FROM line_items WHERE invoice_id = ?', (row['id'],))
+            conn.execute('DELETE FROM invoices WHERE id = ?', (row['id'],))
+        return rows
+
+    @staticmethod
+    def _roll(conn: sqlite3.Connection, values, vendor_label: Optional[str], sign: int) -> None:
+        """Add (sign=1) or remove (sign=-1) one invoice from every rollup it belongs to"""
+        currency = values['currency'] or ''
+        keys = {
+            'vendor': (values['vendor_key'] or '', vendor_label),
+            'month': ((values['invoice_date'] or '')[:7], None),
+            'currency': (currency, None),
+        }
+        amounts = [sign * float(values[f] or 0) for f in ('subtotal', 'tax_amount', 'discount_amount', 'total_amount')]
+        for dimension, (key, label) in keys.items():
+            conn.execute(
+                'INSERT INTO rollups (dimension, key, currency, label, invoice_count, subtotal, tax_amount, '
+                'discount_amount, total_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (dimension, key, currency) DO UPDATE SET '
+                'label = COALESCE(excluded.label, label), invoice_count = invoice_count + excluded.invoice_count, '
+                'subtotal = subtotal + excluded.subtotal, tax_amount = tax_amount + excluded.tax_amount, '
+                'discount_amount = discount_amount + excluded.discount_amount, '
+                'total_amount = total_amount + excluded.total_amount',
+                [dimension, key, currency, label, sign] + amounts,
+            )
+        if sign < 0:
+            conn.execute('DELETE FROM rollups WHERE invoice_count <= 0')
+
+    def rebuild_rollups(self) -> None:
+        """Recompute the rollups from the stored invoices (for databases created before them)"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM rollups')
+            for row in conn.execute('SELECT * FROM invoices').fetchall():
+                self._roll(conn, row, loads(row['data']).get('vendor_canonical') or row['vendor_name'], 1)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self, dimension: str = 'currency', key: str = None, currency: str = None,
+              limit: int = 50) -> List[Dict[str, Any]]:
+        """Rollup rows for one dimension: vendors by total, months newest first, or currencies"""
+        if dimension not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unknown dimension {dimension!r}; expected one of {', '.join(ROLLUP_DIMENSIONS)}")
+        clauses, params = ['dimension = ?'], [dimension]
+        if key is not None:
+            clauses.append('key = ?')
+            params.append(normalize_name(key) if dimension == 'vendor' else key)
+        if currency:
+            clauses.append('currency = ?')
+            params.append(currency.upper())
+        order = {'vendor': 'total_amount DESC', 'month': 'key DESC', 'currency': 'invoice_count DESC'}[dimension]
+        rows = self._conn().execute(
+            f"SELECT * FROM rollups WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT ?",
+            params + [max(1, min(int(limit), Config.INVOICE_QUERY_MAX_LIMIT))],
+        )
+        return [{
+            'key': row['label'] or row['key'], 'currency': row['currency'] or None,
+            'invoice_count': row['invoice_count'], 'subtotal': round(row['subtotal'], 2),
+            'tax_amount': round(row['tax_amount'], 2), 'discount_amount': round(row['discount_amount'], 2),
+            'total_amount': round(row['total_amount'], 2),
+            'average_amount': round(row['total_amount'] / row['invoice_count'], 2) if row['invoice_count'] else 0,
+        } for row in rows]
+
+    def get(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        """Full invoice including line items"""
+        conn = self._conn()
+        row = conn.execute('SELECT * FROM invoices WHERE id = ?', (invoice_id,)).fetchone()
+        if row is None:
+            return None
+        invoice = self._header(row)
+        items = conn.execute('SELECT * FROM line_items WHERE invoice_id = ? ORDER BY position', (invoice_id,))
+        invoice['line_items'] = [{f: item[f] for f in ITEM_FIELDS} for item in items]
+        return invoice
+
+    @staticmethod
+    def _header(row: sqlite3.Row) -> Dict[str, Any]:
+        invoice = loads(row['data'])
+        invoice['invoice_id'] = row['id']
+        invoice['line_items_count'] = row['line_items_count']
+        return invoice
+
+    def query(self, vendor: str = None, tax_id: str = None, invoice_number: str = None, date_from: str = None,
+              date_to: str = None, source_hash: str = None, currency: str = None, vendor_id: int = None,
+              cursor: int = None, limit: int = 50) -> Dict[str, Any]:
+        """Invoice headers matching all given filters, newest first.
+
+        `vendor` matches a name prefix (case-insensitive); `tax_id` matches the
+        vendor tax id or GST number. Pages are keyset-paginated: pass the
+        returned `next_cursor` to get the following page.
+        """
+        clauses, params = [], []
+        if vendor:
+            key = normalize_name(vendor)
+            clauses.append('vendor_key >= ? AND vendor_key < ?')
+            params += [key, key + '\uffff']
+        if vendor_id:
+            clauses.append('vendor_id = ?')
+            params.append(vendor_id)
+        if tax_id:
+            clauses.append('(vendor_tax_id = ? OR gst_number = ?)')
+            params += [normalize_id(tax_id)] * 2
+        if invoice_number:
+            clauses.append('invoice_number = ?')
+            params.append(invoice_number)
+        if date_from:
+            clauses.append('invoice_date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('invoice_date <= ?')
+            params.append(date_to)
+        if source_hash:
+            clauses.append('source_hash = ?')
+            params.append(source_hash)
+        if currency:
+            clauses.append('currency = ?')
+            params.append(currency.upper())
+        if cursor:
+            clauses.append('id < ?')
+            params.append(cursor)
+        limit = max(1, min(int(limit), Config.INVOICE_QUERY_MAX_LIMIT))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._conn().execute(
+            f'SELECT * FROM invoices {where} ORDER BY id DESC LIMIT ?', params + [limit + 1]
+        ).fetchall()
+        invoices = [self._header(row) for row in rows[:limit]]
+        next_cursor = invoices[-1]['invoice_id'] if len(rows) > limit else None
+        return {'invoices': invoices, 'next_cursor': next_cursor}
+
+    def find_duplicates(self, invoice_number: str, vendor_name: str = None, vendor_tax_id: str = None,
+                        vendor_id: int = None) -> List[int]:
+        """Ids of stored invoices with the same number from the same vendor (by entity or tax id when known)"""
+        if not invoice_number:
+            return []
+        tax_id = normalize_id(vendor_tax_id)
+        if vendor_id:
+            rows = self._conn().execute('SELECT id FROM invoices WHERE invoice_number = ? AND vendor_id = ?',
+                                        (invoice_number, vendor_id))
+        elif tax_id:
+            rows = self._conn().execute('SELECT id FROM invoices WHERE invoice_number = ? AND vendor_tax_id = ?',
+                                        (invoice_number, tax_id))
+        else:
+            rows = self._conn().execute('SELECT id FROM invoices WHERE invoice_number = ? AND vendor_key = ?',
+                                        (invoice_number, normalize_name(vendor_name)))
+        return [row['id'] for row in rows]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> InvoiceStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = InvoiceStore()
+        return _store
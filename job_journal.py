@@ -0,0 +1,182 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from config import Config
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Append-only, fsync'd JSONL journal per job. Every file's stage transitions
+# (saved -> ocr -> extracted | failed) are recorded as they happen, together
+# with the OCR text and extracted invoice, so a restarted process can resume
+# incomplete jobs from the last finished stage instead of paying for OCR and
+# extraction again. The journal file is flock'ed while a process works on the
+# job, which keeps other workers (and the startup resumer) away from it.
+# Files are keyed by a per-batch entry id (upload index + filename), since one
+# batch can hold several uploads with the same name; the filename is for display.
+
+FILE_STAGES = ('saved', 'ocr', 'extracted', 'failed')
+
+def entry_id(index: int, filename: str) -> str:
+    """Journal/export key of the upload at `index` in its batch"""
+    return f'{index}_{filename}'
+
+def entry_key(entry: Dict[str, Any]) -> str:
+    # Journals written before entry ids were keyed by filename
+    return entry.get('id') or entry['filename']
+
+class JobJournal:
+    def __init__(self, job_id: str, directory: str = None):
+        self.job_id = job_id
+        self.directory = directory or Config.JOURNAL_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{job_id}.jsonl')
+        self._lock = threading.Lock()
+        self._fh = open(self.path, 'a+', encoding='utf-8')
+        self._terminate_torn_line()
+
+    def _terminate_torn_line(self) -> None:
+        # After a crash mid-write, start the next record on its own line
+        size = self._fh.seek(0, os.SEEK_END)
+        if size:
+            with open(self.path, 'rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    self._fh.write('\n')
+                    self._fh.flush()
+
+    def try_lock(self) -> bool:
+        """Take the per-job lock; released automatically if this process dies"""
+        try:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def append(self, event: str, **data) -> None:
+        record = {'event': event, 'ts': datetime.now().isoformat(), **data}
+        line = dumps(record) + '\n'
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def start(self, options: Dict[str, Any], files: List[Dict[str, str]]) -> None:
+        self.append('job_started', job_id=self.job_id, options=options, files=files)
+
+    def file_stage(self, key: str, stage: str, **data) -> None:
+        self.append('file_stage', file=key, stage=stage, **data)
+
+    def checkpoint_for(self, key: str) -> Callable[[str, Dict[str, Any]], None]:
+        """Callback for pipeline.process_file that journals each finished stage of entry `key`"""
+        return lambda stage, data: self.file_stage(key, stage, **data)
+
+    def complete(self, **data) -> None:
+        self.append('job_completed', **data)
+
+    def close(self) -> None:
+        try:
+            self._fh.close()  # also drops the flock
+        except Exception:
+            pass
+
+def load_state(path: str) -> Optional[Dict[str, Any]]:
+    """Replay a journal into {job_id, options, files: {entry key: {...}}, order, completed, result}"""
+    state = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from a crash mid-write
+                continue
+            event = rec.get('event')
+            if event == 'job_started':
+                state = {
+                    'job_id': rec['job_id'],
+                    'options': rec.get('options', {}),
+                    'order': [entry_key(f) for f in rec.get('files', [])],
+                    'files': {entry_key(f): {'stage': None, **f} for f in rec.get('files', [])},
+                    'completed': False,
+                    'result': None,
+                }
+            elif state is None:
+                continue
+            elif event == 'file_stage':
+                entry = state['files'].setdefault(rec['file'], {'filename': rec['file'], 'stage': None})
+                if rec['file'] not in state['order']:
+                    state['order'].append(rec['file'])
+                entry['stage'] = rec['stage']
+                for key, value in rec.items():
+                    if key not in ('event', 'ts', 'file', 'stage'):
+                        entry[key] = value
+            elif event == 'job_completed':
+                state['completed'] = True
+                state['result'] = {k: v for k, v in rec.items() if k not in ('event', 'ts')}
+    return state
+
+def journal_path(job_id: str, directory: str = None) -> str:
+    return os.path.join(directory or Config.JOURNAL_DIR, f'{job_id}.jsonl')
+
+def get_state(job_id: str, directory: str = None) -> Optional[Dict[str, Any]]:
+    path = journal_path(job_id, directory)
+    if not os.path.exists(path):
+        return None
+    return load_state(path)
+
+def incomplete_jobs(directory: str = None) -> List[Dict[str, Any]]:
+    directory = directory or Config.JOURNAL_DIR
+    if not os.path.isdir(directory):
+        return []
+    states = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.jsonl'):
+            continue
+        try:
+            state = load_state(os.path.join(directory, name))
+        except OSError as e:
+            logger.warning(f"Unreadable journal {name}: {e}")
+            continue
+        if state and not state['completed']:
+            states.append(state)
+        elif _expired(os.path.join(directory, name)):
+            # Completed (or abandoned empty) journals are only kept for the retention window
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return states
+
+def _expired(path: str) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) > Config.JOURNAL_RETENTION_DAYS * 86400
+    except OSError:
+        return False
+
+def resume_incomplete_jobs(runner: Callable[[Dict[str, Any], 'JobJournal'], None], directory: str = None) -> int:
+    """Run `runner(state, journal)` for each incomplete job no other live process holds"""
+    resumed = 0
+    for state in incomplete_jobs(directory):
+        journal = JobJournal(state['job_id'], directory)
+        if not journal.try_lock():
+            journal.close()
+            continue
+        # Re-read under the lock: the owner may have finished since the scan
+        state = load_state(journal.path)
+        if state is None or state['completed']:
+            journal.close()
+            continue
+        try:
+            logger.info(f"Resuming job {state['job_id']}")
+            runner(state, journal)
+            resumed += 1
+        except Exception as e:
+            logger.exception(f"Resuming job {state['job_id']} failed: {e}")
+        finally:
+            journal.close()
+    return resumed
@@ -1,14 +1,14 @@
 import json
+import logging
 import re
 from typing import Any, Dict, List
-from mistralai import Mistral, TextChunk, ImageURLChunk
-from openai import OpenAI
+from mistralai import TextChunk, ImageURLChunk
 from config import Config
 from models import InvoiceData
+from clients import get_async_client, get_mistral_client, get_openrouter_client
+from deadlines import DeadlineExceeded, client_timeout_kwargs
 
-# Initialize clients
-mistral_client = Mistral(api_key=Config.MISTRAL_API_KEY) if Config.MISTRAL_API_KEY else None
-openrouter_client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=Config.OPENROUTER_API_KEY) if Config.OPENROUTER_API_KEY else None
+logger = logging.getLogger(__name__)
 
 def _create_invoice_extraction_prompt(ocr_text: str) -> str:
     """Create the prompt for invoice data extraction"""
@@ -69,8 +69,9 @@ You are an expert invoice data extraction specialist. Extract ALL information fr
 Return ONLY valid JSON that matches the structure above. Include all line items found in the invoice.
 """
 
-def _mistral_parse(chunks) -> Dict[str, Any]:
+def _mistral_parse(chunks, deadline=None) -> Dict[str, Any]:
     """Parse invoice data using Mistral"""
+    mistral_client = get_mistral_client()
     if not mistral_client:
         raise RuntimeError("Mistral API key not configured")
     
@@ -80,15 +81,20 @@ def _mistral_parse(chunks) -> Dict[str, Any]:
             messages=[{"role": "user", "content": chunks}],
             response_format=InvoiceData,
             temperature=0,
+            **client_timeout_kwargs(deadline, 'mistral'),
         )
-        return json.loads(chat.choices[0].message.parsed.model_dump_json())
+        return chat.choices[0].message.parsed.model_dump(mode='json')
     except Exception as e:
+        # No point retrying once the time budget is spent
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded(deadline.label, deadline.budget) from e
         # If structured parsing fails, try regular chat completion
-        print(f"Structured parsing failed, trying regular completion: {str(e)}")
+        logger.debug(f"Structured parsing failed, trying regular completion: {str(e)}")
         chat = mistral_client.chat.complete(
             model=Config.DEFAULT_MODEL,
             messages=[{"role": "user", "content": chunks}],
             temperature=0,
+            **client_timeout_kwargs(deadline, 'mistral'),
         )
         raw_response = chat.choices[0].message.content
         return _extract_json(raw_response)
@@ -106,17 +112,25 @@ def _extract_json(text: str) -> dict:
                 pass
         raise ValueError("Failed to extract valid JSON from OpenRouter response.")
 
-def _openrouter_parse(prompt_text, img_url) -> Dict[str, Any]:
+def _openrouter_parse(prompt_text, img_url, deadline=None) -> Dict[str, Any]:
     """Parse invoice data using OpenRouter"""
+    openrouter_client = get_openrouter_client()
     if not openrouter_client:
         raise RuntimeError("OpenRouter API key not configured")
     
+    completion = openrouter_client.chat.completions.create(
+        **_openrouter_request(prompt_text, img_url),
+        **client_timeout_kwargs(deadline, 'openai'),
+    )
+    raw = completion.choices[0].message.content.strip()
+    return _extract_json(raw)
+
+def _openrouter_request(prompt_text, img_url) -> Dict[str, Any]:
     content = []
     if img_url:
         content.append({"type": "image_url", "image_url": {"url": img_url}})
     content.append({"type": "text", "text": prompt_text})
-    
-    completion = openrouter_client.chat.completions.create(
+    return dict(
         model=Config.OPENROUTER_MODEL,
         messages=[{"role": "user", "content": content}],
         temperature=0,
@@ -125,5 +139,76 @@ def _openrouter_parse(prompt_text, img_url) -> Dict[str, Any]:
             "HTTP-Referer": "https://localhost"
         },
     )
-    raw = completion.choices[0].message.content.strip()
-    return _extract_json(raw)
\ No newline at end of file
+
+def _mistral_chunks(prompt_text: str, preview_url) -> list:
+    chunks = [TextChunk(text=prompt_text)]
+    if isinstance(preview_url, str) and preview_url.startswith("data:image"):
+        chunks = [ImageURLChunk(image_url=preview_url)] + chunks
+    return chunks
+
+def _image_arg(preview_url):
+    return preview_url if (isinstance(preview_url, str) and preview_url.startswith("data:image")) else None
+
+def _extract_with_provider(provider: str, prompt_text: str, preview_url, deadline=None) -> Dict[str, Any]:
+    """Run invoice extraction against a single provider ('Mistral' or 'OpenRouter')"""
+    if provider == 'Mistral':
+        return _mistral_parse(_mistral_chunks(prompt_text, preview_url), deadline)
+    if provider == 'OpenRouter':
+        return _openrouter_parse(prompt_text, _image_arg(preview_url), deadline)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+def _configured_providers() -> List[str]:
+    """Providers that have an API key configured, in default preference order"""
+    providers = []
+    if Config.MISTRAL_API_KEY:
+        providers.append('Mistral')
+    if Config.OPENROUTER_API_KEY:
+        providers.append('OpenRouter')
+    return providers
+
+async def _mistral_parse_async(chunks, deadline=None) -> Dict[str, Any]:
+    """Async variant of _mistral_parse"""
+    mistral_client = get_async_client('mistral')
+    if not mistral_client:
+        raise RuntimeError("Mistral API key not configured")
+
+    try:
+        chat = await mistral_client.chat.parse_async(
+            model=Config.DEFAULT_MODEL,
+            messages=[{"role": "user", "content": chunks}],
+            response_format=InvoiceData,
+            temperature=0,
+            **client_timeout_kwargs(deadline, 'mistral'),
+        )
+        return chat.choices[0].message.parsed.model_dump(mode='json')
+    except Exception as e:
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded(deadline.label, deadline.budget) from e
+        logger.debug(f"Structured parsing failed, trying regular completion: {str(e)}")
+        chat = await mistral_client.chat.complete_async(
+            model=Config.DEFAULT_MODEL,
+            messages=[{"role": "user", "content": chunks}],
+            temperature=0,
+            **client_timeout_kwargs(deadline, 'mistral'),
+        )
+        return _extract_json(chat.choices[0].message.content)
+
+async def _openrouter_parse_async(prompt_text, img_url, deadline=None) -> Dict[str, Any]:
+    """Async variant of _openrouter_parse"""
+    openrouter_client = get_async_client('openrouter')
+    if not openrouter_client:
+        raise RuntimeError("OpenRouter API key not configured")
+
+    completion = await openrouter_client.chat.completions.create(
+        **_openrouter_request(prompt_text, img_url),
+        **client_timeout_kwargs(deadline, 'openai'),
+    )
+    return _extract_json(completion.choices[0].message.content.strip())
+
+async def _extract_with_provider_async(provider: str, prompt_text: str, preview_url, deadline=None) -> Dict[str, Any]:
+    """Async variant of _extract_with_provider"""
+    if provider == 'Mistral':
+        return await _mistral_parse_async(_mistral_chunks(prompt_text, preview_url), deadline)
+    if provider == 'OpenRouter':
+        return await _openrouter_parse_async(prompt_text, _image_arg(preview_url), deadline)
+    raise ValueError(f"Unknown LLM provider: {provider}")
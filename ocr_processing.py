@@ -1,15 +1,22 @@
 import base64
 import mimetypes
 import os
-from mistralai import Mistral, DocumentURLChunk, ImageURLChunk
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from mistralai import DocumentURLChunk, ImageURLChunk
 from mistralai.models import OCRResponse
 from config import Config
+from clients import get_async_client, get_mistral_client
+from deadlines import client_timeout_kwargs
+from cpu_pool import data_url, data_url_async, file_size, run_cpu, split_pdf
 
-# Initialize Mistral client
-mistral_client = Mistral(api_key=Config.MISTRAL_API_KEY) if Config.MISTRAL_API_KEY else None
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
 
-def _merge_md(resp: OCRResponse) -> str:
-    """Merge markdown pages from OCR response"""
+def _page_markdown(resp: OCRResponse) -> List[str]:
+    """Markdown per page from an OCR response, with inline images resolved"""
     md_pages = []
     for p in resp.pages:
         imgs = {i.id: i.image_base64 for i in p.images}
@@ -17,39 +24,83 @@ def _merge_md(resp: OCRResponse) -> str:
         for iid, b64 in imgs.items():
             md = md.replace(f"![{iid}]({iid})", f"![{iid}]({b64})")
         md_pages.append(md)
-    return "\n\n".join(md_pages)
+    return md_pages
 
-def ocr_pdf(path: str) -> tuple[str, str]:
-    """Process PDF file with OCR and return merged markdown and data URL"""
-    if not mistral_client:
-        raise RuntimeError("Mistral API key not configured")
-    
-    with open(path, "rb") as f: 
-        data = f.read()
-    b64 = base64.b64encode(data).decode()
-    url = f"data:application/pdf;base64,{b64}"
-    
+def _merge_md(resp: OCRResponse) -> str:
+    """Merge markdown pages from OCR response"""
+    return "\n\n".join(_page_markdown(resp))
+
+def ocr_pdf(path: str, deadline=None, pages: List[int] = None) -> tuple[str, str]:
+    """Process PDF file with OCR and return merged markdown and data URL.
+    An optional Deadline bounds the OCR call; `pages` limits it to those 0-based pages.
+    """
+    md_pages, url = ocr_pdf_pages(path, deadline, [pages] if pages is not None else None)
+    return ("\n\n".join(md_pages), url)
+
+def _ocr_pdf_url(mistral_client, url: str, deadline=None, pages: List[int] = None) -> List[str]:
+    kwargs = {'pages': pages} if pages is not None else {}
     resp = mistral_client.ocr.process(
         document=DocumentURLChunk(document_url=url),
         model=Config.OCR_MODEL,
         include_image_base64=False,
+        **kwargs,
+        **client_timeout_kwargs(deadline, 'mistral'),
     )
-    return (_merge_md(resp), url)
+    return _page_markdown(resp)
+
+def _ocr_pdf_chunk(mistral_client, path: str, deadline=None) -> List[str]:
+    url = data_url(path, "application/pdf")
+    return _ocr_pdf_url(mistral_client, url, deadline)
 
-def ocr_image(uploaded_file_or_path) -> tuple[str, str]:
+def ocr_pdf_pages(path: str, deadline=None, page_groups: List[List[int]] = None) -> tuple[List[str], str]:
+    """OCR a PDF and return markdown per page plus the data URL.
+    With `page_groups`, each group is a separate request and the groups run in parallel.
+    The groups are split into their own PDFs locally, so each request uploads only
+    its pages; no data URL of the whole document is built then (None is returned).
+    """
+    mistral_client = get_mistral_client()
+    if not mistral_client:
+        raise RuntimeError("Mistral API key not configured")
+
+    workers = max(1, min(len(page_groups or []), Config.OCR_CHUNK_CONCURRENCY))
+    if page_groups and len(page_groups) > 1 and pypdf is not None:
+        chunk_paths = run_cpu(split_pdf, path, page_groups, size=file_size(path))
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr-chunk') as pool:
+                parts = list(pool.map(lambda chunk: _ocr_pdf_chunk(mistral_client, chunk, deadline), chunk_paths))
+        finally:
+            for chunk in chunk_paths:
+                try:
+                    os.remove(chunk)
+                except OSError:
+                    pass
+        return ([page for part in parts for page in part], None)
+
+    # Encoding happens in the CPU pool, which reads the file itself
+    url = data_url(path, "application/pdf")
+    if not page_groups:
+        return (_ocr_pdf_url(mistral_client, url, deadline), url)
+    if len(page_groups) == 1:
+        return (_ocr_pdf_url(mistral_client, url, deadline, page_groups[0]), url)
+    # Without pypdf every chunk request carries the whole document and selects its pages
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr-chunk') as pool:
+        parts = list(pool.map(lambda pages: _ocr_pdf_url(mistral_client, url, deadline, pages), page_groups))
+    return ([page for part in parts for page in part], url)
+
+def ocr_image(uploaded_file_or_path, deadline=None, mime: str = None) -> tuple[str, str]:
     """Process image file with OCR and return merged markdown and data URL.
     Accepts either a Werkzeug file-like object OR a filesystem path string.
+    An optional Deadline bounds the OCR call.
     """
+    mistral_client = get_mistral_client()
     if not mistral_client:
         raise RuntimeError("Mistral API key not configured")
 
     # Determine if we received a path (str) or a file-like object
     if isinstance(uploaded_file_or_path, str):
-        # Treat as filesystem path
+        # Treat as filesystem path; the CPU pool reads and encodes it
         path = uploaded_file_or_path
-        with open(path, "rb") as f:
-            data = f.read()
-        filename = os.path.basename(path)
+        url = data_url(path, mime)
     else:
         # Treat as file-like object from Flask
         fobj = uploaded_file_or_path
@@ -60,13 +111,35 @@ def ocr_image(uploaded_file_or_path) -> tuple[str, str]:
             pass
         filename = getattr(fobj, "filename", "image.jpg")
 
-    b64 = base64.b64encode(data).decode()
-    mime = mimetypes.guess_type(filename)[0] or "image/jpeg"
-    url = f"data:{mime};base64,{b64}"
+        b64 = base64.b64encode(data).decode()
+        mime = mimetypes.guess_type(filename)[0] or "image/jpeg"
+        url = f"data:{mime};base64,{b64}"
 
     resp = mistral_client.ocr.process(
         document=ImageURLChunk(image_url=url),
         model=Config.OCR_MODEL,
         include_image_base64=False,
+        **client_timeout_kwargs(deadline, 'mistral'),
     )
     return (_merge_md(resp), url)
+
+async def ocr_file_pages_async(path: str, deadline=None, mime: str = None) -> tuple[List[str], str]:
+    """Async OCR for a PDF or image path using the Mistral SDK's async methods; markdown per page"""
+    mistral_client = get_async_client('mistral')
+    if not mistral_client:
+        raise RuntimeError("Mistral API key not configured")
+
+    # Encoding multi-MB files is CPU work; keep it off the event loop
+    url = await data_url_async(path, mime)
+    if url.startswith("data:application/pdf"):
+        document = DocumentURLChunk(document_url=url)
+    else:
+        document = ImageURLChunk(image_url=url)
+
+    resp = await mistral_client.ocr.process_async(
+        document=document,
+        model=Config.OCR_MODEL,
+        include_image_base64=False,
+        **client_timeout_kwargs(deadline, 'mistral'),
+    )
+    return (_page_markdown(resp), url)
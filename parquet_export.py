@@ -0,0 +1,137 @@
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from config import Config
+from csv_conversion import DETAILED_COLUMNS, SUMMARY_COLUMNS, iter_detailed_rows, iter_summary_rows
+from models import InvoiceData, LineItem
+from serialization import loads
+
+# Typed columnar exports. The detailed and summary tables are written as
+# Parquet with the same columns as the CSVs, but typed from the models: amounts
+# are float64, counters int32, the YYYY-MM-DD fields date32 and everything else
+# a string, with nulls kept as nulls instead of empty strings. Rows are
+# buffered per column and flushed as one row group every PARQUET_ROW_GROUP_ROWS
+# rows, so memory is bounded by the row group, not the batch.
+# pyarrow is optional; without it the Parquet exports are simply not offered.
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Export columns that are not named after their model field
+_FIELD_FOR_COLUMN = {'item_description': 'description', 'line_total': 'total_price'}
+_INT_COLUMNS = ('file_number', 'line_item_number', 'line_items_count')
+
+def available() -> bool:
+    return pa is not None
+
+@lru_cache(maxsize=None)
+def column_type(column: str) -> str:
+    """'int', 'float', 'date' or 'str' for an export column, from its model field"""
+    if column in _INT_COLUMNS:
+        return 'int'
+    name = _FIELD_FOR_COLUMN.get(column, column)
+    field = InvoiceData.model_fields.get(name) or LineItem.model_fields.get(name)
+    if field is None:
+        return 'str'
+    if 'YYYY-MM-DD' in (field.description or ''):
+        return 'date'
+    if float in (field.annotation, *getattr(field.annotation, '__args__', ())):
+        return 'float'
+    return 'str'
+
+def columns(kind: str) -> List[str]:
+    return DETAILED_COLUMNS if kind == 'detailed' else SUMMARY_COLUMNS
+
+def schema(kind: str):
+    """Arrow schema for the 'detailed' or 'summary' export"""
+    arrow_types = {'int': pa.int32(), 'float': pa.float64(), 'date': pa.date32(), 'str': pa.string()}
+    return pa.schema([(c, arrow_types[column_type(c)]) for c in columns(kind)])
+
+def _to_float(value) -> Optional[float]:
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+def _to_date(value) -> Optional[date]:
+    # Anything that is not a calendar date is dropped; the raw text stays in the JSON export
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+def _to_str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+_CONVERTERS = {'int': _to_int, 'float': _to_float, 'date': _to_date, 'str': _to_str}
+
+def typed_rows(kind: str, invoice: Dict[str, Any], file_number: int) -> Iterator[list]:
+    """One invoice's export rows with each value converted to its column type"""
+    convert = [_CONVERTERS[column_type(c)] for c in columns(kind)]
+    rows = iter_detailed_rows if kind == 'detailed' else iter_summary_rows
+    for row in rows([invoice], file_number):
+        yield [fn(value) for fn, value in zip(convert, row)]
+
+class ParquetExportWriter:
+    """A 'detailed' or 'summary' Parquet file written one row group at a time"""
+
+    def __init__(self, path: str, kind: str, row_group_rows: int = None, compression: str = None):
+        self.path = path
+        self.kind = kind
+        self.schema = schema(kind)
+        self.row_group_rows = row_group_rows or Config.PARQUET_ROW_GROUP_ROWS
+        self._columns: List[list] = [[] for _ in self.schema]
+        self._writer = pq.ParquetWriter(path, self.schema, compression=compression or Config.PARQUET_COMPRESSION)
+        self.invoice_count = 0
+
+    def add(self, invoices: List[Dict[str, Any]]) -> None:
+        """Append invoices; file_number continues from the invoices already written"""
+        for invoice in invoices:
+            self.invoice_count += 1
+            for row in typed_rows(self.kind, invoice, self.invoice_count):
+                for column, value in zip(self._columns, row):
+                    column.append(value)
+                if len(self._columns[0]) >= self.row_group_rows:
+                    self._flush()
+
+    def _flush(self) -> None:
+        if not self._columns[0]:
+            return
+        table = pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(self._columns, self.schema)],
+                                     schema=self.schema)
+        self._writer.write_table(table, row_group_size=len(self._columns[0]))
+        self._columns = [[] for _ in self.schema]
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self) -> 'ParquetExportWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def write_parquet(kind: str, invoices: Iterable[Dict[str, Any]], path: str) -> str:
+    """Write invoices (any iterable, consumed once) as a Parquet export"""
+    with ParquetExportWriter(path, kind) as writer:
+        for invoice in invoices:
+            writer.add([invoice])
+    return path
+
+def iter_jsonl(path: str) -> Iterable[Dict[str, Any]]:
+    """Invoices from a JSONL export, one at a time"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
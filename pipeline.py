@@ -0,0 +1,344 @@
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from ocr_processing import ocr_pdf_pages, ocr_image
+from invoice_splitting import page_range_label, split_pages
+from preflight import PreflightReport, cleanup as preflight_cleanup, page_chunks, preflight
+from config import Config
+from llm_wrappers import _extract_with_provider, _create_invoice_extraction_prompt
+from provider_routing import router as provider_router
+from deadlines import DeadlineExceeded, FileBudget
+from cpu_pool import data_url, decode_to_file, file_size, run_cpu
+from dedup import get_index as get_dedup_index, image_hash
+from invoice_store import content_hash, get_store as get_invoice_store
+from entities import get_index as get_entity_index
+
+logger = logging.getLogger(__name__)
+
+# Per-file processing steps shared by the Flask handler and the async pipeline:
+# OCR -> preview -> LLM extraction -> validation -> metadata, then batch exports.
+
+PREVIEW_DIR = os.path.join('public', 'previews')
+TEMP_DIR = 'temp_files'
+
+class DocumentError(ValueError):
+    """A document, or its extraction, that cannot be processed; retrying it would fail the same way"""
+
+NUMERIC_FIELDS = ['subtotal', 'tax_amount', 'discount_amount', 'total_amount']
+ITEM_NUMERIC_FIELDS = ['quantity', 'unit_price', 'total_price', 'tax_rate']
+
+def run_ocr(file_path: str, filename: str, deadline=None,
+            report: Optional[PreflightReport] = None) -> Tuple[List[str], str]:
+    """OCR a saved upload into markdown per page, dispatching on the preflight route (or the extension without one)"""
+    route = report.action if report is not None else None
+    is_pdf = report.kind == 'pdf' if report is not None else filename.lower().endswith('.pdf')
+    if route == 'local_text':
+        logger.info(f"Using embedded text layer of {filename} ({report.pages} pages), skipping OCR")
+        md_pages, preview_url = report.page_texts, None
+    elif route == 'split':
+        logger.info(f"Processing PDF file: {filename} in chunks ({report.pages} pages)")
+        md_pages, preview_url = ocr_pdf_pages(file_path, deadline, page_chunks(report.pages))
+    elif is_pdf:
+        logger.info(f"Processing PDF file: {filename}")
+        md_pages, preview_url = ocr_pdf_pages(file_path, deadline)
+    else:
+        logger.info(f"Processing Image file: {filename}")
+        image_path = report.ocr_path if report is not None and report.ocr_path else file_path
+        md, preview_url = ocr_image(image_path, deadline=deadline, mime=report.mime if report is not None else None)
+        md_pages = [md] if md is not None else None
+    if md_pages is None:
+        raise DocumentError("OCR returned no metadata")
+    return md_pages, preview_url
+
+def invoice_groups(md_pages: List[str]) -> List[List[int]]:
+    """Page groups holding one invoice each (a single group unless splitting is enabled and boundaries are found)"""
+    if not Config.INVOICE_SPLIT_ENABLED:
+        return [list(range(len(md_pages)))]
+    return split_pages(md_pages)
+
+def persist_preview(filename: str, file_path: str, preview_url, preview_dir: str = PREVIEW_DIR) -> Optional[str]:
+    """Save a lightweight image preview under /public/previews and return its public URL"""
+    try:
+        os.makedirs(preview_dir, exist_ok=True)
+        saved_preview_path = None
+        safe_base = os.path.splitext(filename)[0]
+        is_image = filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+        if isinstance(preview_url, str) and preview_url.startswith('data:image'):
+            m = re.match(r'data:image/(png|jpeg|jpg);base64,', preview_url)
+            ext = m.group(1) if m else 'png'
+            saved_preview_path = os.path.join(preview_dir, f'{safe_base}.preview.{ext}')
+            if is_image and os.path.exists(file_path):
+                # The data URL is just the encoded upload; copying the file avoids decoding it
+                shutil.copyfile(file_path, saved_preview_path)
+            else:
+                # data URL -> save to file; decoded here, since shipping the text to the pool costs as much
+                b64 = preview_url[m.end():] if m else preview_url.split(',', 1)[-1]
+                decode_to_file(b64, saved_preview_path)
+        elif is_image and os.path.exists(file_path):
+            # If original is an image and still exists, copy as preview (named by the
+            # copied file, which may be a downscaled JPEG of a PNG upload)
+            ext = os.path.splitext(file_path)[1].lstrip('.').lower() or 'png'
+            saved_preview_path = os.path.join(preview_dir, f'{safe_base}.preview.{ext}')
+            shutil.copyfile(file_path, saved_preview_path)
+        if saved_preview_path and os.path.exists(saved_preview_path):
+            return '/public/previews/' + os.path.basename(saved_preview_path)
+        if isinstance(preview_url, str) and preview_url.startswith('data:image'):
+            # fallback keep original data url
+            return preview_url
+        logger.warning("No preview available to persist for UI")
+    except Exception as p_err:
+        logger.warning(f"Preview persistence failed: {p_err}")
+    return None
+
+def extract_invoice(llm_choice: str, prompt: str, preview_url, deadline=None) -> Dict[str, Any]:
+    """Run LLM extraction with the requested provider ('Auto' routes by observed latency)"""
+    if llm_choice == 'Auto':
+        # Fastest healthy provider, hedged to the other one past its p95
+        return provider_router.extract(prompt, preview_url, deadline)
+    if llm_choice == 'Mistral':
+        return _extract_with_provider('Mistral', prompt, preview_url, deadline)
+    return _extract_with_provider('OpenRouter', prompt, preview_url, deadline)
+
+def clean_invoice_data(invoice_data) -> Dict[str, Any]:
+    """Validate the LLM result and coerce numeric fields to floats"""
+    if not isinstance(invoice_data, dict):
+        raise DocumentError("Invalid data structure returned from LLM")
+
+    for field in NUMERIC_FIELDS:
+        if field in invoice_data:
+            try:
+                invoice_data[field] = float(invoice_data[field]) if invoice_data[field] is not None else 0.0
+            except (ValueError, TypeError):
+                invoice_data[field] = 0.0
+
+    if 'line_items' in invoice_data and isinstance(invoice_data['line_items'], list):
+        cleaned_items = []
+        for item in invoice_data['line_items']:
+            if isinstance(item, dict):
+                for field in ITEM_NUMERIC_FIELDS:
+                    if field in item:
+                        try:
+                            item[field] = float(item[field]) if item[field] is not None else 0.0
+                        except (ValueError, TypeError):
+                            item[field] = 0.0
+                cleaned_items.append(item)
+        invoice_data['line_items'] = cleaned_items
+    return invoice_data
+
+def finalize_invoice(invoice_data: Dict[str, Any], filename: str, preview_public_url: Optional[str],
+                     confidence_threshold=None) -> Dict[str, Any]:
+    """Attach source/preview/processing metadata to a cleaned invoice"""
+    invoice_data['source_file'] = filename
+    # Prefer the persisted /public preview; otherwise expose the temp upload
+    # (browsers render images directly; PDFs load in the iframe).
+    invoice_data['preview_url'] = preview_public_url or f'/uploads_tmp/{filename}'
+    invoice_data['processed_at'] = datetime.now().isoformat()
+    if confidence_threshold:
+        invoice_data['confidence_threshold'] = confidence_threshold
+    return invoice_data
+
+def _resumed_preview_url(file_path: str, filename: str):
+    """Rebuild the image data URL for a file whose OCR result came from the journal"""
+    if filename.lower().endswith(('.png', '.jpg', '.jpeg')) and os.path.exists(file_path):
+        return data_url(file_path)
+    return None
+
+def page_image_hash(file_path: str, filename: str) -> Optional[int]:
+    """Perceptual hash of an image upload for near-duplicate lookup (None for PDFs)"""
+    if not Config.DEDUP_ENABLED or not filename.lower().endswith(('.png', '.jpg', '.jpeg')) or not os.path.exists(file_path):
+        return None
+    return run_cpu(image_hash, file_path, size=file_size(file_path))
+
+def find_duplicate(md: str, phash: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Near-duplicate of an already extracted document; lookup problems never fail the file"""
+    if not Config.DEDUP_ENABLED:
+        return None
+    try:
+        return get_dedup_index().find(md, phash)
+    except Exception as e:
+        logger.warning(f"Near-duplicate lookup failed: {e}")
+        return None
+
+def index_document(md: str, invoice_data: Dict[str, Any], phash: Optional[int], filename: str) -> None:
+    if not Config.DEDUP_ENABLED:
+        return
+    try:
+        get_dedup_index().add(md, invoice_data, phash, filename)
+    except Exception as e:
+        logger.warning(f"Near-duplicate indexing failed for {filename}: {e}")
+
+def duplicate_note(duplicate: Dict[str, Any], reused: bool) -> Dict[str, Any]:
+    return {'source_file': duplicate['source_file'], 'kind': duplicate['kind'],
+            'similarity': duplicate['similarity'], 'reused': reused}
+
+def resolve_entities(invoice_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach canonical vendor/customer ids and names; resolution problems never fail the file"""
+    if not Config.ENTITY_RESOLUTION_ENABLED:
+        return invoice_data
+    try:
+        index = get_entity_index()
+        vendor = index.resolve('vendor', invoice_data.get('vendor_name'),
+                               invoice_data.get('vendor_tax_id') or invoice_data.get('gst_number'))
+        customer = index.resolve('customer', invoice_data.get('customer_name'))
+    except Exception as e:
+        logger.warning(f"Entity resolution failed: {e}")
+        return invoice_data
+    for role, entity in (('vendor', vendor), ('customer', customer)):
+        if entity is not None:
+            invoice_data[f'{role}_id'] = entity['id']
+            invoice_data[f'{role}_canonical'] = entity['name']
+    return invoice_data
+
+def store_invoices(invoices: List[Dict[str, Any]], file_path: str, filename: str,
+                   source_hash: str = None, job_id: str = None) -> None:
+    """Persist a document's invoices in the invoice store and tag them with their ids.
+
+    Invoices reused from a near-duplicate (DEDUP_REUSE) are already stored under
+    the earlier document, so they are not stored again: a second row would be
+    counted twice in the rollups and reported by find_duplicates.
+    """
+    if not Config.INVOICE_STORE_ENABLED:
+        return
+    new = [inv for inv in invoices if not (inv.get('near_duplicate') or {}).get('reused')]
+    if not new:
+        return
+    try:
+        if source_hash is None and os.path.exists(file_path):
+            source_hash = content_hash(file_path)
+        ids = get_invoice_store().add_many(new, source_hash, job_id)
+    except Exception as e:
+        logger.warning(f"Could not store invoices from {filename}: {e}")
+        return
+    for invoice_data, invoice_id in zip(new, ids):
+        invoice_data['invoice_id'] = invoice_id
+
+def extraction_error(filename: str, llm_err: Exception) -> Exception:
+    """Wrap a failed LLM call: unparseable or invalid output is permanent, while
+    provider errors (timeouts, 5xx, connection resets) stay retryable"""
+    message = f"LLM extraction failed for {filename}: {str(llm_err)}"
+    if isinstance(llm_err, ValueError):
+        return DocumentError(message)
+    return RuntimeError(message)
+
+def _extract_group(md: str, filename: str, llm_choice: str, preview_url, extraction_deadline,
+                   phash: Optional[int] = None) -> Dict[str, Any]:
+    duplicate = find_duplicate(md, phash)
+    if duplicate is not None:
+        logger.info(f"{filename} is a near-duplicate of {duplicate['source_file']} "
+                    f"({duplicate['kind']} similarity {duplicate['similarity']})")
+        if duplicate['reusable'] and Config.DEDUP_REUSE:
+            invoice_data = duplicate['invoice']
+            invoice_data['near_duplicate'] = duplicate_note(duplicate, reused=True)
+            return invoice_data
+
+    prompt = _create_invoice_extraction_prompt(md)
+    logger.debug(f"Prompt created, length={len(prompt) if isinstance(prompt, str) else 'n/a'}")
+    try:
+        invoice_data = extract_invoice(llm_choice, prompt, preview_url, extraction_deadline)
+    except DeadlineExceeded:
+        raise
+    except Exception as llm_err:
+        if extraction_deadline.expired():
+            raise DeadlineExceeded('extraction', extraction_deadline.budget) from llm_err
+        logger.exception(f"LLM extraction failed for {filename}: {llm_err}")
+        raise extraction_error(filename, llm_err) from llm_err
+    invoice_data = resolve_entities(clean_invoice_data(invoice_data))
+    index_document(md, invoice_data, phash, filename)
+    if duplicate is not None:
+        invoice_data['near_duplicate'] = duplicate_note(duplicate, reused=False)
+    return invoice_data
+
+def process_file(file_path: str, filename: str, llm_choice: str, budget: FileBudget,
+                 confidence_threshold=None, preview_dir: str = PREVIEW_DIR,
+                 checkpoint=None, ocr_state: Optional[Dict[str, Any]] = None,
+                 source_hash: str = None, job_id: str = None) -> List[Dict[str, Any]]:
+    """OCR, extract and validate one saved upload; raises on failure.
+
+    Returns one invoice per invoice found in the document (PDFs bundling
+    several invoices are split by page), each tagged with its source pages
+    and stored in the invoice store.
+    `checkpoint(stage, data)` is called as each stage finishes ('ocr',
+    'extracted'). Passing a journaled `ocr_state` skips OCR on resume.
+    """
+    if ocr_state is not None:
+        md_pages = ocr_state.get('md_pages') or [ocr_state['md']]
+        preview_public_url = ocr_state.get('preview_public_url')
+        preview_url = _resumed_preview_url(file_path, filename)
+    else:
+        # Local checks first, so unusable documents never cost an OCR call
+        report = preflight(file_path, filename) if Config.PREFLIGHT_ENABLED else None
+        try:
+            md_pages, preview_url = run_ocr(file_path, filename, deadline=budget.stage('ocr'), report=report)
+            preview_source = report.ocr_path if report is not None and report.ocr_path else file_path
+            preview_public_url = persist_preview(filename, preview_source, preview_url, preview_dir)
+        finally:
+            preflight_cleanup(report)
+        if checkpoint:
+            checkpoint('ocr', {'md_pages': md_pages, 'preview_public_url': preview_public_url})
+
+    groups = invoice_groups(md_pages)
+    texts = ["\n\n".join(md_pages[i] or '' for i in group) for group in groups]
+    extraction_deadline = budget.stage('extraction')
+    if len(groups) == 1:
+        phash = page_image_hash(file_path, filename)
+        invoices = [_extract_group(texts[0], filename, llm_choice, preview_url, extraction_deadline, phash)]
+    else:
+        logger.info(f"Found {len(groups)} invoices in {filename}: pages "
+                    f"{', '.join(page_range_label(g) for g in groups)}")
+        workers = max(1, min(len(groups), Config.INVOICE_SPLIT_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='split') as pool:
+            invoices = list(pool.map(
+                lambda md: _extract_group(md, filename, llm_choice, preview_url, extraction_deadline), texts))
+
+    for index, (invoice_data, group) in enumerate(zip(invoices, groups)):
+        finalize_invoice(invoice_data, filename, preview_public_url, confidence_threshold)
+        invoice_data['source_pages'] = page_range_label(group) if group else None
+        if len(groups) > 1:
+            invoice_data['invoice_index'] = index + 1
+    store_invoices(invoices, file_path, filename, source_hash, job_id)
+    if checkpoint:
+        checkpoint('extracted', {'invoices': invoices})
+    return invoices
+
+def run_export_step(out: Dict[str, Any], label: str, fn, job=None) -> None:
+    """Run one export step within the job's export deadline, recording failures in out['errors']"""
+    try:
+        if job is not None:
+            job.check('export')
+        fn()
+    except DeadlineExceeded as err:
+        out['timeout_reasons'].append(f"{label}: {str(err)}")
+        out['errors'].append(f"{label}: {str(err)}")
+    except Exception as err:
+        logger.exception(f"{label}: {err}")
+        out['errors'].append(f"{label}: {str(err)}")
+
+class BatchStats:
+    """Running batch totals, so stats do not need the invoices kept in memory"""
+
+    def __init__(self):
+        self.invoices = 0
+        self.line_items = 0
+        self.amount = 0
+
+    def add(self, invoices: List[Dict[str, Any]]) -> 'BatchStats':
+        for inv in invoices:
+            self.invoices += 1
+            self.line_items += len(inv.get('line_items', []))
+            self.amount += inv.get('total_amount', 0)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_invoices': self.invoices,
+            'total_line_items': self.line_items,
+            'total_amount': self.amount,
+            'average_amount': self.amount / self.invoices if self.invoices else 0
+        }
+
+def summary_stats(all_invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return BatchStats().add(all_invoices).to_dict()
@@ -0,0 +1,229 @@
+import logging
+import os
+import re
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Local preflight inspection, run before any OCR/LLM call. It identifies the
+# real file type from its magic bytes (not the extension), counts PDF pages,
+# detects encryption and an existing text layer, and measures images. The
+# resulting action routes the document:
+#   reject      - empty, unknown, corrupted, encrypted or too many pages
+#   local_text  - PDF already has a usable text layer; skip the OCR call
+#   split       - long PDF; OCR it in page chunks in parallel
+#   downscale   - oversized image; shrink it before upload
+#   ocr         - everything else, as before
+# pypdf and Pillow are optional: without pypdf, pages/encryption come from a
+# raw scan and the local text path is unavailable; without Pillow, images are
+# sent at their original size.
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MIME_TYPES = {'pdf': 'application/pdf', 'png': 'image/png', 'jpeg': 'image/jpeg'}
+
+class PreflightRejected(ValueError):
+    """A document that should not be sent to OCR at all"""
+
+class PreflightReport:
+    def __init__(self, path: str, kind: Optional[str], size: int):
+        self.path = path
+        self.kind = kind
+        self.size = size
+        self.pages: Optional[int] = None
+        self.encrypted = False
+        self.has_text: Optional[bool] = None
+        self.page_texts: Optional[List[str]] = None  # embedded text per page, when usable
+        self.width: Optional[int] = None
+        self.height: Optional[int] = None
+        self.action = 'ocr'
+        self.reason: Optional[str] = None
+        self.ocr_path: Optional[str] = None  # downscaled copy to OCR instead of the original
+
+    @property
+    def text(self) -> Optional[str]:
+        return '\n\n'.join(self.page_texts) if self.page_texts is not None else None
+
+    @property
+    def mime(self) -> Optional[str]:
+        return MIME_TYPES.get(self.kind)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind, 'size': self.size, 'pages': self.pages, 'encrypted': self.encrypted,
+            'has_text': self.has_text, 'width': self.width, 'height': self.height,
+            'action': self.action, 'reason': self.reason,
+        }
+
+    def reject(self, reason: str) -> 'PreflightReport':
+        self.action = 'reject'
+        self.reason = reason
+        return self
+
+def sniff(head: bytes) -> Optional[str]:
+    """File type from magic bytes"""
+    if head.startswith(b'%PDF-') or (b'%PDF-' in head[:1024]):
+        return 'pdf'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    return None
+
+def _png_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) >= 24 and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+def _jpeg_size(f) -> Optional[Tuple[int, int]]:
+    # Walk the marker segments up to the first start-of-frame
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        seg_len = struct.unpack('>H', length)[0]
+        if code in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(seg_len - 2, os.SEEK_CUR)
+
+def _inspect_pdf_raw(path: str, report: PreflightReport) -> None:
+    """Page count / encryption without a PDF library (approximate)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b'%%EOF' not in data[-2048:]:
+        report.reject('PDF is truncated or corrupted')
+        return
+    report.encrypted = b'/Encrypt' in data
+    # Page objects inside compressed object streams are invisible here; leave the count unknown
+    report.pages = len(re.findall(rb'/Type\s*/Page(?![a-zA-Z])', data)) or None
+
+def _inspect_pdf(path: str, report: PreflightReport) -> None:
+    if PdfReader is None:
+        _inspect_pdf_raw(path, report)
+        return
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            report.encrypted = True
+            # Owner-password-only PDFs open with an empty user password
+            if not reader.decrypt(''):
+                return
+            report.encrypted = False
+        report.pages = len(reader.pages)
+    except Exception as e:
+        report.reject(f'PDF could not be parsed: {e}')
+        return
+    if not Config.PREFLIGHT_LOCAL_TEXT or not report.pages:
+        return
+    # Decide on a sample, then extract everything only if the text layer is usable
+    sample = [_page_text(reader, i) for i in range(min(3, report.pages))]
+    report.has_text = sum(len(t.strip()) for t in sample) / len(sample) >= Config.PREFLIGHT_MIN_TEXT_CHARS
+    if report.has_text:
+        report.page_texts = sample + [_page_text(reader, i) for i in range(len(sample), report.pages)]
+
+def _page_text(reader, index: int) -> str:
+    try:
+        return reader.pages[index].extract_text() or ''
+    except Exception:
+        return ''
+
+def inspect(path: str) -> PreflightReport:
+    """Inspect a saved upload and decide how it should be processed"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return PreflightReport(path, None, 0).reject('File is empty')
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+        report = PreflightReport(path, sniff(head), size)
+        if report.kind is None:
+            return report.reject('Not a PDF, PNG or JPEG file')
+        if report.kind == 'png':
+            dims = _png_size(head)
+        elif report.kind == 'jpeg':
+            dims = _jpeg_size(f)
+        else:
+            dims = None
+    if dims:
+        report.width, report.height = dims
+
+    if report.kind == 'pdf':
+        _inspect_pdf(path, report)
+        if report.action == 'reject':
+            return report
+        if report.encrypted:
+            return report.reject('PDF is password protected')
+        if report.pages == 0:
+            return report.reject('PDF has no pages')
+        if (report.pages or 0) > Config.PREFLIGHT_MAX_PAGES:
+            return report.reject(f'PDF has {report.pages} pages (limit {Config.PREFLIGHT_MAX_PAGES})')
+        if report.has_text:
+            report.action = 'local_text'
+        elif (report.pages or 0) > Config.PREFLIGHT_SPLIT_PAGES:
+            report.action = 'split'
+        return report
+
+    if report.width is None:
+        return report.reject('Image header is corrupted')
+    if min(report.width, report.height) < Config.PREFLIGHT_MIN_IMAGE_SIDE:
+        return report.reject(f'Image is too small to read ({report.width}x{report.height})')
+    if max(report.width, report.height) > Config.PREFLIGHT_MAX_IMAGE_SIDE and Image is not None:
+        report.action = 'downscale'
+    return report
+
+def downscale(report: PreflightReport) -> str:
+    """Write a shrunken JPEG copy of an oversized image next to it; returns its path"""
+    out_path = f'{report.path}.preflight.jpg'
+    with Image.open(report.path) as img:
+        img.thumbnail((Config.PREFLIGHT_MAX_IMAGE_SIDE, Config.PREFLIGHT_MAX_IMAGE_SIDE))
+        img.convert('RGB').save(out_path, 'JPEG', quality=90)
+    # OCR and the preview now get the JPEG copy, so describe that instead of the original
+    report.ocr_path = out_path
+    report.kind = 'jpeg'
+    return out_path
+
+def page_chunks(pages: int, size: int = None) -> List[List[int]]:
+    """0-based page index groups for chunked OCR"""
+    size = size or Config.PREFLIGHT_SPLIT_PAGES
+    return [list(range(start, min(start + size, pages))) for start in range(0, pages, size)]
+
+def preflight(path: str, filename: str = None) -> PreflightReport:
+    """Inspect a document and prepare it for its route; raises PreflightRejected"""
+    report = inspect(path)
+    logger.info(f"Preflight {filename or os.path.basename(path)}: {report.to_dict()}")
+    if report.action == 'reject':
+        raise PreflightRejected(f"Rejected {filename or os.path.basename(path)}: {report.reason}")
+    if report.action == 'downscale':
+        try:
+            downscale(report)
+        except Exception as e:
+            logger.warning(f"Downscale failed for {path}, sending the original: {e}")
+            report.action = 'ocr'
+    return report
+
+def cleanup(report: Optional[PreflightReport]) -> None:
+    if report is not None and report.ocr_path and os.path.exists(report.ocr_path):
+        try:
+            os.remove(report.ocr_path)
+        except OSError:
+            pass
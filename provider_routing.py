@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, List, Optional
+from config import Config
+from llm_wrappers import _extract_with_provider, _configured_providers
+from deadlines import DeadlineExceeded
+
+# Model served by each provider; stats are keyed by (provider, model) so a
+# model change in Config starts a fresh profile instead of inheriting the old one.
+PROVIDER_MODELS = {
+    'Mistral': Config.DEFAULT_MODEL,
+    'OpenRouter': Config.OPENROUTER_MODEL,
+}
+
+class ProviderStats:
+    """Rolling latency/error window for one provider + model"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)  # (latency_seconds, ok)
+        self._lock = threading.Lock()
+        self.last_failure = 0.0
+        self.abandoned = 0  # hedge losers we stopped waiting for
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((latency, ok))
+            if not ok:
+                self.last_failure = time.monotonic()
+
+    def record_abandoned(self) -> None:
+        with self._lock:
+            self.abandoned += 1
+
+    def _latencies(self) -> List[float]:
+        with self._lock:
+            return sorted(lat for lat, ok in self._samples if ok)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        lats = self._latencies()
+        if not lats:
+            return None
+        idx = min(len(lats) - 1, int(round(pct / 100.0 * (len(lats) - 1))))
+        return lats[idx]
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def healthy(self) -> bool:
+        """Unhealthy while the error rate is high and failures are recent; retried after the cooldown"""
+        if self.error_rate < Config.LLM_UNHEALTHY_ERROR_RATE:
+            return True
+        return time.monotonic() - self.last_failure > Config.LLM_UNHEALTHY_COOLDOWN
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'samples': self.count,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'error_rate': round(self.error_rate, 4),
+            'healthy': self.healthy(),
+            'abandoned': self.abandoned,
+        }
+
+class ProviderRouter:
+    """Route each extraction to the currently fastest healthy provider, optionally hedging slow calls"""
+
+    def __init__(self, window: int = None, hedge: bool = None):
+        self.window = window or Config.LLM_ROUTING_WINDOW
+        self.hedge = Config.LLM_HEDGE_ENABLED if hedge is None else hedge
+        self._stats: Dict[tuple, ProviderStats] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=Config.LLM_HEDGE_MAX_WORKERS, thread_name_prefix='llm-route')
+
+    def stats_for(self, provider: str) -> ProviderStats:
+        key = (provider, PROVIDER_MODELS.get(provider, ''))
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = ProviderStats(self.window)
+            return self._stats[key]
+
+    def rank(self, providers: List[str] = None) -> List[str]:
+        """Order providers best-first: healthy before unhealthy, under-sampled first, then by p50 latency"""
+        providers = providers if providers is not None else _configured_providers()
+
+        def sort_key(item):
+            order, provider = item
+            stats = self.stats_for(provider)
+            if stats.count < Config.LLM_ROUTING_MIN_SAMPLES:
+                # Explore until there is enough data to compare
+                return (not stats.healthy(), 0, 0.0, order)
+            p50 = stats.percentile(50)
+            return (not stats.healthy(), 1, p50 if p50 is not None else float('inf'), order)
+
+        return [p for _, p in sorted(enumerate(providers), key=sort_key)]
+
+    def _timed_call(self, provider: str, prompt_text: str, preview_url, deadline=None,
+                    abandoned: threading.Event = None) -> Dict[str, Any]:
+        """One provider call. If `abandoned` is set by the time it finishes (the other
+        hedged call won), it is also counted as abandoned; its latency is still sampled,
+        since dropping the slow tail would pull the p95, and with it the hedge delay, down"""
+        stats = self.stats_for(provider)
+        start = time.monotonic()
+        try:
+            result = _extract_with_provider(provider, prompt_text, preview_url, deadline)
+        except Exception:
+            # Running out of our own budget says nothing about the provider's health
+            if deadline is None or not deadline.expired():
+                stats.record(time.monotonic() - start, False)
+            if abandoned is not None and abandoned.is_set():
+                stats.record_abandoned()
+            raise
+        stats.record(time.monotonic() - start, True)
+        if abandoned is not None and abandoned.is_set():
+            stats.record_abandoned()
+        if isinstance(result, dict):
+            result.setdefault('llm_provider', provider)
+        return result
+
+    def _hedge_delay(self, provider: str) -> Optional[float]:
+        stats = self.stats_for(provider)
+        if stats.count < Config.LLM_ROUTING_MIN_SAMPLES:
+            return None
+        return stats.percentile(95)
+
+    def extract(self, prompt_text: str, preview_url, deadline=None) -> Dict[str, Any]:
+        """Extract invoice data using the best provider; send a hedged duplicate if the first exceeds its p95"""
+        ranked = self.rank()
+        if not ranked:
+            raise RuntimeError("No LLM provider API key configured")
+        primary, backup = ranked[0], (ranked[1] if len(ranked) > 1 else None)
+        if not backup:
+            return self._timed_call(primary, prompt_text, preview_url, deadline)
+
+        def remaining(cap=None):
+            if deadline is None:
+                return cap
+            return deadline.remaining() if cap is None else min(cap, deadline.remaining())
+
+        # `pending` is the set of futures still in flight; once one call wins, whatever
+        # is left in it lost the race and is abandoned, never waited on
+        abandoned = threading.Event()
+        pending = {self._executor.submit(self._timed_call, primary, prompt_text, preview_url, deadline, abandoned)}
+        hedge_delay = self._hedge_delay(primary) if self.hedge else None
+        hedged = False
+        last_error = None
+        try:
+            if hedge_delay is not None:
+                done, _ = wait(pending, timeout=remaining(hedge_delay))
+                if not done and self.stats_for(backup).healthy() and not (deadline and deadline.expired()):
+                    pending.add(self._executor.submit(self._timed_call, backup, prompt_text, preview_url,
+                                                      deadline, abandoned))
+                    hedged = True
+
+            while pending:
+                done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+                if not done:
+                    # Calls carry the same deadline as their own timeout and will wind down
+                    raise DeadlineExceeded(deadline.label, deadline.budget)
+                for fut in done:
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    abandoned.set()
+                    return result
+        finally:
+            for fut in pending:
+                # Drops calls still queued for a worker; running ones finish on their own
+                fut.cancel()
+        # Everything we started failed; fail over once if the backup was never tried
+        if not hedged and not (deadline and deadline.expired()):
+            return self._timed_call(backup, prompt_text, preview_url, deadline)
+        raise last_error
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._stats.keys())
+        return {f"{provider}/{model}": self._stats[(provider, model)].snapshot() for provider, model in keys}
+
+router = ProviderRouter()
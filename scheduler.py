@@ -0,0 +1,47 @@
+from typing import Any, Dict
+from config import Config
+
+# Fair scheduling for the distributed task queue (task_queue.py). Every task
+# belongs to a flow = (tenant, priority class). Flows are served by weighted
+# fair queuing (self-clocked variant): each task gets a virtual finish tag
+#     start  = max(system virtual time, finish tag of the flow's previous task)
+#     finish = start + cost / weight
+# and workers always take the visible task with the smallest tag. A tenant's
+# 500-file batch therefore interleaves with a colleague's single invoice
+# instead of queueing ahead of it, the interactive class outweighs bulk work
+# without starving it, and cost grows with document size so small documents
+# move ahead of large ones.
+
+PRIORITY_CLASSES = ('interactive', 'batch')
+DEFAULT_TENANT = 'anonymous'
+
+def classify(requested: str = None, file_count: int = 1, tenant: str = None) -> str:
+    """Pick the priority class. Small uploads are interactive; a larger one only gets
+    the interactive weight it asks for when its tenant is trusted, otherwise it is batch"""
+    small = file_count <= Config.SCHEDULER_INTERACTIVE_MAX_FILES
+    if requested == 'interactive':
+        return 'interactive' if small or tenant in Config.SCHEDULER_TRUSTED_TENANTS else 'batch'
+    if requested in PRIORITY_CLASSES:
+        return requested
+    return 'interactive' if small else 'batch'
+
+def task_cost(size_bytes: int = None, pages: int = None) -> float:
+    """Service cost estimate in page-equivalents"""
+    if pages:
+        return float(max(1, pages))
+    return 1.0 + (size_bytes or 0) / Config.SCHEDULER_BYTES_PER_PAGE
+
+def flow_weight(tenant: str, priority: str) -> float:
+    tenant_weight = Config.SCHEDULER_TENANT_WEIGHTS.get(tenant, 1.0)
+    return max(1e-6, float(tenant_weight) * float(Config.SCHEDULER_CLASS_WEIGHTS.get(priority, 1.0)))
+
+def flow_key(payload: Dict[str, Any]) -> str:
+    return f"{payload.get('tenant') or DEFAULT_TENANT}|{payload.get('priority') or 'batch'}"
+
+def finish_tag(virtual_time: float, last_finish: float, payload: Dict[str, Any]) -> float:
+    """Virtual finish tag for a task given the queue clock and its flow's previous tag"""
+    tenant = payload.get('tenant') or DEFAULT_TENANT
+    priority = payload.get('priority') or 'batch'
+    start = max(virtual_time, last_finish or 0.0)
+    return start + task_cost(payload.get('size'), payload.get('pages')) / flow_weight(tenant, priority)
+
@@ -0,0 +1,41 @@
+import json
+from typing import Any, Union
+
+# One JSON layer for API responses and everything the app persists (journal,
+# exports, task queue, SQLite stores). orjson is used when installed, several
+# times faster than the stdlib encoder; both paths write compact UTF-8 with
+# str() for anything JSON has no type for, matching the old default=str.
+# Reads fall back to the stdlib parser for what orjson rejects but older files
+# may contain (NaN/Infinity), so existing journals and stores stay readable.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """Compact (or 2-space indented) UTF-8 JSON"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0))
+        except TypeError:
+            pass  # e.g. integers wider than 64 bits
+    return json.dumps(obj, default=str, ensure_ascii=False, indent=2 if indent else None,
+                      separators=(',', ': ') if indent else (',', ':')).encode('utf-8')
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    return dumps_bytes(obj, indent).decode('utf-8')
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def load(f) -> Any:
+    return loads(f.read())
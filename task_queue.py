@@ -0,0 +1,378 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from config import Config
+from scheduler import finish_tag, flow_key
+from serialization import dumps, loads
+
+# Durable task queue for distributed worker mode. Web nodes enqueue one task
+# per file and read results; workers (worker.py) reserve tasks, run the
+# pipeline and write results. Delivery is at-least-once: a reserved task that
+# is not acked within its visibility timeout becomes visible again, and result
+# writes are idempotent (first write wins) so a redelivered task is harmless.
+# Visible tasks are handed out in weighted-fair order (scheduler.py), not FIFO.
+
+class Reservation:
+    def __init__(self, task_id: str, payload: Dict[str, Any], attempts: int, lease: str):
+        self.task_id = task_id
+        self.payload = payload
+        self.attempts = attempts
+        self.lease = lease
+
+class QueueBackend:
+    """Interface implemented by each queue backend"""
+
+    def enqueue(self, payload: Dict[str, Any], task_id: str = None) -> str:
+        raise NotImplementedError
+
+    def reserve(self, visibility_timeout: float = None) -> Optional[Reservation]:
+        raise NotImplementedError
+
+    def extend(self, reservation: Reservation, visibility_timeout: float = None) -> bool:
+        raise NotImplementedError
+
+    def ack(self, reservation: Reservation) -> bool:
+        raise NotImplementedError
+
+    def release(self, reservation: Reservation, delay: float = 0.0) -> None:
+        raise NotImplementedError
+
+    def put_result(self, task_id: str, result: Dict[str, Any]) -> bool:
+        """Store a task result; returns False if a result was already stored"""
+        raise NotImplementedError
+
+    def get_result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def put_job(self, job_id: str, job: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def depth(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def get_results(self, task_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        return {tid: self.get_result(tid) for tid in task_ids}
+
+    def count_results(self, task_ids: List[str]) -> int:
+        """How many of the tasks have a result, without loading them"""
+        return sum(1 for result in self.get_results(task_ids).values() if result is not None)
+
+class SQLiteQueue(QueueBackend):
+    """Single-node backend: one SQLite file shared by the web process and local workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    visible_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease TEXT,
+                    created_at REAL NOT NULL,
+                    tag REAL NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_tasks_visible ON tasks (visible_at, created_at);
+                CREATE TABLE IF NOT EXISTS flows (
+                    flow TEXT PRIMARY KEY,
+                    last_finish REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    task_id TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    written_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+            ''')
+            if 'tag' not in [row[1] for row in conn.execute('PRAGMA table_info(tasks)')]:
+                # Queue files created before fair scheduling
+                conn.execute('ALTER TABLE tasks ADD COLUMN tag REAL NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_tag ON tasks (tag, created_at)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload, task_id=None):
+        task_id = task_id or uuid.uuid4().hex
+        now = time.time()
+        flow = flow_key(payload)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            vtime = conn.execute("SELECT value FROM meta WHERE key = 'vtime'").fetchone()
+            last = conn.execute('SELECT last_finish FROM flows WHERE flow = ?', (flow,)).fetchone()
+            tag = finish_tag(vtime[0] if vtime else 0.0, last[0] if last else 0.0, payload)
+            cur = conn.execute(
+                'INSERT OR IGNORE INTO tasks (id, payload, visible_at, created_at, tag) VALUES (?, ?, ?, ?, ?)',
+                (task_id, dumps(payload), now, now, tag),
+            )
+            if cur.rowcount == 1:
+                conn.execute('INSERT OR REPLACE INTO flows (flow, last_finish) VALUES (?, ?)', (flow, tag))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return task_id
+
+    def reserve(self, visibility_timeout=None):
+        vt = visibility_timeout or Config.TASK_VISIBILITY_TIMEOUT
+        conn = self._conn()
+        now = time.time()
+        lease = uuid.uuid4().hex
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, payload, attempts, tag FROM tasks WHERE visible_at <= ? ORDER BY tag, created_at LIMIT 1',
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                'UPDATE tasks SET visible_at = ?, attempts = attempts + 1, lease = ? WHERE id = ?',
+                (now + vt, lease, row[0]),
+            )
+            # Advance the virtual clock to the tag now in service
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('vtime', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (row[3],),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return Reservation(row[0], loads(row[1]), row[2] + 1, lease)
+
+    def extend(self, reservation, visibility_timeout=None):
+        vt = visibility_timeout or Config.TASK_VISIBILITY_TIMEOUT
+        cur = self._conn().execute(
+            'UPDATE tasks SET visible_at = ? WHERE id = ? AND lease = ?',
+            (time.time() + vt, reservation.task_id, reservation.lease),
+        )
+        return cur.rowcount == 1
+
+    def ack(self, reservation):
+        cur = self._conn().execute('DELETE FROM tasks WHERE id = ? AND lease = ?', (reservation.task_id, reservation.lease))
+        return cur.rowcount == 1
+
+    def release(self, reservation, delay=0.0):
+        self._conn().execute(
+            'UPDATE tasks SET visible_at = ?, lease = NULL WHERE id = ? AND lease = ?',
+            (time.time() + delay, reservation.task_id, reservation.lease),
+        )
+
+    def put_result(self, task_id, result):
+        cur = self._conn().execute(
+            'INSERT OR IGNORE INTO results (task_id, result, written_at) VALUES (?, ?, ?)',
+            (task_id, dumps(result), time.time()),
+        )
+        return cur.rowcount == 1
+
+    def get_result(self, task_id):
+        row = self._conn().execute('SELECT result FROM results WHERE task_id = ?', (task_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def put_job(self, job_id, job):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO jobs (id, job, created_at) VALUES (?, ?, ?)',
+            (job_id, dumps(job), time.time()),
+        )
+
+    def get_job(self, job_id):
+        row = self._conn().execute('SELECT job FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def count_results(self, task_ids):
+        count = 0
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            count += self._conn().execute(
+                f'SELECT COUNT(*) FROM results WHERE task_id IN ({", ".join("?" * len(chunk))})', chunk).fetchone()[0]
+        return count
+
+    def depth(self):
+        conn = self._conn()
+        now = time.time()
+        visible = conn.execute('SELECT COUNT(*) FROM tasks WHERE visible_at <= ?', (now,)).fetchone()[0]
+        total = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+        return {'queued': visible, 'in_flight': total - visible}
+
+class RedisQueue(QueueBackend):
+    """Multi-node backend on any Redis-compatible server.
+
+    Visible tasks sit in a `ready` sorted set scored by their fair-queuing tag;
+    reserved or delayed tasks sit in `inflight`, scored by the time they become
+    visible again. A worker first adds the task to `inflight` and then claims
+    it by removing it from `ready` (ZREM succeeds for exactly one worker), so a
+    worker dying between the two steps only delays the task until its
+    visibility timeout. Due tasks move back to `ready` in a WATCH/MULTI
+    transaction, so the move never deletes a lease taken in between. No Lua is
+    used, so it also runs against stand-ins such as fakeredis.
+    """
+
+    def __init__(self, client, prefix: str = 'docq'):
+        self.r = client
+        self.prefix = prefix
+
+    def _k(self, *parts) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    @staticmethod
+    def _s(raw):
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    def enqueue(self, payload, task_id=None):
+        task_id = task_id or uuid.uuid4().hex
+        key = self._k('task', task_id)
+        # Deduplicate on task id so a retried enqueue does not double-queue
+        if self.r.hsetnx(key, 'payload', dumps(payload)):
+            flow = flow_key(payload)
+            last = self.r.hget(self._k('flows'), flow)
+            tag = finish_tag(float(self.r.get(self._k('vtime')) or 0.0), float(last or 0.0), payload)
+            self.r.hset(self._k('flows'), flow, tag)
+            self.r.hset(key, mapping={'attempts': 0, 'tag': tag})
+            self.r.zadd(self._k('ready'), {task_id: tag})
+        return task_id
+
+    def _requeue_due(self, now: float) -> None:
+        # Expired leases and delayed retries become ready again with their original tag
+        for raw, score in self.r.zrangebyscore(self._k('inflight'), 0, now, start=0, num=100, withscores=True):
+            self._requeue(self._s(raw), score)
+
+    def _requeue(self, task_id: str, expired: float) -> bool:
+        """Move a task from inflight to ready, only while it still holds the expired score"""
+        from redis.exceptions import WatchError
+        inflight, key = self._k('inflight'), self._k('task', task_id)
+        with self.r.pipeline() as pipe:
+            try:
+                # A worker claiming or extending the task in between changes inflight and aborts the move
+                pipe.watch(inflight, key)
+                if pipe.zscore(inflight, task_id) != expired:
+                    return False
+                tag = pipe.hget(key, 'tag')
+                pipe.multi()
+                if tag is not None:
+                    pipe.zadd(self._k('ready'), {task_id: float(tag)})
+                pipe.zrem(inflight, task_id)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def reserve(self, visibility_timeout=None):
+        vt = visibility_timeout or Config.TASK_VISIBILITY_TIMEOUT
+        now = time.time()
+        self._requeue_due(now)
+        for raw, tag in self.r.zrange(self._k('ready'), 0, 9, withscores=True):
+            task_id = self._s(raw)
+            self.r.zadd(self._k('inflight'), {task_id: now + vt})
+            if not self.r.zrem(self._k('ready'), task_id):
+                continue  # another worker claimed it first
+            key = self._k('task', task_id)
+            payload = self.r.hget(key, 'payload')
+            if payload is None:
+                # Acked by a previous holder after we listed it
+                self.r.zrem(self._k('inflight'), task_id)
+                continue
+            lease = uuid.uuid4().hex
+            self.r.hset(key, 'lease', lease)
+            attempts = self.r.hincrby(key, 'attempts', 1)
+            if tag > float(self.r.get(self._k('vtime')) or 0.0):
+                self.r.set(self._k('vtime'), tag)
+            return Reservation(task_id, loads(payload), int(attempts), lease)
+        return None
+
+    def _holds_lease(self, reservation) -> bool:
+        return self._s(self.r.hget(self._k('task', reservation.task_id), 'lease')) == reservation.lease
+
+    def extend(self, reservation, visibility_timeout=None):
+        vt = visibility_timeout or Config.TASK_VISIBILITY_TIMEOUT
+        if not self._holds_lease(reservation):
+            return False
+        self.r.zadd(self._k('inflight'), {reservation.task_id: time.time() + vt})
+        return True
+
+    def ack(self, reservation):
+        if not self._holds_lease(reservation):
+            return False
+        self.r.zrem(self._k('inflight'), reservation.task_id)
+        self.r.zrem(self._k('ready'), reservation.task_id)
+        self.r.delete(self._k('task', reservation.task_id))
+        return True
+
+    def release(self, reservation, delay=0.0):
+        if not self._holds_lease(reservation):
+            return
+        self.r.hdel(self._k('task', reservation.task_id), 'lease')
+        # Becomes ready again once the delay passes (picked up by _requeue_due)
+        self.r.zadd(self._k('inflight'), {reservation.task_id: time.time() + delay})
+
+    def put_result(self, task_id, result):
+        return bool(self.r.set(self._k('result', task_id), dumps(result), nx=True, ex=Config.TASK_RESULT_TTL))
+
+    def get_result(self, task_id):
+        raw = self.r.get(self._k('result', task_id))
+        return loads(raw) if raw else None
+
+    def get_results(self, task_ids):
+        if not task_ids:
+            return {}
+        raws = self.r.mget([self._k('result', tid) for tid in task_ids])
+        return {tid: (loads(raw) if raw else None) for tid, raw in zip(task_ids, raws)}
+
+    def put_job(self, job_id, job):
+        self.r.set(self._k('job', job_id), dumps(job), ex=Config.TASK_RESULT_TTL)
+
+    def get_job(self, job_id):
+        raw = self.r.get(self._k('job', job_id))
+        return loads(raw) if raw else None
+
+    def count_results(self, task_ids):
+        return self.r.exists(*[self._k('result', tid) for tid in task_ids]) if task_ids else 0
+
+    def depth(self):
+        now = time.time()
+        due = self.r.zcount(self._k('inflight'), 0, now)
+        return {'queued': self.r.zcard(self._k('ready')) + due, 'in_flight': self.r.zcard(self._k('inflight')) - due}
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_queue(url: str = None) -> QueueBackend:
+    """Build (once per process) the backend for a queue URL: sqlite:///path or redis://host:port/db"""
+    url = url or Config.TASK_QUEUE_URL
+    with _queues_lock:
+        if url not in _queues:
+            if url.startswith('sqlite:///'):
+                _queues[url] = SQLiteQueue(url[len('sqlite:///'):])
+            elif url.startswith(('redis://', 'rediss://', 'unix://')):
+                import redis
+                _queues[url] = RedisQueue(redis.Redis.from_url(url))
+            else:
+                raise ValueError(f"Unsupported task queue URL: {url}")
+        return _queues[url]
@@ -0,0 +1,44 @@
+import os
+import pytest
+
+# Importing app must not resume journals or open provider connections
+os.environ.setdefault('JOURNAL_RESUME_ON_STARTUP', 'false')
+os.environ.setdefault('HTTP_PREWARM', 'false')
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, so uploads, journals and exports stay out of the tree"""
+    monkeypatch.chdir(tmp_path)
+    for name in ('uploads', 'temp_files', 'uploads_tmp'):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+@pytest.fixture
+def processed():
+    """(filename, file contents, kwargs) for every file the stubbed pipeline was asked to process"""
+    return []
+
+@pytest.fixture
+def app_module(workdir, processed, monkeypatch):
+    import app
+    from admission import AdmissionController
+    from idempotency import IdempotencyStore
+
+    def process_file(file_path, filename, llm_choice, budget, **kwargs):
+        with open(file_path, 'rb') as f:
+            content = f.read().decode()
+        processed.append((filename, content, kwargs))
+        return [{'invoice_id': content, 'invoice_number': content, 'total_amount': 10.0,
+                 'line_items': [{'description': 'item', 'quantity': 1, 'unit_price': 10.0, 'total_price': 10.0}]}]
+
+    monkeypatch.setattr(app, 'process_file', process_file)
+    monkeypatch.setattr(app, 'schedule_preview_cleanup', lambda *a, **k: None)
+    monkeypatch.setattr(app, 'admission_controller', AdmissionController())
+    store = IdempotencyStore(str(workdir / 'idempotency.db'))
+    monkeypatch.setattr(app, 'get_idempotency_store', lambda: store)
+    monkeypatch.setitem(app.app.config, 'PROCESSING_MODE', 'inline')
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,54 @@
+import threading
+import pytest
+from admission import AdmissionController, AdmissionRejected
+
+def test_client_over_its_cap_is_turned_away_with_429():
+    controller = AdmissionController(client_max_files=2)
+    ticket = controller.acquire('a', 2, 100)
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire('a', 1, 100)
+    assert e.value.status == 429
+    assert e.value.retry_after >= 1
+    # Other clients are unaffected
+    controller.acquire('b', 1, 100).release()
+    ticket.release()
+    controller.acquire('a', 1, 100).release()
+
+def test_oversized_request_runs_alone():
+    controller = AdmissionController(max_files=2)
+    with controller.acquire('a', 5, 100):
+        assert controller.snapshot()['in_flight']['files'] == 5
+
+def test_full_wait_queue_gets_503():
+    controller = AdmissionController(max_files=1, max_waiting=0)
+    with controller.acquire('a', 1, 100):
+        with pytest.raises(AdmissionRejected) as e:
+            controller.acquire('b', 1, 100)
+    assert e.value.status == 503
+    assert controller.snapshot()['rejected'] == {'queue_full': 1}
+
+def test_waiting_request_times_out_with_503():
+    controller = AdmissionController(max_files=1, max_waiting=1, max_wait=0.05)
+    with controller.acquire('a', 1, 100):
+        with pytest.raises(AdmissionRejected) as e:
+            controller.acquire('b', 1, 100)
+    assert e.value.status == 503
+    assert controller.snapshot()['rejected'] == {'wait_timeout': 1}
+
+def test_waiting_request_is_admitted_on_release():
+    controller = AdmissionController(max_files=1, max_waiting=1, max_wait=5)
+    ticket = controller.acquire('a', 1, 100)
+    threading.Timer(0.05, ticket.release).start()
+    with controller.acquire('b', 1, 100):
+        assert controller.snapshot()['in_flight']['requests'] == 1
+
+def test_check_request_rejects_before_the_body_is_read():
+    controller = AdmissionController(client_max_files=1, max_files=1, max_waiting=0)
+    with controller.acquire('a', 1, 100):
+        with pytest.raises(AdmissionRejected) as e:
+            controller.check_request('a', 100)
+        assert e.value.status == 429
+        with pytest.raises(AdmissionRejected) as e:
+            controller.check_request('b', 100)
+        assert e.value.status == 503
+    controller.check_request('b', 100)
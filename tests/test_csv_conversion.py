@@ -0,0 +1,50 @@
+import io
+import pytest
+from csv_conversion import convert_invoices_to_csv, create_summary_csv, write_csv
+
+pytest.importorskip('pandas')
+
+def pandas_csv(kind, invoices):
+    frame = convert_invoices_to_csv(invoices) if kind == 'detailed' else create_summary_csv(invoices)
+    return frame.to_csv(index=False)
+
+def streamed_csv(kind, invoices):
+    buf = io.StringIO()
+    write_csv(kind, invoices, buf)
+    return buf.getvalue()
+
+MIXED = [
+    # Ints, floats and None share the amount columns, so pandas promotes them to float64
+    {'invoice_number': 'INV-1', 'subtotal': 100, 'tax_amount': 7.5, 'total_amount': 107.5,
+     'discount_amount': None, 'line_items': [
+         {'description': 'Widget', 'quantity': 2, 'unit_price': 50, 'total_price': 100, 'tax_rate': None},
+         {'description': 'Shipping', 'quantity': 1, 'unit_price': 7.5, 'total_price': 7.5},
+     ]},
+    # All-int column stays int; missing keys fall back to the defaults
+    {'invoice_number': 'INV-2', 'subtotal': 20, 'tax_amount': 0, 'total_amount': 20, 'line_items': []},
+    {'invoice_number': None, 'vendor_name': None, 'total_amount': None,
+     'line_items': [{'description': None, 'quantity': 3, 'unit_price': 1.25, 'total_price': 3.75, 'sku': None}]},
+]
+
+QUOTED = [
+    {'invoice_number': 'INV-"7"', 'vendor_name': 'Acme, Inc.', 'vendor_address': '1 Main St\nSpringfield',
+     'notes': 'Line one\r\nLine "two", with comma', 'total_amount': 12.0, 'currency': 'EUR',
+     'source_pages': '1-2', 'line_items': [
+         {'description': 'Bolt "M8", zinc\nbox of 100', 'quantity': 1.0, 'unit_price': 12.0, 'total_price': 12.0,
+          'unit': 'box', 'sku': 'B-8'},
+     ]},
+    {'invoice_number': '', 'vendor_name': ' leading space', 'notes': '', 'total_amount': 0.0, 'line_items': []},
+]
+
+@pytest.mark.parametrize('kind', ['detailed', 'summary'])
+@pytest.mark.parametrize('invoices', [MIXED, QUOTED, MIXED + QUOTED, []], ids=['mixed', 'quoted', 'both', 'empty'])
+def test_write_csv_matches_pandas(kind, invoices):
+    assert streamed_csv(kind, invoices) == pandas_csv(kind, invoices)
+
+@pytest.mark.parametrize('kind', ['detailed', 'summary'])
+def test_write_csv_matches_pandas_across_chunks(kind):
+    from bench_csv import synthetic_invoices
+
+    # Enough rows to span several writer chunks
+    invoices = synthetic_invoices(120, 6)
+    assert streamed_csv(kind, invoices) == pandas_csv(kind, invoices)
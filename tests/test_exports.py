@@ -0,0 +1,56 @@
+import os
+from exports import IncrementalExport, load_manifest, read_invoices
+
+def invoice(number, total=10.0):
+    return {'invoice_id': number, 'invoice_number': number, 'total_amount': total,
+            'line_items': [{'description': 'item', 'quantity': 1, 'unit_price': total, 'total_price': total}]}
+
+def test_add_appends_once_per_source(workdir):
+    export = IncrementalExport('job1', ['detailed', 'jsonl'])
+    assert export.add('0_a.pdf', [invoice('A1'), invoice('A2')])
+    assert not export.add('0_a.pdf', [invoice('A1')])
+    assert export.add('1_a.pdf', [invoice('B1')])
+
+    total, invoices = read_invoices('job1')
+    assert total == 3
+    assert [inv['invoice_id'] for inv in invoices] == ['A1', 'A2', 'B1']
+    assert read_invoices('job1', offset=1, limit=1)[1][0]['invoice_id'] == 'A2'
+    with open(export.manifest['outputs']['detailed']['path']) as f:
+        lines = f.read().splitlines()
+    # One header, then file numbers keep counting across appends
+    assert lines[0].startswith('file_number,')
+    assert [line.split(',')[0] for line in lines[1:]] == ['1', '2', '3']
+
+def test_reopening_truncates_a_torn_tail_and_resumes(workdir):
+    export = IncrementalExport('job2', ['summary', 'jsonl'])
+    export.add('0_a.pdf', [invoice('A1')])
+    committed = {kind: out['bytes'] for kind, out in export.manifest['outputs'].items()}
+    # A crash mid-append leaves bytes the manifest never recorded
+    for out in export.manifest['outputs'].values():
+        with open(out['path'], 'a') as f:
+            f.write('torn')
+
+    resumed = IncrementalExport('job2', ['summary', 'jsonl'])
+    for kind, out in resumed.manifest['outputs'].items():
+        assert os.path.getsize(out['path']) == committed[kind]
+    assert not resumed.add('0_a.pdf', [invoice('A1')])
+    assert resumed.add('1_b.pdf', [invoice('B1')])
+    assert [inv['invoice_id'] for inv in read_invoices('job2')[1]] == ['A1', 'B1']
+
+def test_readers_only_see_the_committed_prefix(workdir):
+    export = IncrementalExport('job3', ['jsonl'])
+    export.add('0_a.pdf', [invoice('A1')])
+    with open(export.manifest['outputs']['jsonl']['path'], 'ab') as f:
+        f.write(b'{"invoice_id": "uncommitted"}\n')
+    assert read_invoices('job3') == (1, [invoice('A1')])
+
+def test_finish_closes_the_export(workdir):
+    export = IncrementalExport('job4', ['detailed', 'jsonl'])
+    export.add('0_a.pdf', [invoice('A1')])
+    out = export.finish(success=True)
+    assert out['errors'] == []
+    assert {'detailed', 'jsonl', 'json'} <= set(out['temp_file_paths'])
+    with open(out['temp_file_paths']['json']) as f:
+        assert f.read().startswith('[{')
+    assert load_manifest('job4')['status'] == 'complete'
+    assert not export.add('1_b.pdf', [invoice('B1')])
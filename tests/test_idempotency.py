@@ -0,0 +1,35 @@
+import pytest
+from config import Config
+from idempotency import IdempotencyStore
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / 'idempotency.db'))
+
+def test_first_claim_owns_the_key(store):
+    assert store.claim('addr:1', 'k', 'fp', 'job1') is None
+    existing = store.claim('addr:1', 'k', 'fp', 'job2')
+    assert existing['job_id'] == 'job1'
+    assert existing['status'] == 'in_progress'
+    # Keys are per client
+    assert store.claim('addr:2', 'k', 'fp', 'job3') is None
+
+def test_completed_claim_carries_the_stored_response(store):
+    store.claim('addr:1', 'k', 'fp', 'job1')
+    store.complete('addr:1', 'k', 200, b'{"success": true}')
+    record = store.claim('addr:1', 'k', 'other-fp', 'job2')
+    assert record['status'] == 'complete'
+    assert record['response'] == b'{"success": true}'
+    # The caller compares fingerprints to refuse a different payload under the same key
+    assert record['fingerprint'] == 'fp'
+
+def test_released_key_can_be_claimed_again(store):
+    store.claim('addr:1', 'k', 'fp', 'job1')
+    store.release('addr:1', 'k')
+    assert store.claim('addr:1', 'k', 'fp', 'job2') is None
+
+def test_expired_key_can_be_claimed_again(store, monkeypatch):
+    monkeypatch.setattr(Config, 'IDEMPOTENCY_TTL', -1)
+    store.claim('addr:1', 'k', 'fp', 'job1')
+    assert store.get('addr:1', 'k') is None
+    assert store.claim('addr:1', 'k', 'fp', 'job2') is None
@@ -0,0 +1,67 @@
+from exports import read_invoices
+from job_journal import JobJournal, entry_id, get_state, resume_incomplete_jobs
+
+def start_job(job_id, uploads, options=None):
+    """Journal a job the way /upload does, saving each (filename, contents) upload first"""
+    journal = JobJournal(job_id)
+    journal.try_lock()
+    entries = []
+    for index, (filename, content) in enumerate(uploads):
+        key = entry_id(index, filename)
+        path = f'uploads/{job_id}_{key}'
+        with open(path, 'w') as f:
+            f.write(content)
+        entries.append({'id': key, 'filename': filename, 'file_path': path})
+    journal.start(options or {'llm_choice': 'Mistral', 'include_detailed_csv': True, 'errors': []}, entries)
+    return journal, entries
+
+def test_resume_skips_finished_files_and_picks_up_from_ocr(app_module, processed):
+    journal, entries = start_job('job1', [('a.pdf', 'first'), ('b.pdf', 'second'), ('c.pdf', 'third')])
+    done = [{'invoice_id': 'first', 'invoice_number': 'first', 'total_amount': 10.0, 'line_items': []}]
+    journal.file_stage(entries[0]['id'], 'extracted', invoices=done)
+    journal.file_stage(entries[1]['id'], 'ocr', md_pages=['page one'], preview_public_url=None)
+    # The process dies here: the lock goes with it
+    journal.close()
+
+    assert resume_incomplete_jobs(app_module.resume_journaled_job) == 1
+    # The extracted file is not processed again; the OCR'd one reuses its text
+    assert [(name, content) for name, content, _ in processed] == [('b.pdf', 'second'), ('c.pdf', 'third')]
+    assert processed[0][2]['ocr_state']['md_pages'] == ['page one']
+    assert processed[1][2]['ocr_state'] is None
+
+    state = get_state('job1')
+    assert state['completed'] and state['result']['success']
+    total, invoices = read_invoices('job1')
+    assert total == 3
+    assert [inv['invoice_id'] for inv in invoices] == ['first', 'second', 'third']
+    assert resume_incomplete_jobs(app_module.resume_journaled_job) == 0
+
+def test_resume_leaves_jobs_another_process_holds(app_module, processed):
+    journal, _ = start_job('job2', [('a.pdf', 'first')])
+    try:
+        assert resume_incomplete_jobs(app_module.resume_journaled_job) == 0
+        assert processed == []
+    finally:
+        journal.close()
+
+def test_same_filename_entries_are_tracked_separately(workdir):
+    journal, entries = start_job('job3', [('scan.pdf', 'first'), ('scan.pdf', 'second')])
+    journal.file_stage(entries[0]['id'], 'failed', error='bad scan')
+    journal.close()
+
+    state = get_state('job3')
+    assert state['order'] == ['0_scan.pdf', '1_scan.pdf']
+    assert state['files']['0_scan.pdf']['stage'] == 'failed'
+    assert state['files']['1_scan.pdf']['stage'] is None
+
+def test_torn_last_line_is_ignored(workdir):
+    journal, entries = start_job('job4', [('a.pdf', 'first')])
+    journal.close()
+    with open(journal.path, 'a') as f:
+        f.write('{"event": "file_stage", "file": "0_a.pdf", "sta')
+    assert get_state('job4')['files']['0_a.pdf']['stage'] is None
+    # The next record starts on its own line
+    journal = JobJournal('job4')
+    journal.file_stage(entries[0]['id'], 'failed', error='bad scan')
+    journal.close()
+    assert get_state('job4')['files']['0_a.pdf']['stage'] == 'failed'
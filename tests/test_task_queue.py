@@ -0,0 +1,61 @@
+import time
+import pytest
+from task_queue import RedisQueue
+
+fakeredis = pytest.importorskip('fakeredis')
+
+@pytest.fixture
+def queue():
+    return RedisQueue(fakeredis.FakeRedis(), prefix='test')
+
+def test_claim_hands_a_task_to_one_worker(queue):
+    queue.enqueue({'filename': 'a.pdf'}, task_id='t1')
+    reservation = queue.reserve(visibility_timeout=30)
+    assert reservation.task_id == 't1'
+    assert reservation.payload == {'filename': 'a.pdf'}
+    assert reservation.attempts == 1
+    assert queue.reserve(visibility_timeout=30) is None
+    assert queue.depth() == {'queued': 0, 'in_flight': 1}
+
+def test_expired_lease_is_requeued_and_redelivered(queue):
+    queue.enqueue({'filename': 'a.pdf'}, task_id='t1')
+    first = queue.reserve(visibility_timeout=0.05)
+    time.sleep(0.1)
+    second = queue.reserve(visibility_timeout=30)
+    assert second.task_id == 't1'
+    assert second.attempts == 2
+    # The expired holder can no longer extend or ack
+    assert not queue.extend(first)
+    assert not queue.ack(first)
+    assert queue.ack(second)
+    assert queue.depth() == {'queued': 0, 'in_flight': 0}
+
+def test_requeue_keeps_a_lease_taken_in_between(queue):
+    queue.enqueue({'filename': 'a.pdf'}, task_id='t1')
+    queue.reserve(visibility_timeout=0.05)
+    time.sleep(0.1)
+    expired = queue.r.zscore('test:inflight', 't1')
+    fresh = queue.reserve(visibility_timeout=30)
+    # A requeue that listed the old score must not touch the new lease
+    assert not queue._requeue('t1', expired)
+    assert queue.r.zscore('test:inflight', 't1') > time.time()
+    assert queue.r.zscore('test:ready', 't1') is None
+    assert queue.ack(fresh)
+
+def test_release_delays_redelivery(queue):
+    queue.enqueue({'filename': 'a.pdf'}, task_id='t1')
+    reservation = queue.reserve(visibility_timeout=30)
+    queue.release(reservation, delay=0.05)
+    assert queue.reserve(visibility_timeout=30) is None
+    time.sleep(0.1)
+    assert queue.reserve(visibility_timeout=30).attempts == 2
+
+def test_ack_removes_the_task_and_results_are_first_write_wins(queue):
+    queue.enqueue({'filename': 'a.pdf'}, task_id='t1')
+    reservation = queue.reserve(visibility_timeout=30)
+    assert queue.put_result('t1', {'ok': True})
+    assert not queue.put_result('t1', {'ok': False})
+    assert queue.ack(reservation)
+    assert queue.get_result('t1') == {'ok': True}
+    assert queue.reserve(visibility_timeout=30) is None
+    assert not queue.r.exists('test:task:t1')
@@ -0,0 +1,68 @@
+import io
+from admission import AdmissionController
+
+def upload(client, files, headers=None, **form):
+    data = {'include_detailed_csv': 'on', **form,
+            'files': [(io.BytesIO(content.encode()), name) for name, content in files]}
+    return client.post('/upload', data=data, headers=headers or {}, content_type='multipart/form-data')
+
+def test_same_named_files_are_all_processed(client, processed):
+    r = upload(client, [('scan.pdf', 'first'), ('scan.pdf', 'second')])
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body['success'], body
+    assert sorted(content for _, content, _ in processed) == ['first', 'second']
+    assert [inv['invoice_id'] for inv in body['invoices']] == ['first', 'second']
+    assert body['csv_files']['detailed'].count('\n') == 3
+
+def test_idempotent_retry_replays_the_first_response(client, processed):
+    headers = {'Idempotency-Key': 'retry-1'}
+    first = upload(client, [('a.pdf', 'first')], headers)
+    retry = upload(client, [('a.pdf', 'first')], headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert len(processed) == 1
+
+def test_idempotency_key_reused_for_a_different_upload(client, processed):
+    headers = {'Idempotency-Key': 'retry-2'}
+    assert upload(client, [('a.pdf', 'first')], headers).status_code == 200
+    r = upload(client, [('b.pdf', 'other contents')], headers)
+    assert r.status_code == 422
+    assert not r.get_json()['success']
+    assert len(processed) == 1
+
+def test_rejected_idempotent_request_can_be_retried(client, processed):
+    headers = {'Idempotency-Key': 'retry-3'}
+    r = client.post('/upload', data={}, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 400
+    # 4xx responses are not stored, so the corrected retry runs instead of replaying
+    r = upload(client, [('a.pdf', 'first')], headers)
+    assert r.status_code == 200
+    assert 'Idempotent-Replayed' not in r.headers
+    assert len(processed) == 1
+
+def test_client_over_its_share_gets_429(client, app_module, processed):
+    app_module.admission_controller = controller = AdmissionController(client_max_files=1)
+    ticket = controller.acquire('addr:127.0.0.1', 1, 100)
+    try:
+        r = upload(client, [('a.pdf', 'first')])
+    finally:
+        ticket.release()
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) >= 1
+    assert processed == []
+    assert controller.snapshot()['rejected'] == {'client_limit': 1}
+
+def test_busy_server_with_a_full_wait_queue_gets_503(client, app_module, processed):
+    app_module.admission_controller = controller = AdmissionController(max_files=1, max_waiting=0)
+    ticket = controller.acquire('addr:10.0.0.2', 1, 100)
+    try:
+        r = upload(client, [('a.pdf', 'first')])
+    finally:
+        ticket.release()
+    assert r.status_code == 503
+    assert 'Retry-After' in r.headers
+    assert processed == []
+    # Capacity is back once the other upload finishes
+    assert upload(client, [('a.pdf', 'first')]).status_code == 200
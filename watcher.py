@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from config import Config
+from ingest import OutputWriter, RateLimiter, ingest_file
+
+# Watch-folder daemon: scanners drop PDFs/images into a shared directory and
+# each one is processed as soon as it has finished being written.
+#   python watcher.py /srv/scans --output data/scans --workers 4
+# inotify (via the optional inotify_simple package) wakes the loop as soon as
+# a file is closed or moved in; without it, or on filesystems that do not
+# deliver inotify events (SMB/NFS mounts), the directory is polled. Either way
+# a file is only picked up once its size and mtime have stopped changing for
+# --settle seconds, so half-copied scans are never sent to OCR.
+
+logger = logging.getLogger('watcher')
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+def _signature(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+class FolderWatcher:
+    """Yields files in a directory once they are complete (size/mtime stable for `settle` seconds)"""
+
+    def __init__(self, directory: str, settle: float = 2.0, poll_interval: float = 2.0,
+                 rescan_interval: float = 60.0, use_inotify: bool = True):
+        self.directory = directory
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.pending: Dict[str, Tuple[tuple, float]] = {}  # path -> (signature, stable since)
+        self.dispatched: Dict[str, tuple] = {}  # path -> signature it was handed out with
+        self._inotify = None
+        if use_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+                self._inotify.add_watch(directory, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE)
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({e}); polling {directory}")
+                self._inotify = None
+        self._last_scan = float('-inf')
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify else 'polling'
+
+    @staticmethod
+    def _wanted(name: str) -> bool:
+        # Skip hidden/partial files some copy tools write before renaming into place
+        if name.startswith('.') or '.' not in name:
+            return False
+        return name.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+
+    def _note(self, path: str, now: float) -> None:
+        sig = _signature(path)
+        if sig is None:
+            self.pending.pop(path, None)
+            return
+        if self.dispatched.get(path) == sig:
+            return
+        prev = self.pending.get(path)
+        if prev is None or prev[0] != sig:
+            self.pending[path] = (sig, now)
+
+    def _scan(self, now: float) -> None:
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            logger.warning(f"Cannot list {self.directory}: {e}")
+            return
+        for name in names:
+            if self._wanted(name):
+                self._note(os.path.join(self.directory, name), now)
+        # Forget files that were removed or moved away after processing
+        for path in [p for p in self.dispatched if not os.path.exists(p)]:
+            del self.dispatched[path]
+        self._last_scan = now
+
+    def _wait_for_events(self, timeout: float) -> None:
+        if self._inotify is None:
+            time.sleep(timeout)
+            return
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            if event.name and self._wanted(event.name):
+                self._note(os.path.join(self.directory, event.name), time.monotonic())
+
+    def poll(self) -> List[str]:
+        """Wait briefly for changes, then return files that have settled"""
+        pending_wait = min((since + self.settle for _, since in self.pending.values()), default=None)
+        timeout = self.poll_interval
+        if pending_wait is not None:
+            timeout = max(0.05, min(timeout, pending_wait - time.monotonic()))
+        self._wait_for_events(timeout)
+        now = time.monotonic()
+        # inotify only needs an occasional safety rescan; polling mode rescans every round
+        if self._inotify is None or now - self._last_scan >= self.rescan_interval:
+            self._scan(now)
+        ready = []
+        for path, (sig, since) in list(self.pending.items()):
+            current = _signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != sig:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                self.dispatched[path] = sig
+                ready.append(path)
+        return ready
+
+def run_watch(directory: str, output: str, workers: int = 4, settle: float = 2.0, poll_interval: float = 2.0,
+              llm_choice: str = 'Mistral', rotate: str = None, rate: float = 0.0, file_deadline: float = None,
+              use_inotify: bool = True, stop: threading.Event = None) -> None:
+    stop = stop or threading.Event()
+    watcher = FolderWatcher(directory, settle, poll_interval, use_inotify=use_inotify)
+    writer = OutputWriter(output, rotate=rotate)
+    limiter = RateLimiter(rate)
+    file_deadline = file_deadline or Config.FILE_DEADLINE_SECONDS
+    preview_dir = os.path.join(output, 'previews')
+    os.makedirs(preview_dir, exist_ok=True)
+    in_progress, lock = set(), threading.Lock()
+    # Bound what is queued behind the workers; settled files wait in the watcher until a slot frees
+    slots = threading.BoundedSemaphore(workers * 2)
+    logger.info(f"Watching {directory} ({watcher.mode}) with {workers} workers, writing to {output}")
+
+    def run_one(path: str, queued_at: float):
+        try:
+            outcome = ingest_file(path, writer, limiter, in_progress, lock, llm_choice, file_deadline, preview_dir)
+            logger.info(f"{outcome}: {os.path.basename(path)} ({time.monotonic() - queued_at:.1f}s after it settled)")
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='watch') as pool:
+        backlog: List[str] = []
+        while not stop.is_set():
+            backlog.extend(watcher.poll())
+            while backlog and slots.acquire(blocking=False):
+                pool.submit(run_one, backlog.pop(0), time.monotonic())
+    logger.info("Watcher stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description='Process invoices dropped into a folder')
+    parser.add_argument('directory', help='Folder to watch')
+    parser.add_argument('--output', '-o', required=True, help='Output directory for JSONL/CSV results and the processed ledger')
+    parser.add_argument('--workers', '-w', type=int, default=4, help='Files processed in parallel')
+    parser.add_argument('--settle', type=float, default=2.0, help='Seconds a file must stay unchanged before it is processed')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between directory scans when polling')
+    parser.add_argument('--llm', default='Mistral', choices=['Mistral', 'OpenRouter', 'Auto'], help='Extraction provider')
+    parser.add_argument('--rotate', choices=['daily', 'none'], default='daily', help='Roll JSONL/CSV outputs over daily')
+    parser.add_argument('--rate', type=float, default=0.0, help='Max files started per second (0 = unlimited)')
+    parser.add_argument('--poll', action='store_true', help='Force polling even if inotify is available')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run_watch(args.directory, args.output, args.workers, args.settle, args.poll_interval, args.llm,
+              None if args.rotate == 'none' else args.rotate, args.rate, use_inotify=not args.poll, stop=stop)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+from config import Config
+from exports import IncrementalExport
+from pipeline import PREVIEW_DIR, BatchStats, DocumentError, process_file
+from preflight import PreflightRejected
+from deadlines import DeadlineExceeded, FileBudget, deadline_until, job_deadline
+from task_queue import get_queue
+
+# Worker entry point for distributed mode: pull per-file tasks from the queue,
+# run save -> OCR -> extract -> validate, and write the result back.
+# Whichever worker writes a job's last result enqueues the job's finalize task
+# (task id {job_id}-finalize, so it is queued once however many workers see
+# the job complete). That task streams each file's invoices into the job's
+# incremental exports, in upload order, and stores the job result that
+# /api/jobs/<id> serves; like any task it is redelivered if its worker dies.
+#   python worker.py --queue redis://queue-host:6379/0 --concurrency 8
+
+logger = logging.getLogger('worker')
+
+class Heartbeat:
+    """Keep extending a reservation's visibility while the task is still being worked on"""
+
+    def __init__(self, queue, reservation, interval: float):
+        self.queue = queue
+        self.reservation = reservation
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.extend(self.reservation):
+                logger.warning(f"Lost lease on task {self.reservation.task_id}")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+def handle_task(queue, reservation, preview_dir: str = PREVIEW_DIR) -> None:
+    payload = reservation.payload
+    task_id = reservation.task_id
+
+    if queue.get_result(task_id) is not None:
+        # Redelivered after the result was written but before the ack
+        queue.ack(reservation)
+        if payload.get('kind') != 'finalize':
+            finalize_when_done(queue, payload.get('job_id'))
+        return
+    if payload.get('kind') == 'finalize':
+        finalize_job(queue, payload['job_id'])
+        queue.put_result(task_id, {'ok': True})
+        queue.ack(reservation)
+        return
+    filename = payload['filename']
+
+    if 'deadline_at' in payload:
+        job = deadline_until(payload['deadline_at'])
+    else:
+        # Enqueued before tasks carried an absolute deadline
+        job = job_deadline(payload.get('deadline_seconds'))
+    if job.expired():
+        # Waited (or retried) past the job's deadline: never start it
+        queue.put_result(task_id, {'ok': False, 'timed_out': True,
+                                   'error': f"Skipped {filename}: job deadline exceeded"})
+        _remove_task_file(payload)
+        queue.ack(reservation)
+        finalize_when_done(queue, payload.get('job_id'))
+        return
+
+    with Heartbeat(queue, reservation, Config.TASK_VISIBILITY_TIMEOUT / 3):
+        budget = FileBudget(job)
+        try:
+            invoices = process_file(
+                payload['file_path'], filename, payload.get('llm_choice', 'Mistral'), budget,
+                confidence_threshold=payload.get('confidence_threshold'),
+                preview_dir=preview_dir,
+                job_id=payload.get('job_id'),
+            )
+            result = {'ok': True, 'invoices': invoices}
+        except DeadlineExceeded as e:
+            result = {'ok': False, 'timed_out': True, 'error': f"Timed out processing {filename}: {e}"}
+        except (DocumentError, PreflightRejected) as e:
+            # Bad document or invalid LLM output; retrying would only spend more.
+            # Provider timeouts, 5xx and connection errors fall through to the retry below.
+            result = {'ok': False, 'error': f"Error processing {filename}: {str(e)}"}
+        except Exception as e:
+            if reservation.attempts < Config.TASK_MAX_ATTEMPTS:
+                delay = 2 ** reservation.attempts
+                logger.warning(f"Task {task_id} failed (attempt {reservation.attempts}), retrying in {delay}s: {e}")
+                queue.release(reservation, delay=delay)
+                return
+            logger.exception(f"Task {task_id} failed permanently: {e}")
+            result = {'ok': False, 'error': f"Error processing {filename}: {str(e)}"}
+
+    queue.put_result(task_id, result)
+    _remove_task_file(payload)
+    queue.ack(reservation)
+    finalize_when_done(queue, payload.get('job_id'))
+
+def finalize_when_done(queue, job_id) -> None:
+    """Queue the job's finalize task once every file has a result"""
+    job = queue.get_job(job_id) if job_id else None
+    if job is None or 'result' in job:
+        return
+    if queue.count_results(job['task_ids']) < len(job['task_ids']):
+        return
+    queue.enqueue({'kind': 'finalize', 'job_id': job_id, 'tenant': job.get('tenant'),
+                   'priority': job.get('priority')}, task_id=f'{job_id}-finalize')
+
+def finalize_job(queue, job_id: str) -> None:
+    """Build a queued job's exports from its task results, one file at a time, and store its result"""
+    job = queue.get_job(job_id)
+    if job is None or 'result' in job:
+        return
+    kinds = [k for k in ('detailed', 'summary') if job.get(f'include_{k}_csv')] + ['jsonl']
+    # Resumable: a redelivered finalize skips the tasks its manifest already has
+    export = IncrementalExport(job_id, kinds, directory=Config.SHARED_EXPORT_FOLDER)
+    stats = BatchStats()
+    invoice_ids, errors, timeout_reasons = [], list(job.get('errors', [])), []
+    for task_id in job['task_ids']:
+        result = queue.get_result(task_id) or {'ok': False, 'error': f'No result for task {task_id}'}
+        if result.get('ok'):
+            invoices = result['invoices'] if 'invoices' in result else [result['invoice']]
+            stats.add(invoices)
+            invoice_ids.extend(inv.get('invoice_id') for inv in invoices)
+            export.add(task_id, invoices)
+        else:
+            errors.append(result.get('error', 'Unknown error'))
+            if result.get('timed_out'):
+                timeout_reasons.append(result.get('error'))
+    success = bool(stats.invoices)
+    exports = export.finish(success=success, errors=errors)
+    if success:
+        errors = errors + exports['errors']
+    else:
+        errors = errors or ['No invoices were successfully processed']
+    job['result'] = {
+        'success': success,
+        'total_invoices': stats.invoices,
+        'invoice_ids': invoice_ids,
+        'stats': stats.to_dict(),
+        'errors': errors,
+        'timed_out': bool(timeout_reasons),
+        'timeout_reasons': timeout_reasons,
+        'temp_file_paths': exports['temp_file_paths'] if success else {},
+    }
+    queue.put_job(job_id, job)
+    logger.info(f"Finalized job {job_id}: {stats.invoices} invoice(s) from {len(job['task_ids'])} file(s)")
+
+def _remove_task_file(payload) -> None:
+    try:
+        if os.path.exists(payload['file_path']):
+            os.remove(payload['file_path'])
+    except Exception as rm_err:
+        logger.warning(f"Failed to remove task file {payload['file_path']}: {rm_err}")
+
+def run_worker(queue_url: str = None, concurrency: int = 4, poll_interval: float = 1.0,
+               preview_dir: str = PREVIEW_DIR, stop: threading.Event = None) -> None:
+    queue = get_queue(queue_url)
+    stop = stop or threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            try:
+                reservation = queue.reserve()
+            except Exception as e:
+                logger.warning(f"Queue reserve failed: {e}")
+                stop.wait(poll_interval)
+                continue
+            if reservation is None:
+                stop.wait(poll_interval)
+                continue
+            try:
+                handle_task(queue, reservation, preview_dir)
+            except Exception as e:
+                # Leave the task to reappear after its visibility timeout
+                logger.exception(f"Unhandled error on task {reservation.task_id}: {e}")
+
+    threads = [threading.Thread(target=loop, name=f'worker-{i}', daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    logger.info(f"Worker started with {concurrency} threads on {queue_url or Config.TASK_QUEUE_URL}")
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description='Invoice processing worker')
+    parser.add_argument('--queue', default=Config.TASK_QUEUE_URL, help='Task queue URL (sqlite:///path or redis://...)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Tasks processed in parallel')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+    parser.add_argument('--preview-dir', default=PREVIEW_DIR, help='Where to write UI previews')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stop = threading.Event()
+    # Finish in-flight tasks on SIGTERM/SIGINT; unfinished ones reappear after their timeout
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run_worker(args.queue, args.concurrency, args.poll_interval, args.preview_dir, stop)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from typing import Any, Dict, Iterable, List
+from parquet_export import column_type, columns, typed_rows
+
+# Excel export of the detailed and summary tables, one sheet each, with real
+# number and date cells (typed from the models, like the Parquet export).
+# xlsxwriter's constant_memory mode flushes every finished row to a temp file,
+# so memory stays flat however many line items the batch has; rows therefore
+# have to be written strictly in order, which the single pass over the
+# invoices does for both sheets at once.
+# xlsxwriter is optional; without it the XLSX export is simply not offered.
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+MAX_ROWS = 1048576  # rows per Excel sheet, header included
+
+def available() -> bool:
+    return xlsxwriter is not None
+
+class XlsxExportWriter:
+    """A workbook with a 'Detailed' and/or 'Summary' sheet, written row by row"""
+
+    def __init__(self, path: str, kinds=('detailed', 'summary')):
+        self.path = path
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        self._bold = self.workbook.add_format({'bold': True})
+        self._date = self.workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        self._sheets: Dict[str, Any] = {}
+        self._rows: Dict[str, int] = {}
+        self._pages: Dict[str, int] = {}
+        self._types = {kind: [column_type(c) for c in columns(kind)] for kind in kinds}
+        for kind in kinds:
+            self._pages[kind] = 0
+            self._new_sheet(kind)
+        self.invoice_count = 0
+
+    def _new_sheet(self, kind: str) -> None:
+        # Sheets past Excel's row limit continue as "Detailed (2)", ...
+        self._pages[kind] += 1
+        name = kind.capitalize() if self._pages[kind] == 1 else f'{kind.capitalize()} ({self._pages[kind]})'
+        sheet = self.workbook.add_worksheet(name)
+        sheet.freeze_panes(1, 0)
+        for col, column in enumerate(columns(kind)):
+            if column_type(column) == 'date':
+                sheet.set_column(col, col, 11)
+            sheet.write_string(0, col, column, self._bold)
+        self._sheets[kind] = sheet
+        self._rows[kind] = 1
+
+    def add(self, invoices: List[Dict[str, Any]]) -> None:
+        """Append invoices; file_number continues from the invoices already written"""
+        for invoice in invoices:
+            self.invoice_count += 1
+            for kind in self._sheets:
+                for row in typed_rows(kind, invoice, self.invoice_count):
+                    self._write_row(kind, row)
+
+    def _write_row(self, kind: str, row: list) -> None:
+        if self._rows[kind] >= MAX_ROWS:
+            self._new_sheet(kind)
+        sheet, r = self._sheets[kind], self._rows[kind]
+        for col, (value, kind_of) in enumerate(zip(row, self._types[kind])):
+            if value is None or value == '':
+                continue
+            if kind_of == 'date':
+                sheet.write_datetime(r, col, value, self._date)
+            elif kind_of == 'str':
+                sheet.write_string(r, col, value)
+            else:
+                sheet.write_number(r, col, value)
+        self._rows[kind] = r + 1
+
+    def close(self) -> None:
+        self.workbook.close()
+
+    def __enter__(self) -> 'XlsxExportWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def write_xlsx(invoices: Iterable[Dict[str, Any]], path: str, kinds=('detailed', 'summary')) -> str:
+    """Write invoices (any iterable, consumed once) as an XLSX export"""
+    with XlsxExportWriter(path, kinds) as writer:
+        for invoice in invoices:
+            writer.add([invoice])
+    return path